@@ -1,28 +1,62 @@
 import os
-from flask import Flask, render_template, redirect, url_for, request, flash, send_file, jsonify, session
+from flask import Flask, Request, Response, render_template, redirect, url_for, request, flash, send_file, jsonify, session, abort, stream_with_context, g, has_request_context, has_app_context
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy import orm
+from sqlalchemy.dialects import postgresql, sqlite as sqlite_dialect
+from sqlalchemy.exc import OperationalError
+from datetime import datetime, timedelta, timezone
 import io
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.pagesizes import A4, mm
+import base64
+import hashlib
+import threading
+import queue
+import socket
+import time
+import zipfile
+import zlib
+import gzip
+from collections import Counter, OrderedDict
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor
+import sqlite3
 import json
 import csv
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException
 import logging
+import re
+import unicodedata
+import sys
 from functools import wraps
+import click
+from metrics import MetricsRegistry
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', '4ELMydzP8QszZd9yXG3U')
-app.config['TEMPLATES_AUTO_RELOAD'] = True
 
 # コンフィグ更新
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB
+# 大きなファイルを受け付けるエンドポイント（アップロードは一時ファイルに書き出され、ストリームで処理される）
+app.config['LARGE_UPLOAD_MAX_CONTENT_LENGTH'] = int(os.environ.get('LARGE_UPLOAD_MAX_CONTENT_LENGTH', 512 * 1024 * 1024))  # 512MB
+app.config['LARGE_UPLOAD_ENDPOINTS'] = {'import_items', 'restore_data'}
+app.config['IMPORT_CHUNK_SIZE'] = 1000
+
+class InventoryRequest(Request):
+    @property
+    def max_content_length(self):
+        if self.endpoint in app.config['LARGE_UPLOAD_ENDPOINTS']:
+            return app.config['LARGE_UPLOAD_MAX_CONTENT_LENGTH']
+        return super().max_content_length
+
+app.request_class = InventoryRequest
 
 # ログの設定
 is_production = os.environ.get('RENDER', False)
+# テンプレートの更新確認は開発環境だけ（本番は起動時にコンパイルしたものを使い続ける）
+app.config['TEMPLATES_AUTO_RELOAD'] = not is_production
 if is_production:
     # 本番環境ではファイルにログを出力
     logging.basicConfig(
@@ -61,9 +95,209 @@ else:
 if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgres://'):
     app.config['SQLALCHEMY_DATABASE_URI'] = app.config['SQLALCHEMY_DATABASE_URI'].replace('postgres://', 'postgresql://', 1)
 
+# SQLiteの同時実行設定（複数ワーカーから同じDBファイルに書き込むため）
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 10000))
+
 # データベースの初期化
 db = SQLAlchemy(app)
 
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    """SQLite接続ごとにWALモードとビジータイムアウトを設定する"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    # WALモードでは書き込み中も読み込みがブロックされない
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    # ロック取得待ちの上限（ミリ秒）
+    cursor.execute(f"PRAGMA busy_timeout={app.config['SQLITE_BUSY_TIMEOUT_MS']}")
+    cursor.close()
+    # 全文検索インデックスを同期するトリガーから使う正規化関数
+    dbapi_connection.create_function('search_normalize', 1, normalize_search_text, deterministic=True)
+
+# メトリクス（Prometheus形式、/metrics で取得）
+# gunicornの各ワーカーとジョブワーカーは METRICS_DIR に自分の値を書き出し、/metrics で合算する。
+# METRICS_DIR は gunicorn.conf.py が起動ごとに用意する（未設定なら自プロセスの値のみ）。
+# METRICS_TOKEN を設定すると Authorization: Bearer <トークン> で外部から取得できる（未設定ならローカルからのみ）。
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR')
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+metrics = MetricsRegistry(app.config['METRICS_DIR'])
+metrics.counter('inventory_http_requests_total', 'ルートごとのHTTPリクエスト数')
+metrics.histogram('inventory_http_request_duration_seconds', 'ルートごとのレスポンス時間（秒）')
+metrics.histogram('inventory_sql_statements_per_request', '1リクエスト（ジョブ）あたりのSQL文の数',
+                  buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+metrics.counter('inventory_sql_duration_seconds_total', 'ルートごとのSQLの実行時間の合計（秒）')
+metrics.histogram('inventory_pdf_render_seconds', '発注書PDF1件あたりの描画時間（秒）')
+metrics.counter('inventory_jobs_total', 'バックグラウンドジョブの実行数')
+metrics.histogram('inventory_job_duration_seconds', 'バックグラウンドジョブの実行時間（秒）')
+
+def start_metrics_scope(route):
+    """リクエストやジョブ単位でSQLの計測を始める"""
+    g.metrics_route = route
+    g.metrics_sql = [0, 0.0]
+    if app.config['SQL_PROFILE']:
+        g.sql_profile = []
+
+def record_sql_metrics():
+    """計測中のSQLの件数と時間を記録する"""
+    statements, seconds = g.metrics_sql
+    metrics.observe('inventory_sql_statements_per_request', statements, [('route', g.metrics_route)])
+    metrics.inc('inventory_sql_duration_seconds_total', [('route', g.metrics_route)], seconds)
+
+def record_pdf_render(seconds):
+    route = g.get('metrics_route', 'other') if has_app_context() else 'other'
+    metrics.observe('inventory_pdf_render_seconds', seconds, [('route', route)])
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_sql_timer(conn, cursor, statement, parameters, context, executemany):
+    # 1つの接続で文が入れ子に実行されることはないので、開始時刻は1つだけ持てばよい
+    # （失敗した文は after_cursor_execute が呼ばれないが、次の文で上書きされる）
+    conn.info['metrics_started'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_sql_timer(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('metrics_started')
+    if has_app_context() and 'metrics_sql' in g:
+        elapsed = time.perf_counter() - started
+        g.metrics_sql[0] += 1
+        g.metrics_sql[1] += elapsed
+        if 'sql_profile' in g:
+            profile_sql_statement(statement, elapsed)
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    start_metrics_scope(request.endpoint or 'unknown')
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_started' in g:
+        route = [('route', g.metrics_route)]
+        metrics.inc('inventory_http_requests_total', route + [('method', request.method), ('status', str(response.status_code))])
+        metrics.observe('inventory_http_request_duration_seconds', time.perf_counter() - g.request_started, route)
+        record_sql_metrics()
+    return response
+
+# SQLプロファイラ（SQL_PROFILE=1 のときだけ有効）
+# リクエスト（ジョブ）ごとに全SQLの時間と呼び出し元を記録し、同じ形のSQLが繰り返される
+# N+1の疑いと、SQL_PROFILE_SLOW_MS ミリ秒を超えた遅いSQLを SQL_PROFILE_LOG に書き出す。
+# 結果は X-SQL-Profile ヘッダーと、HTMLページ右下のパネルに表示する。
+app.config['SQL_PROFILE'] = os.environ.get('SQL_PROFILE', '0') == '1'
+app.config['SQL_PROFILE_SLOW_MS'] = float(os.environ.get('SQL_PROFILE_SLOW_MS', 100))
+app.config['SQL_PROFILE_REPEAT_THRESHOLD'] = int(os.environ.get('SQL_PROFILE_REPEAT_THRESHOLD', 5))
+app.config['SQL_PROFILE_LOG'] = os.environ.get('SQL_PROFILE_LOG', os.path.join(os.path.dirname(db_file), 'sql_profile.log'))
+
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+sql_profile_logger = logging.getLogger('inventory.sql_profile')
+if app.config['SQL_PROFILE']:
+    sql_profile_handler = logging.FileHandler(app.config['SQL_PROFILE_LOG'], encoding='utf-8')
+    sql_profile_handler.setFormatter(logging.Formatter('%(asctime)s [%(process)d] %(message)s', '%Y-%m-%d %H:%M:%S'))
+    sql_profile_logger.addHandler(sql_profile_handler)
+    sql_profile_logger.setLevel(logging.INFO)
+    sql_profile_logger.propagate = False
+
+def sql_call_site():
+    """SQLを発行したアプリ側の呼び出し元（ファイル名:行番号 関数名）を返す
+
+    テンプレート内の遅延読み込みはテンプレートの行番号で返す。
+    """
+    frame = sys._getframe(3)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(APP_ROOT) and 'site-packages' not in filename:
+            template = frame.f_globals.get('__jinja_template__')
+            if template is not None:
+                return f"{os.path.relpath(filename, APP_ROOT)}:{template.get_corresponding_lineno(frame.f_lineno)}"
+            return f"{os.path.relpath(filename, APP_ROOT)}:{frame.f_lineno} {frame.f_code.co_name}"
+        frame = frame.f_back
+    return 'unknown'
+
+def sql_shape(statement):
+    """パラメータの数や値の違いを無視したSQLの形"""
+    shape = re.sub(r'%\(\w+\)s', '?', statement)
+    shape = re.sub(r"'(?:[^']|'')*'", '?', shape)
+    shape = re.sub(r'\b\d+\b', '?', shape)
+    shape = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(?)', shape)
+    shape = re.sub(r'\(\?\)(?:\s*,\s*\(\?\))+', '(?)', shape)
+    return ' '.join(shape.split())
+
+def profile_sql_statement(statement, elapsed):
+    site = sql_call_site()
+    g.sql_profile.append((statement, elapsed, site))
+    if elapsed * 1000 >= app.config['SQL_PROFILE_SLOW_MS']:
+        sql_profile_logger.info(
+            f"遅いSQL {elapsed * 1000:.1f}ms route={g.metrics_route} site={site} sql={' '.join(statement.split())}"
+        )
+
+def sql_profile_summary():
+    """記録したSQLを集計し、件数・合計時間・N+1の疑い・遅いSQLを返す"""
+    shapes = {}
+    for statement, elapsed, site in g.sql_profile:
+        stats = shapes.setdefault(sql_shape(statement), {'count': 0, 'seconds': 0.0, 'sites': Counter()})
+        stats['count'] += 1
+        stats['seconds'] += elapsed
+        stats['sites'][site] += 1
+    suspects = [
+        {'sql': shape, 'count': stats['count'], 'ms': stats['seconds'] * 1000, 'sites': stats['sites'].most_common(3)}
+        for shape, stats in shapes.items() if stats['count'] >= app.config['SQL_PROFILE_REPEAT_THRESHOLD']
+    ]
+    suspects.sort(key=lambda suspect: suspect['count'], reverse=True)
+    slow = [
+        {'sql': ' '.join(statement.split()), 'ms': elapsed * 1000, 'site': site}
+        for statement, elapsed, site in g.sql_profile if elapsed * 1000 >= app.config['SQL_PROFILE_SLOW_MS']
+    ]
+    return {
+        'route': g.metrics_route,
+        'count': len(g.sql_profile),
+        'ms': sum(elapsed for _, elapsed, _ in g.sql_profile) * 1000,
+        'suspects': suspects,
+        'slow': slow,
+    }
+
+def log_sql_profile(summary):
+    for suspect in summary['suspects']:
+        sites = ', '.join(f'{site} x{count}' for site, count in suspect['sites'])
+        sql_profile_logger.info(
+            f"N+1の疑い {suspect['count']}回 {suspect['ms']:.1f}ms route={summary['route']} sites={sites} sql={suspect['sql']}"
+        )
+
+@app.after_request
+def attach_sql_profile(response):
+    if 'sql_profile' not in g:
+        return response
+    summary = sql_profile_summary()
+    log_sql_profile(summary)
+    response.headers['X-SQL-Profile'] = (
+        f"queries={summary['count']}; time={summary['ms']:.1f}ms; n+1={len(summary['suspects'])}; slow={len(summary['slow'])}"
+    )
+    # HTMLページには集計パネルを差し込む
+    if response.mimetype == 'text/html' and not response.direct_passthrough:
+        body = response.get_data(as_text=True)
+        if '</body>' in body:
+            panel = render_template('sql_profile.html', profile=summary)
+            response.set_data(body.replace('</body>', panel + '</body>', 1))
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    token = app.config['METRICS_TOKEN']
+    if token:
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            abort(403)
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(403)
+    # ジョブの滞留状況はその場でDBから数える
+    job_counts = dict(db.session.execute(db.select(Job.status, db.func.count()).group_by(Job.status)).all())
+    lines = ['# HELP inventory_jobs 状態ごとのバックグラウンドジョブ数', '# TYPE inventory_jobs gauge']
+    lines += [f'inventory_jobs{{status="{status}"}} {job_counts.get(status, 0)}' for status in ('queued', 'running', 'done', 'failed')]
+    if STARTUP_TIMES:
+        lines += ['# HELP inventory_startup_seconds 起動処理の段階ごとの所要時間（秒）', '# TYPE inventory_startup_seconds gauge']
+        lines += [f'inventory_startup_seconds{{phase="{phase}"}} {seconds:.6f}' for phase, seconds in STARTUP_TIMES.items()]
+    return Response(metrics.render(lines), mimetype='text/plain; version=0.0.4')
+
 # テンプレートにグローバル変数を追加
 @app.context_processor
 def inject_now():
@@ -82,6 +316,11 @@ class Item(db.Model):
     current_stock = db.Column(db.Integer, default=0)  # 現在の在庫数
     supplier_id = db.Column(db.Integer, db.ForeignKey('supplier.id'), nullable=True)
     
+    __table_args__ = (
+        db.Index('ix_item_supplier_id', 'supplier_id'),
+        db.Index('ix_item_name', 'name'),
+    )
+    
     def __repr__(self):
         return f'<Item {self.name}>'
 
@@ -93,6 +332,10 @@ class Supplier(db.Model):
     email = db.Column(db.String(100), nullable=True)
     items = db.relationship('Item', backref='supplier', lazy=True)
     
+    __table_args__ = (
+        db.Index('ix_supplier_name', 'name'),
+    )
+    
     def __repr__(self):
         return f'<Supplier {self.name}>'
 
@@ -104,6 +347,10 @@ class Patient(db.Model):
     phone = db.Column(db.String(20), nullable=True)
     sets = db.relationship('PatientSet', backref='patient', lazy=True)
     
+    __table_args__ = (
+        db.Index('ix_patient_name', 'name'),
+    )
+    
     def __repr__(self):
         return f'<Patient {self.name}>'
 
@@ -112,6 +359,10 @@ class PatientSet(db.Model):
     name = db.Column(db.String(100), nullable=False)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
     
+    __table_args__ = (
+        db.Index('ix_patient_set_patient_id', 'patient_id'),
+    )
+    
     def __repr__(self):
         return f'<PatientSet {self.name}>'
 
@@ -134,6 +385,12 @@ class SetItem(db.Model):
     item_set = db.relationship('ItemSet', backref='set_items', foreign_keys=[item_set_id])
     item = db.relationship('Item', backref='set_items')
     
+    __table_args__ = (
+        db.Index('ix_set_item_patient_set_id', 'patient_set_id'),
+        db.Index('ix_set_item_item_set_id', 'item_set_id'),
+        db.Index('ix_set_item_item_id', 'item_id'),
+    )
+    
     def __repr__(self):
         return f'<SetItem {self.id}>'
 
@@ -146,6 +403,13 @@ class Usage(db.Model):
     item = db.relationship('Item', backref='usages')
     patient = db.relationship('Patient', backref='usages')
     
+    __table_args__ = (
+        # 月次レポートの期間集計用（使用量まで含めてインデックスだけで集計できる）
+        db.Index('ix_usage_usage_date', 'usage_date', 'item_id', 'quantity'),
+        db.Index('ix_usage_item_id_usage_date', 'item_id', 'usage_date'),
+        db.Index('ix_usage_patient_id', 'patient_id'),
+    )
+    
     def __repr__(self):
         return f'<Usage {self.id}>'
 
@@ -157,6 +421,13 @@ class Order(db.Model):
     supplier = db.relationship('Supplier', backref='orders')
     items = db.relationship('OrderItem', backref='order', lazy=True)
     
+    __table_args__ = (
+        # 発注先ごとの未処理発注の検索用
+        db.Index('ix_order_supplier_id_status_order_date', 'supplier_id', 'status', 'order_date'),
+        db.Index('ix_order_order_date', 'order_date'),
+        db.Index('ix_order_status_order_date', 'status', 'order_date'),
+    )
+    
     def __repr__(self):
         return f'<Order {self.id}>'
 
@@ -167,6 +438,12 @@ class OrderItem(db.Model):
     quantity = db.Column(db.Integer, nullable=False)
     item = db.relationship('Item', backref='order_items')
     
+    __table_args__ = (
+        # 1つの発注に同じ備品の明細は1行のみ
+        db.Index('ux_order_item_order_id_item_id', 'order_id', 'item_id', unique=True),
+        db.Index('ix_order_item_item_id', 'item_id'),
+    )
+    
     def __repr__(self):
         return f'<OrderItem {self.id}>'
 
@@ -184,6 +461,864 @@ class ClinicInfo(db.Model):
     def __repr__(self):
         return f'<ClinicInfo {self.name}>'
 
+# 日別集計モデル（月次・四半期・年次レポート用）
+class UsageDailyRollup(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        # 需要予測のキャッシュが期間内の合計を確認する（テーブルを読まずに済むようにする）
+        db.Index('ix_usage_daily_rollup_day_quantity', 'day', 'quantity'),
+    )
+    
+    def __repr__(self):
+        return f'<UsageDailyRollup {self.day} {self.item_id}>'
+
+class OrderDailyRollup(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<OrderDailyRollup {self.day} {self.item_id}>'
+
+# バックグラウンドジョブ（PDF一括作成・インポート・復元・レポート出力）
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    params = db.Column(db.Text)  # JSON
+    result = db.Column(db.Text)  # JSON
+    error = db.Column(db.Text)
+    result_file = db.Column(db.String(255))
+    result_name = db.Column(db.String(255))
+    result_mimetype = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        # ワーカーが次の待機中ジョブを探す
+        db.Index('ix_job_status_id', 'status', 'id'),
+    )
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
+
+# 使用記録APIの冪等キー（クライアントの再送で二重に登録しないため）
+class UsageSyncKey(db.Model):
+    key = db.Column(db.String(100), primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # 保持期間を過ぎたキーの削除用
+        db.Index('ix_usage_sync_key_received_at', 'received_at'),
+    )
+    
+    def __repr__(self):
+        return f'<UsageSyncKey {self.key}>'
+
+# 変更履歴（同期クライアント向けの変更フィード。DBのトリガーで記録する）
+class ChangeLog(db.Model):
+    seq = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # upsert, delete
+    changed_at = db.Column(db.DateTime, nullable=False, server_default=db.func.current_timestamp())
+    
+    __table_args__ = (
+        db.Index('ix_change_log_table_name_row_id', 'table_name', 'row_id', 'seq'),
+        # 削除後に番号が再利用されないようにする
+        {'sqlite_autoincrement': True},
+    )
+    
+    def __repr__(self):
+        return f'<ChangeLog {self.seq} {self.table_name} {self.row_id} {self.op}>'
+
+# 参照データのバージョン（書き込みのたびに加算し、各ワーカーのキャッシュが最新か確認する）
+class DataVersion(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DataVersion {self.name} {self.version}>'
+
+# backref で追加される属性（Item.supplier など）をクラスから参照できるよう、最初のクエリを待たずにここで設定する
+orm.configure_mappers()
+
+def dialect_insert(table):
+    """ON CONFLICT 句が使えるDBごとのINSERT文を返す"""
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(table)
+    return sqlite_dialect.insert(table)
+
+def day_of(column):
+    """日時の列を日付に変換するSQL式"""
+    if db.engine.dialect.name == 'sqlite':
+        return db.func.date(column)
+    return db.cast(column, db.Date)
+
+def days_since(column, start_day):
+    """日付の列が start_day から何日後かを整数で返すSQL式"""
+    if db.engine.dialect.name == 'sqlite':
+        return db.cast(db.func.julianday(column) - db.func.julianday(start_day.isoformat()), db.Integer)
+    return column - start_day
+
+def add_to_rollup(model, entries):
+    """日別集計に (日付, 備品ID, 数量) を加算する。呼び出し元と同じトランザクションで実行される"""
+    totals = {}
+    for day, item_id, quantity in entries:
+        totals[(day, item_id)] = totals.get((day, item_id), 0) + quantity
+    if not totals:
+        return
+    stmt = dialect_insert(model.__table__)
+    db.session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=['day', 'item_id'],
+            set_={'quantity': model.__table__.c.quantity + stmt.excluded.quantity}
+        ),
+        [{'day': day, 'item_id': item_id, 'quantity': quantity} for (day, item_id), quantity in totals.items()]
+    )
+
+def rebuild_rollups():
+    """使用記録・発注明細から日別集計を作り直す。(使用量の行数, 発注量の行数) を返す"""
+    db.session.execute(db.delete(UsageDailyRollup))
+    db.session.execute(db.delete(OrderDailyRollup))
+
+    usage_day = day_of(Usage.usage_date)
+    db.session.execute(
+        db.insert(UsageDailyRollup.__table__).from_select(
+            ['day', 'item_id', 'quantity'],
+            db.select(usage_day, Usage.item_id, db.func.sum(Usage.quantity))
+            .group_by(usage_day, Usage.item_id)
+        )
+    )
+    order_day = day_of(Order.order_date)
+    db.session.execute(
+        db.insert(OrderDailyRollup.__table__).from_select(
+            ['day', 'item_id', 'quantity'],
+            db.select(order_day, OrderItem.item_id, db.func.sum(OrderItem.quantity))
+            .join(Order, Order.id == OrderItem.order_id)
+            .group_by(order_day, OrderItem.item_id)
+        )
+    )
+    db.session.commit()
+    return (
+        db.session.scalar(db.select(db.func.count()).select_from(UsageDailyRollup)),
+        db.session.scalar(db.select(db.func.count()).select_from(OrderDailyRollup))
+    )
+
+# 参照データのキャッシュ
+# 発注先・汎用セット・クリニック情報などのフォーム用データはワーカーごとにキャッシュし、
+# DBに保存したバージョン番号が変わったときだけ読み直す。
+# バージョンはキャッシュが読むテーブルだけ記録する（使用登録など頻繁な書き込みで加算しないため）。
+DATA_VERSION_TABLES = {
+    'supplier': 'suppliers',
+    'clinic_info': 'clinic',
+    'item_set': 'sets',
+}
+
+def track_data_change(session, name):
+    if name:
+        session.info.setdefault('changed_data', set()).add(name)
+
+@event.listens_for(orm.Session, 'do_orm_execute')
+def track_bulk_writes(orm_execute_state):
+    """一括のINSERT/UPDATE/DELETEで変更された参照データを記録する"""
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = orm_execute_state.statement.table
+    track_data_change(orm_execute_state.session, DATA_VERSION_TABLES.get(table.name))
+
+@event.listens_for(orm.Session, 'after_flush')
+def track_flushed_changes(session, flush_context):
+    """ORMで追加・変更・削除された参照データを記録する"""
+    for obj in session.new | session.deleted:
+        track_data_change(session, DATA_VERSION_TABLES.get(obj.__table__.name))
+    for obj in session.dirty:
+        name = DATA_VERSION_TABLES.get(obj.__table__.name)
+        if name and session.is_modified(obj):
+            track_data_change(session, name)
+
+@event.listens_for(orm.Session, 'before_commit')
+def bump_data_versions(session):
+    """変更があった参照データのバージョンを同じトランザクションで加算する"""
+    session.flush()
+    changed = session.info.pop('changed_data', None)
+    if not changed:
+        return
+    stmt = dialect_insert(DataVersion.__table__)
+    session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=['name'],
+            set_={'version': DataVersion.__table__.c.version + 1}
+        ),
+        [{'name': name, 'version': 1} for name in sorted(changed)]
+    )
+
+@event.listens_for(orm.Session, 'after_rollback')
+def discard_data_changes(session):
+    session.info.pop('changed_data', None)
+
+def data_versions():
+    """参照データのバージョンを返す（リクエスト中は1回だけ問い合わせる）"""
+    if has_request_context() and 'data_versions' in g:
+        return g.data_versions
+    versions = dict(db.session.execute(db.select(DataVersion.name, DataVersion.version)).all())
+    if has_request_context():
+        g.data_versions = versions
+    return versions
+
+def row_snapshots(model, order_by=None):
+    """テーブルの全行を列の値だけを持つ軽量なオブジェクトとして読み込む"""
+    table = model.__table__
+    stmt = db.select(table).order_by(order_by if order_by is not None else table.c.id)
+    return [SimpleNamespace(**row._mapping) for row in db.session.execute(stmt)]
+
+class ReferenceCache:
+    """参照データのプロセス内キャッシュ。エントリはバージョン番号と一緒に保持する"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, name, loader, version_names=None):
+        """version_names のバージョンが変わっていなければキャッシュを、変わっていれば loader() の結果を返す"""
+        versions = data_versions()
+        version = tuple(versions.get(v, 0) for v in (version_names or (name,)))
+        entry = self.entries.get(name)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        # バージョンを読んだ後にデータを読むため、キャッシュが古いバージョンより古くなることはない
+        value = loader()
+        with self.lock:
+            self.entries[name] = (version, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+reference_cache = ReferenceCache()
+
+def reference_suppliers(order_by_name=False):
+    suppliers = reference_cache.get('suppliers', lambda: row_snapshots(Supplier))
+    return sorted(suppliers, key=lambda s: s.name) if order_by_name else suppliers
+
+def reference_item_sets():
+    return reference_cache.get('item_sets', lambda: row_snapshots(ItemSet), ('sets',))
+
+def reference_clinic():
+    """クリニック情報（未登録なら None）"""
+    def load():
+        clinics = row_snapshots(ClinicInfo)
+        return clinics[0] if clinics else None
+    return reference_cache.get('clinic', load)
+
+# スキーマのマイグレーション
+def merge_duplicate_order_items():
+    """同じ発注・同じ備品の明細を1行にまとめる（ユニークインデックス作成前に必要）"""
+    duplicates = db.session.execute(
+        db.select(
+            OrderItem.order_id,
+            OrderItem.item_id,
+            db.func.min(OrderItem.id).label('keep_id'),
+            db.func.sum(OrderItem.quantity).label('total_quantity')
+        ).group_by(OrderItem.order_id, OrderItem.item_id).having(db.func.count(OrderItem.id) > 1)
+    ).all()
+    for row in duplicates:
+        db.session.execute(
+            db.update(OrderItem.__table__).where(OrderItem.id == row.keep_id).values(quantity=row.total_quantity)
+        )
+        db.session.execute(
+            db.delete(OrderItem.__table__).where(
+                OrderItem.order_id == row.order_id,
+                OrderItem.item_id == row.item_id,
+                OrderItem.id != row.keep_id
+            )
+        )
+    db.session.commit()
+    return len(duplicates)
+
+def install_change_triggers():
+    """変更フィードの対象テーブルに、書き込みを change_log に記録するトリガーを作成する
+
+    ORM・一括UPDATE・直接のSQLのどれで書き込んでも記録される。初めて作成したときは
+    既存の行をすべて記録しておき、since=0 から同期すれば全件が得られるようにする。
+    作成したトリガー名を返す。
+    """
+    dialect = db.engine.dialect.name
+    created = []
+    with db.engine.begin() as conn:
+        if dialect == 'postgresql':
+            existing = set(conn.scalars(db.text("SELECT tgname FROM pg_trigger WHERE NOT tgisinternal")))
+            conn.execute(db.text("""
+                CREATE OR REPLACE FUNCTION record_change() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP = 'DELETE' THEN
+                        INSERT INTO change_log (table_name, row_id, op) VALUES (TG_TABLE_NAME, OLD.id, 'delete');
+                        RETURN OLD;
+                    END IF;
+                    INSERT INTO change_log (table_name, row_id, op) VALUES (TG_TABLE_NAME, NEW.id, 'upsert');
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql
+            """))
+        else:
+            existing = set(conn.scalars(db.text("SELECT name FROM sqlite_master WHERE type = 'trigger'")))
+
+        for table_name in CHANGE_FEED_TABLES:
+            names = [f'trg_{table_name}_change_{op}' for op in ('insert', 'update', 'delete')]
+            if dialect == 'postgresql':
+                names = names[:1]
+            if all(name in existing for name in names):
+                continue
+            if dialect == 'postgresql':
+                conn.execute(db.text(
+                    f"CREATE TRIGGER {names[0]} AFTER INSERT OR UPDATE OR DELETE ON {table_name} "
+                    f"FOR EACH ROW EXECUTE FUNCTION record_change()"
+                ))
+            else:
+                for name, event_name, row, op in zip(names, ('INSERT', 'UPDATE', 'DELETE'), ('NEW', 'NEW', 'OLD'), ('upsert', 'upsert', 'delete')):
+                    conn.execute(db.text(
+                        f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event_name} ON {table_name} BEGIN "
+                        f"INSERT INTO change_log (table_name, row_id, op) VALUES ('{table_name}', {row}.id, '{op}'); END"
+                    ))
+            # 既存の行を記録する
+            conn.execute(db.text(
+                f"INSERT INTO change_log (table_name, row_id, op) SELECT '{table_name}', id, 'upsert' FROM {table_name} ORDER BY id"
+            ))
+            created.extend(names)
+    return created
+
+def compact_change_log():
+    """同じ行の古い変更履歴を削除し、行ごとに最新の1件だけを残す（削除の記録も残る）"""
+    latest = db.select(db.func.max(ChangeLog.seq)).group_by(ChangeLog.table_name, ChangeLog.row_id)
+    deleted = db.session.execute(db.delete(ChangeLog.__table__).where(ChangeLog.seq.not_in(latest))).rowcount
+    db.session.commit()
+    return deleted
+
+# 全文検索（備品名・患者名・患者ID）
+# SQLite では正規化した文字列を <インデックス名>_content テーブルに持ち、それを外部コンテンツとする
+# FTS5 の trigram インデックスを作る。どちらも元のテーブルのトリガーで同期する。インデックスにも
+# 検索語にも search_normalize を適用し、全角・半角、カタカナ・ひらがな、大文字・小文字を区別しない。
+SEARCH_TABLES = {
+    # インデックス名 -> (元のテーブル, 索引する列)
+    'item_search': ('item', ('name',)),
+    'patient_search': ('patient', ('name', 'patient_id')),
+}
+SEARCH_LIMIT_MAX = 50
+# 一致した行のうち並べ替えの対象にする件数（これより多く一致する語は最初の分だけを順位付けする）
+SEARCH_CANDIDATES = 1000
+
+KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+def normalize_search_text(text):
+    """検索用の正規化（NFKC で全角英数字・半角カナを揃え、小文字・ひらがなにする）"""
+    if text is None:
+        return ''
+    return unicodedata.normalize('NFKC', text).lower().translate(KATAKANA_TO_HIRAGANA)
+
+def install_search_index():
+    """全文検索のインデックスと同期用のトリガーを作成する（SQLiteのみ）
+
+    トリガーを作成したとき（初回やテーブルを作り直した後）は、インデックスの内容を
+    元のテーブルから作り直す。作成したトリガー名を返す。
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return []
+    created = []
+    with db.engine.begin() as conn:
+        existing = set(conn.scalars(db.text("SELECT name FROM sqlite_master WHERE type = 'trigger'")))
+        for index_name, (table_name, columns) in SEARCH_TABLES.items():
+            names = [f'trg_{table_name}_search_{op}' for op in ('insert', 'update', 'delete')]
+            if all(name in existing for name in names):
+                continue
+            content = f'{index_name}_content'
+            column_list = ', '.join(columns)
+            normalized = ', '.join(f'search_normalize(NEW.{column})' for column in columns)
+            # 外部コンテンツの FTS5 は、内容を変える前に古い内容で 'delete' を実行する必要がある
+            remove_old = (f"INSERT INTO {index_name} ({index_name}, rowid, {column_list}) "
+                          f"SELECT 'delete', id, {column_list} FROM {content} WHERE id = OLD.id; "
+                          f"DELETE FROM {content} WHERE id = OLD.id; ")
+            add_new = (f"INSERT INTO {content} (id, {column_list}) VALUES (NEW.id, {normalized}); "
+                       f"INSERT INTO {index_name} (rowid, {column_list}) VALUES (NEW.id, {normalized}); ")
+
+            conn.execute(db.text(
+                f"CREATE TABLE IF NOT EXISTS {content} (id INTEGER PRIMARY KEY, "
+                + ', '.join(f'{column} TEXT' for column in columns) + ")"
+            ))
+            conn.execute(db.text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {index_name} USING fts5("
+                f"{column_list}, content='{content}', content_rowid='id', tokenize='trigram')"
+            ))
+            conn.execute(db.text(
+                f"CREATE TRIGGER IF NOT EXISTS {names[0]} AFTER INSERT ON {table_name} BEGIN {add_new}END"
+            ))
+            conn.execute(db.text(
+                f"CREATE TRIGGER IF NOT EXISTS {names[1]} AFTER UPDATE OF {column_list} ON {table_name} "
+                f"BEGIN {remove_old}{add_new}END"
+            ))
+            conn.execute(db.text(
+                f"CREATE TRIGGER IF NOT EXISTS {names[2]} AFTER DELETE ON {table_name} BEGIN {remove_old}END"
+            ))
+            conn.execute(db.text(f"DELETE FROM {content}"))
+            conn.execute(db.text(
+                f"INSERT INTO {content} (id, {column_list}) SELECT id, "
+                + ', '.join(f'search_normalize({column})' for column in columns) + f" FROM {table_name}"
+            ))
+            conn.execute(db.text(f"INSERT INTO {index_name} ({index_name}) VALUES ('rebuild')"))
+            created.extend(names)
+    return created
+
+def like_pattern(term):
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def search_ids(index_name, query, limit):
+    """検索語に一致する行のIDを関連度順に返す
+
+    空白で区切った語をすべて含む行が一致する。3文字以上の語は trigram インデックスで照合し、
+    3文字未満の語は部分一致で絞り込む（3文字未満の語だけなら正規化済みのテーブルを走査する）。
+    一致した行のうち SEARCH_CANDIDATES 件を、名前が検索語で始まる行、bm25 の順位、名前の短い順に並べる。
+    SQLite 以外では元のテーブルを部分一致で検索する（正規化は行わない）。
+    """
+    table_name, columns = SEARCH_TABLES[index_name]
+    terms = normalize_search_text(query).split()
+    if not terms:
+        return []
+    if db.engine.dialect.name != 'sqlite':
+        table = db.metadata.tables[table_name]
+        stmt = db.select(table.c.id).where(*[
+            db.or_(*[table.c[column].ilike(like_pattern(term)) for column in columns]) for term in terms
+        ]).order_by(db.func.length(table.c[columns[0]]), table.c.id).limit(limit)
+        return db.session.scalars(stmt).all()
+
+    conditions = []
+    params = {'prefix': like_pattern(terms[0])[1:], 'candidates': SEARCH_CANDIDATES, 'limit': limit}
+    long_terms = [term for term in terms if len(term) >= 3]
+    for n, term in enumerate(term for term in terms if len(term) < 3):
+        params[f'term{n}'] = like_pattern(term)
+        conditions.append('(' + ' OR '.join(f"{column} LIKE :term{n} ESCAPE '\\'" for column in columns) + ')')
+    if long_terms:
+        params['match'] = ' '.join('"' + term.replace('"', '""') + '"' for term in long_terms)
+        candidates = (f"SELECT rowid AS id, {columns[0]}, rank FROM {index_name} "
+                      f"WHERE {' AND '.join([f'{index_name} MATCH :match'] + conditions)}")
+    else:
+        candidates = f"SELECT id, {columns[0]} FROM {index_name}_content WHERE {' AND '.join(conditions)}"
+    order = [f"{columns[0]} LIKE :prefix ESCAPE '\\' DESC"] + (['rank'] if long_terms else []) + \
+        [f"length({columns[0]})", 'id']
+    return db.session.scalars(db.text(
+        f"SELECT id FROM ({candidates} LIMIT :candidates) ORDER BY {', '.join(order)} LIMIT :limit"
+    ), params).all()
+
+def apply_schema_migrations():
+    """既存のDBに不足しているインデックス・トリガーを追加する
+
+    db.create_all() は既存テーブルを変更しないため、デプロイ済みのDBには
+    モデルに追加したインデックスがここで作成される。作成したインデックス・トリガー名を返す。
+    """
+    inspector = db.inspect(db.engine)
+    created = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if table.name == OrderItem.__tablename__ and index.unique:
+                merge_duplicate_order_items()
+            index.create(bind=db.engine)
+            created.append(index.name)
+
+    if created:
+        # クエリプランナーに新しいインデックスの統計情報を反映
+        with db.engine.begin() as conn:
+            conn.execute(db.text('ANALYZE'))
+
+    # 集計テーブルが追加されたばかりの既存DBは履歴から集計を作成
+    rollups_empty = db.session.scalar(db.select(UsageDailyRollup.day).limit(1)) is None and \
+        db.session.scalar(db.select(OrderDailyRollup.day).limit(1)) is None
+    has_history = db.session.scalar(db.select(Usage.id).limit(1)) is not None or \
+        db.session.scalar(db.select(OrderItem.id).limit(1)) is not None
+    if rollups_empty and has_history:
+        rebuild_rollups()
+
+    created.extend(install_change_triggers())
+    created.extend(install_search_index())
+    return created
+
+# 本番の起動処理（gunicorn の preload_app でマスターが1回だけ実行し、ワーカーは結果を引き継ぐ）
+STARTUP_TIMES = {}  # 段階 -> 秒（/metrics と起動ログに出力する）
+
+def precompile_templates():
+    """全テンプレートをコンパイルしてJinjaのキャッシュに載せ、件数を返す"""
+    names = app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html'))
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+def prepare_for_workers():
+    """スキーマの確認とテンプレートのコンパイルを行い、各段階の所要時間を STARTUP_TIMES に記録する
+
+    マスターで開いたDB接続はフォーク後のワーカーで共有しないよう最後に破棄する。
+    """
+    started = time.perf_counter()
+    with app.app_context():
+        db.create_all()
+        created = apply_schema_migrations()
+        if created:
+            app.logger.warning(f"スキーマを更新しました: {', '.join(created)}")
+        db.session.remove()
+        db.engine.dispose()
+    STARTUP_TIMES['schema'] = time.perf_counter() - started
+    started = time.perf_counter()
+    precompile_templates()
+    STARTUP_TIMES['templates'] = time.perf_counter() - started
+    return STARTUP_TIMES
+
+# 書き込みの直列化（単一ライター）
+# WRITE_QUEUE=1 のとき、使用登録・発注・在庫編集などの書き込みは各ワーカーで実行せず、
+# Unixソケット経由でライタープロセス（writer.py）に送る。ライターは届いた操作をまとめて
+# 1つのトランザクションで実行するため、ワーカー数が増えてもDBのロック待ちが増えない。
+# 読み込みはこれまで通り各ワーカーで並列に行う。
+app.config['WRITE_QUEUE'] = os.environ.get('WRITE_QUEUE', '0') == '1'
+app.config['WRITE_SOCKET'] = os.environ.get('WRITE_SOCKET', os.path.join(os.path.dirname(db_file), 'writer.sock'))
+app.config['WRITE_BATCH_MAX'] = int(os.environ.get('WRITE_BATCH_MAX', 200))
+app.config['WRITE_BATCH_WAIT_MS'] = float(os.environ.get('WRITE_BATCH_WAIT_MS', 2))
+app.config['WRITE_TIMEOUT'] = float(os.environ.get('WRITE_TIMEOUT', 60))
+
+metrics.histogram('inventory_write_batch_size', 'ライターが1トランザクションで実行した書き込み操作の数',
+                  buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+
+WRITE_OPERATIONS = {}
+
+def write_operation(name):
+    """書き込み操作を登録する
+
+    操作は JSON に変換できる引数を受け取り、JSON に変換できる結果を返す。
+    コミットは submit_write（またはライター）が行う。
+    """
+    def decorator(f):
+        WRITE_OPERATIONS[name] = f
+        return f
+    return decorator
+
+def submit_write(name, **params):
+    """書き込み操作を実行して結果を返す
+
+    WRITE_QUEUE=1 ならライタープロセスに送って結果を待つ。ライターに接続できない
+    場合はこのプロセスで直接書き込む。ライター側で HTTPException（abort）が発生した
+    場合は同じステータスで abort し、それ以外の失敗は RuntimeError にする。
+    """
+    if app.config['WRITE_QUEUE']:
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(app.config['WRITE_TIMEOUT'])
+            sock.connect(app.config['WRITE_SOCKET'])
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            sock.close()
+            app.logger.error(f"ライタープロセスに接続できないため直接書き込みます: {e}")
+        else:
+            with sock:
+                request_line = json.dumps({'op': name, 'params': params}, default=json_default, ensure_ascii=False)
+                sock.sendall(request_line.encode('utf-8') + b'\n')
+                reply = json.loads(sock.makefile('rb').readline() or b'null')
+            if reply is None:
+                raise RuntimeError('ライタープロセスから応答がありませんでした')
+            if reply['ok']:
+                return reply['result']
+            if reply['status'] < 500:
+                abort(reply['status'], reply['error'])
+            raise RuntimeError(reply['error'])
+    result = WRITE_OPERATIONS[name](**params)
+    db.session.commit()
+    return result
+
+def execute_write(request_data):
+    operation = WRITE_OPERATIONS.get(request_data.get('op'))
+    if operation is None:
+        raise ValueError(f"不明な書き込み操作です: {request_data.get('op')}")
+    return operation(**request_data.get('params', {}))
+
+def run_write_batch(requests):
+    """書き込み操作をまとめて1つのトランザクションで実行し、操作ごとの応答を返す
+
+    どれかが失敗した場合は全体をロールバックし、1件ずつ別のトランザクションで
+    やり直して、失敗した操作だけをエラーにする。
+    """
+    try:
+        replies = [{'ok': True, 'result': execute_write(request_data)} for request_data in requests]
+        db.session.commit()
+        return replies
+    except Exception as e:
+        db.session.rollback()
+        if len(requests) == 1:
+            if isinstance(e, HTTPException):
+                return [{'ok': False, 'status': e.code, 'error': e.description}]
+            app.logger.error(f"書き込みエラー: {requests[0].get('op')} {e}")
+            return [{'ok': False, 'status': 500, 'error': str(e)}]
+    replies = []
+    for request_data in requests:
+        replies.extend(run_write_batch([request_data]))
+    return replies
+
+def run_write_server():
+    """WRITE_SOCKET で書き込み操作を受け付け、バッチごとに実行し続ける（1プロセスだけ起動する）
+
+    接続ごとのスレッドが操作をキューに入れ、このスレッドがキューに溜まった分を
+    （最大 WRITE_BATCH_MAX 件、最初の1件から WRITE_BATCH_WAIT_MS ミリ秒まで待って）まとめて実行する。
+    """
+    path = app.config['WRITE_SOCKET']
+    if os.path.exists(path):
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(128)
+    pending = queue.Queue()
+
+    def handle(conn):
+        with conn:
+            try:
+                request_data = json.loads(conn.makefile('rb').readline())
+            except ValueError:
+                return
+            reply_box = queue.Queue(maxsize=1)
+            pending.put((request_data, reply_box))
+            reply = json.dumps(reply_box.get(), default=json_default, ensure_ascii=False)
+            try:
+                conn.sendall(reply.encode('utf-8') + b'\n')
+            except OSError:
+                pass
+
+    def accept_loop():
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    app.logger.info(f"ライタープロセスを開始しました: {path}")
+    with app.app_context():
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + app.config['WRITE_BATCH_WAIT_MS'] / 1000
+            while len(batch) < app.config['WRITE_BATCH_MAX']:
+                try:
+                    batch.append(pending.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            start_metrics_scope('writer')
+            metrics.observe('inventory_write_batch_size', len(batch))
+            replies = run_write_batch([request_data for request_data, _ in batch])
+            record_sql_metrics()
+            db.session.remove()
+            for (_, reply_box), reply in zip(batch, replies):
+                reply_box.put(reply)
+
+# 在庫消費エンジン
+def decrement_stock(quantities):
+    """在庫を1回の条件付きUPDATEで減算し、減算後の値を返す
+
+    quantities は 備品ID→減算数 の辞書。読み込み→書き戻しを行わずDB側で
+    減算するため、複数ワーカーから同時に使用登録しても在庫数が失われない。
+    在庫は0未満にならない。
+
+    戻り値は 備品ID→(減算後の在庫, 最低在庫数, 発注先ID) の辞書。
+    存在しない備品IDは含まれない。
+    """
+    if not quantities:
+        return {}
+    delta = db.case(quantities, value=Item.id, else_=0)
+    current = db.func.coalesce(Item.current_stock, 0)
+    rows = db.session.execute(
+        db.update(Item.__table__)
+        .where(Item.id.in_(quantities))
+        .values(current_stock=db.case((current > delta, current - delta), else_=0))
+        .returning(Item.id, Item.current_stock, Item.minimum_stock, Item.supplier_id)
+    ).all()
+    return {row.id: (row.current_stock, row.minimum_stock or 0, row.supplier_id) for row in rows}
+
+def consume_stock(lines, patient_id=None, order_quantity_fn=None, require_all=False, order_quantity_items=None):
+    """備品の使用登録・在庫減算・自動発注をまとめて行う
+
+    lines は (item_id, quantity) または (item_id, quantity, patient_id, usage_date) のリスト。
+    後者の patient_id・usage_date が None の行は引数の patient_id・現在時刻を使う。在庫の減算、未処理発注の検索、
+    Usage/Order/OrderItem の書き込みをそれぞれ一括で行うため、行数に関係なく
+    一定回数のSQLで処理が完了する。コミットは呼び出し側で行う。
+
+    同じ備品が複数行にある場合は数量を合算して扱う。減算後の在庫が最低在庫数以下なら
+    発注対象とし、order_quantity_fn を指定すると発注数量を
+    (減算後の在庫, 最低在庫数, 使用数) から計算する。省略時は使用数を発注数量とする。
+    order_quantity_items を指定すると order_quantity_fn はその備品IDだけに使う。
+
+    戻り値は {'orders': 発注先ID→発注IDの辞書(発生順), 'stock': 備品ID→減算後の在庫,
+    'missing': 見つからなかった備品ID, 'reordered': 発注対象になった備品ID→発注先ID}
+    """
+    lines = [(int(line[0]), int(line[1])) + tuple(line[2:]) for line in lines if line[0] and int(line[1]) > 0]
+    result = {'orders': {}, 'stock': {}, 'missing': [], 'reordered': {}}
+    if not lines:
+        return result
+
+    used = {}
+    for line in lines:
+        used[line[0]] = used.get(line[0], 0) + line[1]
+
+    # 在庫をDB側で一括減算（書き込みロックはここから取得される）
+    updated = decrement_stock(used)
+    result['stock'] = {item_id: row[0] for item_id, row in updated.items()}
+    result['missing'] = sorted(used.keys() - updated.keys())
+    if result['missing'] and require_all:
+        # 減算済みの在庫はリクエスト（ライターではバッチ）の終わりにロールバックされる
+        abort(404)
+
+    # 使用記録を一括書き込み
+    now = datetime.utcnow()
+    usage_rows = []
+    for item_id, quantity, *extra in lines:
+        if item_id not in updated:
+            continue
+        line_patient_id, usage_date = (extra + [None, None])[:2]
+        usage_rows.append({
+            'item_id': item_id,
+            'quantity': quantity,
+            'patient_id': line_patient_id if line_patient_id is not None else patient_id,
+            'usage_date': usage_date or now
+        })
+    if not usage_rows:
+        return result
+    # Core のINSERTにすると patient_id が None の行が混ざっても1回の executemany で済む
+    db.session.execute(db.insert(Usage.__table__), usage_rows)
+    add_to_rollup(UsageDailyRollup, [(row['usage_date'].date(), row['item_id'], row['quantity']) for row in usage_rows])
+
+    # 在庫が最低在庫数を下回り、発注先がある備品を発注対象にする
+    reorder = {}  # (supplier_id, item_id) -> 発注数量
+    for item_id in used:
+        if item_id not in updated:
+            continue
+        stock, minimum, supplier_id = updated[item_id]
+        if stock <= minimum and supplier_id:
+            if order_quantity_fn and (order_quantity_items is None or item_id in order_quantity_items):
+                order_quantity = order_quantity_fn(stock, minimum, used[item_id])
+            else:
+                order_quantity = used[item_id]
+            reorder[(supplier_id, item_id)] = order_quantity
+            result['orders'].setdefault(supplier_id, None)
+            result['reordered'][item_id] = supplier_id
+
+    if reorder:
+        result['orders'] = add_to_pending_orders(reorder, now)
+
+    return result
+
+def restock_quantity(stock, minimum, used):
+    """最低在庫数の2倍まで戻す発注数量（最低1）"""
+    return max(1, minimum * 2 - stock)
+
+@write_operation('use_items')
+def use_items(lines, patient_id=None, require_all=False, restock=False):
+    """備品の使用を登録し、{'order_ids': 作成・追加した発注IDのリスト} を返す
+
+    restock=True なら発注数量を最低在庫数の2倍まで戻す数にする（汎用セット用）。
+    備品IDのリストを渡した場合はその備品だけを補充数量で発注する。
+    """
+    result = consume_stock(lines, patient_id=patient_id, require_all=require_all,
+                           order_quantity_fn=restock_quantity if restock else None,
+                           order_quantity_items=None if restock is True else set(restock or ()))
+    return {'order_ids': [order_id for order_id in result['orders'].values() if order_id]}
+
+def add_to_pending_orders(reorder, now=None):
+    """発注先ごとの未処理発注に明細を一括で追加する
+
+    reorder は (発注先ID, 備品ID)→発注数量 の辞書。発注先ごとに最新の未処理発注を使い、
+    なければ新しく作成する。同じ備品の明細がすでにあれば数量を加算する。
+    戻り値は 発注先ID→発注ID の辞書(reorder の順)。
+    """
+    now = now or datetime.utcnow()
+    orders = {}
+    for supplier_id, _ in reorder:
+        orders.setdefault(supplier_id, None)
+    order_dates = {}
+
+    # 未処理発注を発注先ごとに一括取得（発注先ごとに最新のものを使う）
+    pending = db.session.execute(
+        db.select(Order.id, Order.supplier_id, Order.order_date)
+        .where(Order.supplier_id.in_(list(orders)), Order.status == 'pending')
+        .order_by(Order.order_date.desc(), Order.id.desc())
+    ).all()
+    for row in pending:
+        if orders[row.supplier_id] is None:
+            orders[row.supplier_id] = row.id
+            order_dates[row.id] = row.order_date
+
+    # 未処理発注がない発注先は新しい発注を一括作成
+    new_suppliers = [s for s, order_id in orders.items() if order_id is None]
+    if new_suppliers:
+        created = db.session.execute(
+            db.insert(Order).returning(Order.id, Order.supplier_id),
+            [{'supplier_id': s, 'status': 'pending', 'order_date': now} for s in new_suppliers]
+        ).all()
+        for row in created:
+            orders[row.supplier_id] = row.id
+            order_dates[row.id] = now
+
+    # 既存の明細は数量を加算し、なければ追加
+    order_item_rows = [{
+        'order_id': orders[supplier_id],
+        'item_id': item_id,
+        'quantity': quantity
+    } for (supplier_id, item_id), quantity in reorder.items()]
+    stmt = dialect_insert(OrderItem.__table__)
+    db.session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=['order_id', 'item_id'],
+            set_={'quantity': OrderItem.__table__.c.quantity + stmt.excluded.quantity}
+        ),
+        order_item_rows
+    )
+
+    # 発注量の日別集計を更新（発注日で集計する）
+    add_to_rollup(OrderDailyRollup, [
+        (order_dates[row['order_id']].date(), row['item_id'], row['quantity']) for row in order_item_rows
+    ])
+    return orders
+
+def reorder_scan():
+    """最低在庫数以下で発注先がある備品を1回のクエリで探し、未処理発注に一括で追加する
+
+    使用登録以外（在庫の直接編集・復元など）で在庫が減った備品も発注対象にするためのもの。
+    すでに未処理発注に載っている備品は対象外なので、何度実行しても発注は重複しない。
+    発注数量は最低在庫数の2倍まで補充する数（最低1）。備品数に関係なく一定回数のSQLで済む。
+    コミットは呼び出し側で行う。戻り値は {'items': 発注対象の備品数, 'orders': 発注先ID→発注ID}
+    """
+    current = db.func.coalesce(Item.current_stock, 0)
+    shortfall = Item.minimum_stock * 2 - current
+    on_pending_order = db.select(OrderItem.id).join(Order, Order.id == OrderItem.order_id).where(
+        OrderItem.item_id == Item.id, Order.status == 'pending'
+    ).exists()
+    rows = db.session.execute(
+        db.select(
+            Item.supplier_id,
+            Item.id,
+            db.case((shortfall < 1, 1), else_=shortfall)
+        ).where(
+            Item.supplier_id.is_not(None),
+            current <= Item.minimum_stock,
+            ~on_pending_order
+        ).order_by(Item.supplier_id, Item.id)
+    ).all()
+    if not rows:
+        return {'items': 0, 'orders': {}}
+    reorder = {(supplier_id, item_id): quantity for supplier_id, item_id, quantity in rows}
+    return {'items': len(reorder), 'orders': add_to_pending_orders(reorder)}
+
+@write_operation('reorder_scan')
+def reorder_scan_operation():
+    result = reorder_scan()
+    return {'items': result['items'], 'order_ids': list(result['orders'].values())}
+
 # ログイン要求デコレータ
 def login_required(f):
     @wraps(f)
@@ -193,6 +1328,103 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# 一覧ページのページング（キーセット方式）
+PER_PAGE_DEFAULT = 50
+PER_PAGE_MAX = 200
+
+def encode_cursor(sort_value, last_id):
+    """最後の行の並び替えキーとIDからカーソル文字列を作る"""
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, last_id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, sort_expr):
+    """カーソル文字列を (並び替えキー, ID) に戻す。不正な場合は None"""
+    if not cursor:
+        return None
+    try:
+        sort_value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if isinstance(sort_expr.type, db.DateTime) and sort_value is not None:
+            sort_value = datetime.fromisoformat(sort_value)
+        return sort_value, int(last_id)
+    except (ValueError, TypeError):
+        return None
+
+def list_params(sort_options, default_sort, default_order='asc'):
+    """リクエストから並び替え・カーソル・件数を読み取る"""
+    sort = request.args.get('sort', default_sort)
+    if sort not in sort_options:
+        sort = default_sort
+    order = request.args.get('order', default_order)
+    if order not in ('asc', 'desc'):
+        order = default_order
+    per_page = request.args.get('per_page', PER_PAGE_DEFAULT, type=int)
+    per_page = max(1, min(per_page or PER_PAGE_DEFAULT, PER_PAGE_MAX))
+    return {
+        'sort': sort,
+        'order': order,
+        'sort_expr': sort_options[sort],
+        'descending': order == 'desc',
+        'cursor': request.args.get('cursor'),
+        'per_page': per_page
+    }
+
+def keyset_paginate(stmt, id_column, params):
+    """(並び替えキー, ID) の順で1ページ分を取得する
+
+    OFFSET を使わず前ページ最後の行のキーから読み始めるため、
+    何ページ目でもインデックス上の範囲検索1回で済む。
+    戻り値は (行のリスト, 次ページのカーソル)。
+    """
+    sort_expr = params['sort_expr']
+    descending = params['descending']
+    position = decode_cursor(params['cursor'], sort_expr)
+    if position:
+        sort_value, last_id = position
+        if descending:
+            stmt = stmt.where(db.or_(sort_expr < sort_value, db.and_(sort_expr == sort_value, id_column < last_id)))
+        else:
+            stmt = stmt.where(db.or_(sort_expr > sort_value, db.and_(sort_expr == sort_value, id_column > last_id)))
+
+    if descending:
+        stmt = stmt.order_by(sort_expr.desc(), id_column.desc())
+    else:
+        stmt = stmt.order_by(sort_expr.asc(), id_column.asc())
+
+    stmt = stmt.add_columns(sort_expr.label('sort_key'), id_column.label('sort_id')).limit(params['per_page'] + 1)
+    rows = db.session.execute(stmt).all()
+
+    next_cursor = None
+    if len(rows) > params['per_page']:
+        rows = rows[:params['per_page']]
+        next_cursor = encode_cursor(rows[-1].sort_key, rows[-1].sort_id)
+
+    # 並び替え用の列を除いて返す（エンティティ1つだけの場合はそのまま）
+    width = len(rows[0]) - 2 if rows else 0
+    if width == 1:
+        return [row[0] for row in rows], next_cursor
+    return [tuple(row[:width]) for row in rows], next_cursor
+
+def pagination_urls(next_cursor):
+    """現在の絞り込み条件を保ったまま、先頭ページと次ページのURLを作る"""
+    args = request.args.to_dict()
+    args.pop('cursor', None)
+    return {
+        'first_url': url_for(request.endpoint, **args) if request.args.get('cursor') else None,
+        'next_url': url_for(request.endpoint, cursor=next_cursor, **args) if next_cursor else None
+    }
+
+def parse_date_arg(name):
+    """YYYY-MM-DD 形式のクエリパラメータを日付に変換する。不正な場合は None"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return None
+
 # ログイン
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -225,16 +1457,66 @@ def logout():
 def index():
     return render_template('index.html')
 
+ITEM_SORTS = {
+    'id': Item.id,
+    'name': Item.name,
+    'stock': db.func.coalesce(Item.current_stock, 0)
+}
+
+def query_items_page():
+    """備品一覧の1ページ分を絞り込み・並び替えして取得する"""
+    params = list_params(ITEM_SORTS, 'id')
+    filters = {
+        'below_minimum': request.args.get('below_minimum') == '1',
+        'supplier_id': request.args.get('supplier_id', type=int)
+    }
+    # 発注先は結合して取得（行ごとの遅延読み込みを避ける）
+    stmt = db.select(Item).options(db.joinedload(Item.supplier))
+    if filters['below_minimum']:
+        stmt = stmt.where(db.func.coalesce(Item.current_stock, 0) <= db.func.coalesce(Item.minimum_stock, 0))
+    if filters['supplier_id']:
+        stmt = stmt.where(Item.supplier_id == filters['supplier_id'])
+    rows, next_cursor = keyset_paginate(stmt, Item.id, params)
+    return rows, next_cursor, params, filters
+
+def item_to_dict(item):
+    return {
+        'id': item.id,
+        'name': item.name,
+        'unit_type': item.unit_type,
+        'items_per_box': item.items_per_box,
+        'minimum_stock': item.minimum_stock,
+        'current_stock': item.current_stock,
+        'supplier_id': item.supplier_id,
+        'supplier_name': item.supplier.name if item.supplier else None
+    }
+
 @app.route('/items')
 @login_required
 def items():
-    all_items = Item.query.all()
-    return render_template('items.html', items=all_items)
+    page_items, next_cursor, params, filters = query_items_page()
+    all_suppliers = reference_suppliers(order_by_name=True)
+    return render_template('items.html',
+                          items=page_items,
+                          suppliers=all_suppliers,
+                          params=params,
+                          filters=filters,
+                          **pagination_urls(next_cursor))
+
+@app.route('/api/items')
+@login_required
+def api_items():
+    page_items, next_cursor, params, filters = query_items_page()
+    return jsonify({
+        'data': [item_to_dict(item) for item in page_items],
+        'next_cursor': next_cursor,
+        'sort': params['sort'],
+        'order': params['order']
+    })
 
 @app.route('/add_item', methods=['GET', 'POST'])
 @login_required
 def add_item():
-    suppliers = Supplier.query.all()
     if request.method == 'POST':
         name = request.form['name']
         unit_type = request.form['unit_type']
@@ -255,19 +1537,53 @@ def add_item():
         db.session.commit()
         flash('備品を追加しました', 'success')
         return redirect(url_for('items'))
-    return render_template('add_item.html', suppliers=suppliers)
+    return render_template('add_item.html')
+
+SUPPLIER_SORTS = {
+    'id': Supplier.id,
+    'name': Supplier.name
+}
+
+def query_suppliers_page():
+    """発注先一覧の1ページ分を並び替えして取得する"""
+    params = list_params(SUPPLIER_SORTS, 'id')
+    rows, next_cursor = keyset_paginate(db.select(Supplier), Supplier.id, params)
+    return rows, next_cursor, params
+
+def supplier_to_dict(supplier):
+    return {
+        'id': supplier.id,
+        'name': supplier.name,
+        'fax_number': supplier.fax_number,
+        'address': supplier.address,
+        'email': supplier.email
+    }
 
 @app.route('/suppliers')
 @login_required
 def suppliers():
     try:
-        all_suppliers = Supplier.query.all()
-        return render_template('suppliers.html', suppliers=all_suppliers)
+        page_suppliers, next_cursor, params = query_suppliers_page()
+        return render_template('suppliers.html',
+                              suppliers=page_suppliers,
+                              params=params,
+                              **pagination_urls(next_cursor))
     except Exception as e:
         app.logger.error(f"発注先一覧表示エラー: {str(e)}")
         flash(f'発注先一覧の表示中にエラーが発生しました: {str(e)}', 'danger')
         return redirect(url_for('index'))
 
+@app.route('/api/suppliers')
+@login_required
+def api_suppliers():
+    page_suppliers, next_cursor, params = query_suppliers_page()
+    return jsonify({
+        'data': [supplier_to_dict(supplier) for supplier in page_suppliers],
+        'next_cursor': next_cursor,
+        'sort': params['sort'],
+        'order': params['order']
+    })
+
 @app.route('/add_supplier', methods=['GET', 'POST'])
 @login_required
 def add_supplier():
@@ -321,18 +1637,7 @@ def edit_supplier(supplier_id):
 @login_required
 def delete_supplier(supplier_id):
     try:
-        supplier = Supplier.query.get_or_404(supplier_id)
-        supplier_name = supplier.name
-        
-        # 関連する物品の発注先IDをNULLに設定
-        items = Item.query.filter_by(supplier_id=supplier_id).all()
-        for item in items:
-            item.supplier_id = None
-        
-        # 発注先を削除
-        db.session.delete(supplier)
-        db.session.commit()
-        
+        supplier_name = submit_write('delete_supplier', supplier_id=supplier_id)
         flash(f'発注先「{supplier_name}」を削除しました', 'success')
     except Exception as e:
         db.session.rollback()
@@ -340,11 +1645,142 @@ def delete_supplier(supplier_id):
     
     return redirect(url_for('suppliers'))
 
+@write_operation('delete_supplier')
+def delete_supplier_operation(supplier_id):
+    """発注先を削除し、その発注先の備品は発注先なしにする。削除した発注先名を返す"""
+    supplier = db.session.get(Supplier, supplier_id)
+    if supplier is None:
+        abort(404)
+    
+    # 関連する物品の発注先IDをNULLに設定
+    db.session.execute(db.update(Item.__table__).where(Item.supplier_id == supplier_id).values(supplier_id=None))
+    
+    # 発注先を削除
+    db.session.delete(supplier)
+    return supplier.name
+
+PATIENT_SORTS = {
+    'id': Patient.id,
+    'name': Patient.name
+}
+
+def query_patients_page():
+    """患者一覧の1ページ分を並び替えして取得する"""
+    params = list_params(PATIENT_SORTS, 'id')
+    # 登録セット数は集計サブクエリで取得
+    set_counts = db.select(
+        PatientSet.patient_id,
+        db.func.count(PatientSet.id).label('set_count')
+    ).group_by(PatientSet.patient_id).subquery()
+    stmt = db.select(Patient, db.func.coalesce(set_counts.c.set_count, 0)).outerjoin(
+        set_counts, set_counts.c.patient_id == Patient.id
+    )
+    rows, next_cursor = keyset_paginate(stmt, Patient.id, params)
+    return rows, next_cursor, params
+
 @app.route('/patients')
 @login_required
 def patients():
-    all_patients = Patient.query.all()
-    return render_template('patients.html', patients=all_patients)
+    page_patients, next_cursor, params = query_patients_page()
+    return render_template('patients.html',
+                          patients=page_patients,
+                          params=params,
+                          **pagination_urls(next_cursor))
+
+@app.route('/api/patients')
+@login_required
+def api_patients():
+    page_patients, next_cursor, params = query_patients_page()
+    return jsonify({
+        'data': [{
+            'id': patient.id,
+            'name': patient.name,
+            'patient_id': patient.patient_id,
+            'set_count': set_count
+        } for patient, set_count in page_patients],
+        'next_cursor': next_cursor,
+        'sort': params['sort'],
+        'order': params['order']
+    })
+
+@app.route('/api/search')
+@login_required
+def api_search():
+    """備品・患者の全文検索（q: 検索語、type: items / patients、limit: 件数）
+
+    全角・半角やカタカナ・ひらがなの違いを無視し、関連度順に返す。
+    """
+    kind = request.args.get('type', 'items')
+    if kind not in ('items', 'patients'):
+        return jsonify({'error': 'type は items か patients を指定してください'}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), SEARCH_LIMIT_MAX)
+    if kind == 'items':
+        ids = search_ids('item_search', request.args.get('q', ''), limit)
+        rows = db.session.execute(
+            db.select(Item.id, Item.name, Item.unit_type, Item.current_stock).where(Item.id.in_(ids))).all()
+        data = [{'id': row.id, 'name': row.name, 'unit_type': row.unit_type, 'current_stock': row.current_stock}
+                for row in rows]
+    else:
+        ids = search_ids('patient_search', request.args.get('q', ''), limit)
+        rows = db.session.execute(
+            db.select(Patient.id, Patient.name, Patient.patient_id).where(Patient.id.in_(ids))).all()
+        data = [{'id': row.id, 'name': row.name, 'patient_id': row.patient_id} for row in rows]
+    # 検索結果の順位の順に並べ直す
+    position = {row_id: n for n, row_id in enumerate(ids)}
+    data.sort(key=lambda row: position[row['id']])
+    return jsonify({'data': data, 'type': kind})
+
+# 入力フォームの選択肢の検索（static/js/typeahead.js が select の選択肢を入力に応じて読み込む）
+TYPEAHEAD_LIMIT = 20
+TYPEAHEAD_MAX_AGE = 30  # 秒（ブラウザのキャッシュ。在庫数の表示が少し古くても問題ない程度にする）
+
+@app.route('/api/typeahead/<kind>')
+@login_required
+def api_typeahead(kind):
+    """備品・患者・発注先の選択肢を検索する（q: 検索語。空なら名前順の先頭から）
+
+    備品は id・名前・単位・在庫数、患者は id・名前・患者ID、発注先は id・名前だけを返す。
+    """
+    query = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', TYPEAHEAD_LIMIT, type=int), 1), SEARCH_LIMIT_MAX)
+    if kind == 'items':
+        model, index_name = Item, 'item_search'
+        stmt = db.select(Item.id, Item.name, Item.unit_type, Item.current_stock)
+    elif kind == 'patients':
+        model, index_name = Patient, 'patient_search'
+        stmt = db.select(Patient.id, Patient.name, Patient.patient_id)
+    elif kind == 'suppliers':
+        model, index_name = Supplier, None
+        stmt = db.select(Supplier.id, Supplier.name)
+    else:
+        abort(404)
+
+    if not query:
+        rows = db.session.execute(stmt.order_by(model.name, model.id).limit(limit)).all()
+    elif index_name:
+        ids = search_ids(index_name, query, limit)
+        position = {row_id: n for n, row_id in enumerate(ids)}
+        rows = sorted(db.session.execute(stmt.where(model.id.in_(ids))).all(), key=lambda row: position[row.id])
+    else:
+        # 発注先は件数が少ないので、正規化した名前の部分一致で探す
+        terms = normalize_search_text(query).split()
+        name = db.func.search_normalize(model.name) if db.engine.dialect.name == 'sqlite' else model.name
+        rows = db.session.execute(
+            stmt.where(*[name.ilike(like_pattern(term), escape='\\') for term in terms])
+            .order_by(name.ilike(like_pattern(terms[0])[1:], escape='\\').desc(), model.name, model.id)
+            .limit(limit)
+        ).all()
+
+    if kind == 'items':
+        data = [{'id': row.id, 'name': row.name, 'unit': row.unit_type, 'stock': row.current_stock or 0}
+                for row in rows]
+    elif kind == 'patients':
+        data = [{'id': row.id, 'name': row.name, 'patient_id': row.patient_id} for row in rows]
+    else:
+        data = [{'id': row.id, 'name': row.name} for row in rows]
+    response = jsonify({'data': data})
+    response.headers['Cache-Control'] = f'private, max-age={TYPEAHEAD_MAX_AGE}'
+    return response
 
 @app.route('/add_patient', methods=['GET', 'POST'])
 @login_required
@@ -368,8 +1804,6 @@ def item_sets():
 @app.route('/add_item_set', methods=['GET', 'POST'])
 @login_required
 def add_item_set():
-    all_items = Item.query.all()
-    
     if request.method == 'POST':
         name = request.form['name']
         description = request.form.get('description', '')
@@ -406,7 +1840,7 @@ def add_item_set():
         flash('汎用セットを追加しました', 'success')
         return redirect(url_for('item_sets'))
         
-    return render_template('add_item_set.html', items=all_items)
+    return render_template('add_item_set.html')
 
 @app.route('/patient_sets')
 @login_required
@@ -417,11 +1851,8 @@ def patient_sets():
 @app.route('/add_patient_set', methods=['GET', 'POST'])
 @login_required
 def add_patient_set():
-    patients = Patient.query.all()
-    all_items = Item.query.all()
-    
     # URLパラメータから患者IDを取得
-    pre_selected_patient_id = request.args.get('patient_id')
+    pre_selected_patient_id = request.args.get('patient_id', type=int)
     
     if request.method == 'POST':
         name = request.form['name']
@@ -463,17 +1894,13 @@ def add_patient_set():
         else:
             return redirect(url_for('patient_sets'))
     
-    return render_template('add_patient_set.html', 
-                          patients=patients, 
-                          items=all_items, 
-                          pre_selected_patient_id=pre_selected_patient_id)
+    # 選択肢は入力に応じて読み込むため、選択済みの患者だけを渡す
+    pre_selected_patient = db.session.get(Patient, pre_selected_patient_id) if pre_selected_patient_id else None
+    return render_template('add_patient_set.html', pre_selected_patient=pre_selected_patient)
 
 @app.route('/use_item', methods=['GET', 'POST'])
 @login_required
 def use_item():
-    all_items = Item.query.all()
-    patients = Patient.query.all()
-    
     if request.method == 'POST':
         patient_id = request.form.get('patient_id')
         item_ids = request.form.getlist('item_id[]')
@@ -483,92 +1910,250 @@ def use_item():
             flash('備品と数量を正しく選択してください', 'danger')
             return redirect(url_for('use_item'))
         
-        # 発注情報を集約するための辞書
-        orders_by_supplier = {}
-        
-        for i in range(len(item_ids)):
-            item_id = item_ids[i]
-            quantity = int(quantities[i])
-            
-            if not item_id or quantity <= 0:
-                continue
-                
-            item = Item.query.get_or_404(item_id)
-            
-            # 使用記録を保存
-            usage = Usage(
-                item_id=item.id,
-                quantity=quantity,
-                patient_id=patient_id if patient_id else None,
-                usage_date=datetime.utcnow()
-            )
-            db.session.add(usage)
-            
-            # 在庫を減らす
-            item.current_stock = max(0, item.current_stock - quantity)
-            
-            # 在庫が最低在庫数を下回ったら発注
-            if item.current_stock <= item.minimum_stock and item.supplier_id:
-                supplier_id = item.supplier_id
-                
-                # 今日の発注がすでにあるか確認
-                if supplier_id in orders_by_supplier:
-                    order = orders_by_supplier[supplier_id]
-                else:
-                    existing_order = Order.query.filter_by(
-                        supplier_id=supplier_id,
-                        status='pending'
-                    ).order_by(Order.order_date.desc()).first()
-                    
-                    if existing_order:
-                        order = existing_order
-                    else:
-                        # 新しい発注を作成
-                        new_order = Order(
-                            supplier_id=supplier_id,
-                            status='pending',
-                            order_date=datetime.utcnow()
-                        )
-                        db.session.add(new_order)
-                        db.session.flush()
-                        order = new_order
-                    
-                    orders_by_supplier[supplier_id] = order
-                
-                # 同じアイテムの発注がすでにあるか確認
-                existing_order_item = OrderItem.query.filter_by(
-                    order_id=order.id,
-                    item_id=item.id
-                ).first()
-                
-                if existing_order_item:
-                    existing_order_item.quantity += quantity
-                else:
-                    new_order_item = OrderItem(
-                        order_id=order.id,
-                        item_id=item.id,
-                        quantity=quantity
-                    )
-                    db.session.add(new_order_item)
-        
-        db.session.commit()
+        result = submit_write('use_items', lines=list(zip(item_ids, quantities)),
+                              patient_id=patient_id if patient_id else None, require_all=True)
         
-        if orders_by_supplier:
+        if result['order_ids']:
             flash('備品を使用登録し、発注書を生成しました', 'success')
             # 最初の発注を表示
-            first_order = list(orders_by_supplier.values())[0]
-            return redirect(url_for('view_order', order_id=first_order.id))
+            return redirect(url_for('view_order', order_id=result['order_ids'][0]))
         else:
             flash('備品を使用登録しました', 'success')
             return redirect(url_for('items'))
     
-    return render_template('use_item.html', items=all_items, patients=patients)
+    return render_template('use_item.html')
+
+# 変更フィード（同期クライアントが前回以降の変更だけを取得する）
+CHANGE_FEED_TABLES = {
+    'supplier': ('suppliers', Supplier),
+    'item': ('items', Item),
+    'patient': ('patients', Patient),
+    'patient_set': ('patient_sets', PatientSet),
+    'item_set': ('item_sets', ItemSet),
+    'set_item': ('set_items', SetItem),
+}
+CHANGE_FEED_LIMIT_DEFAULT = 500
+CHANGE_FEED_LIMIT_MAX = 5000
+
+def row_to_dict(row):
+    return {key: json_default(value) if isinstance(value, datetime) else value for key, value in row._mapping.items()}
+
+def query_changes(since, limit):
+    """seq が since より大きい変更を最大 limit 件読み、行ごとに最新の状態にまとめて返す
+
+    戻り値は (変更のリスト, 次回の since, 続きがあるか)。
+    削除された行は data を持たない 'delete'（トゥームストーン）として返す。
+    """
+    entries = db.session.execute(
+        db.select(ChangeLog.seq, ChangeLog.table_name, ChangeLog.row_id, ChangeLog.op)
+        .where(ChangeLog.seq > since)
+        .order_by(ChangeLog.seq)
+        .limit(limit + 1)
+    ).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    if not entries:
+        return [], since, False
+
+    # 同じ行の変更は最後の1件だけにする
+    latest = {}
+    for entry in entries:
+        latest.pop((entry.table_name, entry.row_id), None)
+        latest[(entry.table_name, entry.row_id)] = entry
+
+    # 現在の行はテーブルごとに1回で読む
+    ids_by_table = {}
+    for (table_name, row_id), entry in latest.items():
+        if entry.op == 'upsert' and table_name in CHANGE_FEED_TABLES:
+            ids_by_table.setdefault(table_name, []).append(row_id)
+    rows = {}
+    for table_name, row_ids in ids_by_table.items():
+        table = CHANGE_FEED_TABLES[table_name][1].__table__
+        for row in db.session.execute(db.select(table).where(table.c.id.in_(row_ids))):
+            rows[(table_name, row.id)] = row_to_dict(row)
+
+    changes = []
+    for (table_name, row_id), entry in latest.items():
+        if table_name not in CHANGE_FEED_TABLES:
+            continue
+        data = rows.get((table_name, row_id))
+        change = {
+            'seq': entry.seq,
+            'table': CHANGE_FEED_TABLES[table_name][0],
+            'id': row_id,
+            # 読み込むまでに削除された行もトゥームストーンとして返す
+            'op': 'upsert' if data is not None else 'delete'
+        }
+        if data is not None:
+            change['data'] = data
+        changes.append(change)
+    return changes, entries[-1].seq, has_more
+
+@app.route('/api/changes')
+@login_required
+def api_changes():
+    """since より後の変更を返す。next_since を次の since に指定して続きを取得する"""
+    since = request.args.get('since', 0, type=int)
+    limit = max(1, min(request.args.get('limit', CHANGE_FEED_LIMIT_DEFAULT, type=int), CHANGE_FEED_LIMIT_MAX))
+    changes, next_since, has_more = query_changes(since, limit)
+    return jsonify({
+        'changes': changes,
+        'next_since': next_since,
+        'has_more': has_more
+    })
+
+# 使用記録の一括登録API（訪問先の端末からの同期用）
+API_USAGE_BATCH_MAX = 5000
+# 冪等キーの保持日数。クライアントはこの期間を過ぎたイベントを再送しないこと（再送すると二重に登録される）
+app.config['USAGE_SYNC_KEY_RETENTION_DAYS'] = int(os.environ.get('USAGE_SYNC_KEY_RETENTION_DAYS', 30))
+
+def parse_usage_event(event):
+    """使用イベント1件を検証し (key, item_id, quantity, patient_id, usage_date) を返す
+
+    不正な場合は ValueError を送出する。timestamp はISO 8601形式で、
+    タイムゾーン付きの場合はUTCに変換する（省略時は登録時刻）。
+    """
+    if not isinstance(event, dict):
+        raise ValueError('イベントの形式が正しくありません')
+    key = event.get('key')
+    if not isinstance(key, str) or not key or len(key) > 100:
+        raise ValueError('key は1〜100文字の文字列で指定してください')
+    try:
+        item_id = int(event['item_id'])
+        quantity = int(event['quantity'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('item_id と quantity は整数で指定してください')
+    if quantity <= 0:
+        raise ValueError('quantity は1以上で指定してください')
+    patient_id = event.get('patient_id')
+    if patient_id is not None:
+        try:
+            patient_id = int(patient_id)
+        except (TypeError, ValueError):
+            raise ValueError('patient_id は整数で指定してください')
+    usage_date = None
+    if event.get('timestamp'):
+        try:
+            usage_date = datetime.fromisoformat(str(event['timestamp']))
+        except ValueError:
+            raise ValueError('timestamp はISO 8601形式で指定してください')
+        if usage_date.tzinfo is not None:
+            usage_date = usage_date.astimezone(timezone.utc).replace(tzinfo=None)
+    return key, item_id, quantity, patient_id, usage_date
+
+def record_usage_events(events):
+    """使用イベントをまとめて1つのトランザクションで登録する
+
+    冪等キーを先に ON CONFLICT DO NOTHING で書き込み、新しく書き込めたキーの
+    イベントだけを consume_stock に渡す。同じキーの再送や同時送信は 'duplicate' になる。
+    戻り値は (イベントごとの結果のリスト, 発注先ID→発注ID)。コミットは呼び出し側で行う。
+    """
+    results = []
+    parsed = {}  # 結果のインデックス -> 検証済みのイベント
+    seen_keys = set()
+    for index, event in enumerate(events):
+        key = event.get('key') if isinstance(event, dict) else None
+        results.append({'key': key})
+        try:
+            parsed_event = parse_usage_event(event)
+        except ValueError as e:
+            results[index].update(status='error', error=str(e))
+            continue
+        if parsed_event[0] in seen_keys:
+            results[index]['status'] = 'duplicate'
+            continue
+        seen_keys.add(parsed_event[0])
+        parsed[index] = parsed_event
+
+    # 存在しない備品・患者は1回ずつの問い合わせで確認する
+    item_ids = {e[1] for e in parsed.values()}
+    patient_ids = {e[3] for e in parsed.values() if e[3] is not None}
+    known_items = set(db.session.scalars(db.select(Item.id).where(Item.id.in_(item_ids)))) if item_ids else set()
+    known_patients = set(db.session.scalars(db.select(Patient.id).where(Patient.id.in_(patient_ids)))) if patient_ids else set()
+    for index, (key, item_id, quantity, patient_id, usage_date) in list(parsed.items()):
+        if item_id not in known_items:
+            results[index].update(status='error', error='備品が見つかりません')
+            del parsed[index]
+        elif patient_id is not None and patient_id not in known_patients:
+            results[index].update(status='error', error='患者が見つかりません')
+            del parsed[index]
+
+    if not parsed:
+        return results, {}
+
+    # 冪等キーを書き込み、書き込めたイベントだけを登録する
+    now = datetime.utcnow()
+    stmt = dialect_insert(UsageSyncKey.__table__).on_conflict_do_nothing(index_elements=['key'])
+    inserted = set(db.session.scalars(
+        stmt.returning(UsageSyncKey.key),
+        [{'key': e[0], 'item_id': e[1], 'quantity': e[2], 'received_at': now} for e in parsed.values()]
+    ))
+    lines = []
+    for index, (key, item_id, quantity, patient_id, usage_date) in parsed.items():
+        if key in inserted:
+            lines.append((item_id, quantity, patient_id, usage_date))
+        else:
+            results[index]['status'] = 'duplicate'
+
+    consumed = consume_stock(lines)
+    for index, (key, item_id, quantity, patient_id, usage_date) in parsed.items():
+        if key not in inserted:
+            continue
+        results[index].update(status='applied', stock=consumed['stock'].get(item_id))
+        if item_id in consumed['reordered']:
+            results[index]['order_id'] = consumed['orders'][consumed['reordered'][item_id]]
+    return results, consumed['orders']
+
+def purge_usage_sync_keys():
+    """保持期間を過ぎた冪等キーを削除する"""
+    cutoff = datetime.utcnow() - timedelta(days=app.config['USAGE_SYNC_KEY_RETENTION_DAYS'])
+    deleted = db.session.execute(db.delete(UsageSyncKey.__table__).where(UsageSyncKey.received_at < cutoff)).rowcount
+    db.session.commit()
+    return deleted
+
+@write_operation('record_usage')
+def record_usage_operation(events):
+    results, orders = record_usage_events(events)
+    return {'results': results, 'orders': {str(supplier_id): order_id for supplier_id, order_id in orders.items()}}
+
+@app.route('/api/usage', methods=['POST'])
+@login_required
+def api_record_usage():
+    """使用イベントのバッチを登録する
+
+    リクエスト: {"events": [{"key", "item_id", "quantity", "patient_id", "timestamp"}, ...]}
+    レスポンス: イベントごとの結果（applied / duplicate / error）と件数
+    """
+    payload = request.get_json(silent=True)
+    events = payload.get('events') if isinstance(payload, dict) else None
+    if not isinstance(events, list):
+        return jsonify({'error': 'events を配列で指定してください'}), 400
+    if len(events) > API_USAGE_BATCH_MAX:
+        return jsonify({'error': f'1回に登録できるイベントは{API_USAGE_BATCH_MAX}件までです'}), 413
+    
+    # 入力に起因するエラーだけをクライアントに返す（それ以外は通常の500エラーとして記録される）
+    try:
+        recorded = submit_write('record_usage', events=events)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except HTTPException as e:
+        db.session.rollback()
+        return jsonify({'error': e.description}), e.code
+    
+    counts = {status: 0 for status in ('applied', 'duplicate', 'error')}
+    for result in recorded['results']:
+        counts[result['status']] += 1
+    return jsonify({
+        'results': recorded['results'],
+        'counts': counts,
+        'orders': recorded['orders']
+    })
 
 @app.route('/use_set', methods=['GET', 'POST'])
 @login_required
 def use_set():
-    patients = Patient.query.all()
-    all_item_sets = ItemSet.query.all()
+    all_item_sets = reference_item_sets()
     selected_patient_id = None
     patient_sets = []
     
@@ -605,11 +2190,12 @@ def use_set():
         if item_set_id:
             return redirect(url_for('use_item_set', set_id=item_set_id, patient_id=patient_id or 0))
     
+    # 患者の選択肢は入力に応じて読み込むため、選択済みの患者だけを渡す
+    selected_patient = db.session.get(Patient, selected_patient_id) if selected_patient_id else None
     return render_template('use_set.html', 
-                          patients=patients, 
                           patient_sets=patient_sets, 
                           item_sets=all_item_sets, 
-                          selected_patient_id=selected_patient_id)
+                          selected_patient=selected_patient)
 
 @app.route('/use_patient_set/<int:set_id>', methods=['GET', 'POST'])
 @login_required
@@ -621,77 +2207,17 @@ def use_patient_set(set_id):
         flash('このセットには備品が登録されていません', 'warning')
         return redirect(url_for('patient_sets'))
     
-    # 発注が必要な備品を追跡
-    orders_created = {}
-    
-    for set_item in set_items:
-        item = Item.query.get(set_item.item_id)
-        if not item:
-            continue
-            
-        # 使用記録を保存
-        usage = Usage(
-            item_id=item.id,
-            quantity=set_item.quantity,
-            patient_id=patient_set.patient_id,
-            usage_date=datetime.utcnow()
-        )
-        db.session.add(usage)
-        
-        # 在庫を減らす
-        item.current_stock = max(0, item.current_stock - set_item.quantity)
-        
-        # 在庫が最低在庫数を下回り、供給元がある場合、発注を生成
-        if item.current_stock <= item.minimum_stock and item.supplier_id:
-            supplier_id = item.supplier_id
-            
-            # この供給元の発注がすでに処理されているか確認
-            if supplier_id not in orders_created:
-                # 未処理の発注を検索
-                existing_order = Order.query.filter_by(
-                    supplier_id=supplier_id,
-                    status='pending'
-                ).order_by(Order.order_date.desc()).first()
-                
-                if existing_order:
-                    orders_created[supplier_id] = existing_order
-                else:
-                    # 新しい発注を作成
-                    new_order = Order(
-                        supplier_id=supplier_id,
-                        status='pending',
-                        order_date=datetime.utcnow()
-                    )
-                    db.session.add(new_order)
-                    db.session.flush()
-                    orders_created[supplier_id] = new_order
-            
-            # この発注に備品を追加
-            order = orders_created[supplier_id]
-            
-            # 同じアイテムの発注がすでにあるか確認
-            existing_order_item = OrderItem.query.filter_by(
-                order_id=order.id,
-                item_id=item.id
-            ).first()
-            
-            if existing_order_item:
-                existing_order_item.quantity += set_item.quantity
-            else:
-                new_order_item = OrderItem(
-                    order_id=order.id,
-                    item_id=item.id,
-                    quantity=set_item.quantity
-                )
-                db.session.add(new_order_item)
-    
-    db.session.commit()
+    # 使用登録と自動発注を一括処理
+    result = submit_write(
+        'use_items',
+        lines=[(set_item.item_id, set_item.quantity) for set_item in set_items],
+        patient_id=patient_set.patient_id
+    )
     
-    if orders_created:
+    if result['order_ids']:
         flash(f'患者セット {patient_set.name} を使用し、発注書を生成しました', 'success')
         # 最初の発注のIDを使用してリダイレクト
-        first_order = next(iter(orders_created.values()))
-        return redirect(url_for('view_order', order_id=first_order.id))
+        return redirect(url_for('view_order', order_id=result['order_ids'][0]))
     else:
         flash(f'患者セット {patient_set.name} を使用しました', 'success')
         return redirect(url_for('patient_sets'))
@@ -716,124 +2242,537 @@ def use_item_set(set_id):
         flash('このセットには備品が登録されていません', 'warning')
         return redirect(url_for('item_sets'))
     
-    # 発注が必要な備品を追跡
-    orders_created = {}
-    
-    for set_item in set_items:
-        item = Item.query.get(set_item.item_id)
-        if not item:
-            continue
-            
-        # 使用記録を保存
-        usage = Usage(
-            item_id=item.id,
-            quantity=set_item.quantity,
-            patient_id=patient_id,  # 患者IDが指定されていない場合はNoneになる
-            usage_date=datetime.utcnow()
-        )
-        db.session.add(usage)
-        
-        # 在庫を減らす
-        item.current_stock = max(0, item.current_stock - set_item.quantity)
-        
-        # 在庫が最低在庫数を下回り、供給元がある場合、発注を生成
-        if item.current_stock <= item.minimum_stock and item.supplier_id:
-            supplier_id = item.supplier_id
-            
-            # この供給元の発注がすでに処理されているか確認
-            if supplier_id not in orders_created:
-                # 未処理の発注を検索
-                existing_order = Order.query.filter_by(
-                    supplier_id=supplier_id,
-                    status='pending'
-                ).order_by(Order.order_date.desc()).first()
-                
-                if existing_order:
-                    orders_created[supplier_id] = existing_order
-                else:
-                    # 新しい発注を作成
-                    new_order = Order(
-                        supplier_id=supplier_id,
-                        status='pending',
-                        order_date=datetime.utcnow()
-                    )
-                    db.session.add(new_order)
-                    db.session.flush()
-                    orders_created[supplier_id] = new_order
-            
-            # この発注に備品を追加
-            order = orders_created[supplier_id]
-            
-            # 必要発注数を計算（適切な数量に戻すため）
-            order_quantity = max(1, item.minimum_stock * 2 - item.current_stock)
-            
-            # この発注にこの備品がすでに含まれているか確認
-            existing_item = OrderItem.query.filter_by(
-                order_id=order.id,
-                item_id=item.id
-            ).first()
-            
-            if existing_item:
-                # 数量を更新
-                existing_item.quantity += order_quantity
-            else:
-                # 新しいオーダーアイテムを作成
-                new_order_item = OrderItem(
-                    order_id=order.id,
-                    item_id=item.id,
-                    quantity=order_quantity
-                )
-                db.session.add(new_order_item)
-    
-    db.session.commit()
+    # 使用登録と自動発注を一括処理
+    # 汎用セットでは最低在庫数の2倍まで戻す数量を発注する
+    result = submit_write(
+        'use_items',
+        lines=[(set_item.item_id, set_item.quantity) for set_item in set_items],
+        patient_id=patient_id,
+        restock=True
+    )
     
     flash(f'汎用セット「{item_set.name}」を使用登録しました', 'success')
     
     # 発注書があれば、最初の発注書を表示
-    if orders_created:
-        first_order = list(orders_created.values())[0]
+    if result['order_ids']:
         flash('一部の備品が最低在庫数を下回ったため、自動発注されました', 'info')
-        return redirect(url_for('view_order', order_id=first_order.id))
+        return redirect(url_for('view_order', order_id=result['order_ids'][0]))
     
     return redirect(url_for('index'))
 
+# 訪問ルートの一括使用登録
+# 1日の訪問（患者とセット）をまとめて受け取り、備品ごとに数量を合算して
+# 在庫の減算・使用記録・自動発注を1つのトランザクションで行う。
+VISIT_BATCH_MAX = 200
+
+def parse_visit(visit):
+    """訪問1件を検証し (patient_id, (セットの種類, セットID), overrides) を返す
+
+    セットの種類は 'patient'（患者セット）か 'item'（汎用セット）。不正な場合は ValueError を送出する。
+    """
+    if not isinstance(visit, dict):
+        raise ValueError('訪問の形式が正しくありません')
+
+    def optional_id(name):
+        value = visit.get(name)
+        if value in (None, '', 0, '0'):
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{name} は整数で指定してください')
+
+    patient_id = optional_id('patient_id')
+    patient_set_id = optional_id('patient_set_id')
+    item_set_id = optional_id('item_set_id')
+    if bool(patient_set_id) == bool(item_set_id):
+        raise ValueError('patient_set_id と item_set_id のどちらか一方を指定してください')
+    overrides = visit.get('overrides') or {}
+    if not isinstance(overrides, dict):
+        raise ValueError('overrides は 備品ID→数量 の形式で指定してください')
+    try:
+        overrides = {int(item_id): int(quantity) for item_id, quantity in overrides.items()}
+    except (TypeError, ValueError):
+        raise ValueError('overrides の備品IDと数量は整数で指定してください')
+    if any(quantity < 0 for quantity in overrides.values()):
+        raise ValueError('overrides の数量は0以上で指定してください')
+    set_key = ('patient', patient_set_id) if patient_set_id else ('item', item_set_id)
+    return patient_id, set_key, overrides
+
+def expand_visits(visits):
+    """訪問のリストをセットの内容に展開する
+
+    visits は {'patient_id', 'patient_set_id' または 'item_set_id', 'overrides'} のリスト。
+    患者セットの patient_id は省略でき、指定した場合はセットの患者と一致する必要がある。
+    overrides（備品ID→数量）はセットの数量を置き換え（0 でその備品を使わない）、
+    セットにない備品は追加する。セット・患者・備品は訪問数に関係なく種類ごとに1回の問い合わせで読み込む。
+
+    戻り値は訪問ごとの {'patient_id', 'kind', 'set_id', 'set_name', 'items': 備品ID→数量} のリスト。
+    不正な訪問があれば何件目かを含めた ValueError を送出する。
+    """
+    parsed = []
+    for index, visit in enumerate(visits, 1):
+        try:
+            parsed.append(parse_visit(visit))
+        except ValueError as e:
+            raise ValueError(f'{index}件目: {e}')
+
+    patient_set_ids = [set_id for _, (kind, set_id), _ in parsed if kind == 'patient']
+    item_set_ids = [set_id for _, (kind, set_id), _ in parsed if kind == 'item']
+    patient_sets = {row.id: row for row in db.session.execute(
+        db.select(PatientSet.id, PatientSet.name, PatientSet.patient_id).where(PatientSet.id.in_(patient_set_ids)))}
+    item_sets = dict(db.session.execute(
+        db.select(ItemSet.id, ItemSet.name).where(ItemSet.id.in_(item_set_ids))).all())
+    contents = {}  # (セットの種類, セットID) -> 備品ID→数量
+    for row in db.session.execute(
+            db.select(SetItem.patient_set_id, SetItem.item_set_id, SetItem.item_id, SetItem.quantity)
+            .where(db.or_(SetItem.patient_set_id.in_(patient_set_ids), SetItem.item_set_id.in_(item_set_ids)))
+            .order_by(SetItem.id)):
+        key = ('patient', row.patient_set_id) if row.patient_set_id in patient_sets else ('item', row.item_set_id)
+        items = contents.setdefault(key, {})
+        items[row.item_id] = items.get(row.item_id, 0) + row.quantity
+
+    patient_ids = {patient_id for patient_id, _, _ in parsed if patient_id is not None}
+    known_patients = set(db.session.scalars(db.select(Patient.id).where(Patient.id.in_(patient_ids))))
+    override_ids = {item_id for _, _, overrides in parsed for item_id in overrides}
+    known_items = set(db.session.scalars(db.select(Item.id).where(Item.id.in_(override_ids))))
+
+    expanded = []
+    for index, (patient_id, (kind, set_id), overrides) in enumerate(parsed, 1):
+        if patient_id is not None and patient_id not in known_patients:
+            raise ValueError(f'{index}件目: 患者が見つかりません')
+        if kind == 'patient':
+            patient_set = patient_sets.get(set_id)
+            if patient_set is None:
+                raise ValueError(f'{index}件目: 患者セットが見つかりません')
+            if patient_id is not None and patient_id != patient_set.patient_id:
+                raise ValueError(f'{index}件目: 患者セットが指定した患者のものではありません')
+            patient_id, set_name = patient_set.patient_id, patient_set.name
+        else:
+            if set_id not in item_sets:
+                raise ValueError(f'{index}件目: 汎用セットが見つかりません')
+            set_name = item_sets[set_id]
+        if overrides.keys() - known_items:
+            raise ValueError(f'{index}件目: 備品が見つかりません')
+        items = dict(contents.get((kind, set_id), {}))
+        items.update(overrides)
+        expanded.append({
+            'patient_id': patient_id,
+            'kind': kind,
+            'set_id': set_id,
+            'set_name': set_name,
+            'items': {item_id: quantity for item_id, quantity in items.items() if quantity > 0}
+        })
+    return expanded
+
+def use_visits(expanded):
+    """展開した訪問をまとめて使用登録し、use_items の結果を返す
+
+    備品ごとの数量の合算と在庫の減算・自動発注は consume_stock が1回で行う。
+    汎用セットで使った備品は汎用セットの使用登録と同じく補充数量で発注する。
+    """
+    lines = []
+    restock = set()
+    for visit in expanded:
+        for item_id, quantity in visit['items'].items():
+            lines.append((item_id, quantity, visit['patient_id'], None))
+            if visit['kind'] == 'item':
+                restock.add(item_id)
+    return submit_write('use_items', lines=lines, restock=sorted(restock))
+
+def route_form_visits(with_quantities=False):
+    """訪問ルートのフォームから訪問のリストを組み立てる（セット未選択の行は無視する）
+
+    with_quantities=True なら確認画面で入力した数量（quantity-<行>-<備品ID>）を overrides にする。
+    """
+    visits = []
+    for index, (patient_id, set_value) in enumerate(zip(request.form.getlist('patient_id[]'),
+                                                        request.form.getlist('set[]'))):
+        kind, _, set_id = set_value.partition(':')
+        if not set_id:
+            continue
+        visit = {'patient_id': patient_id, f'{kind}_set_id': set_id}
+        if with_quantities:
+            prefix = f'quantity-{index}-'
+            visit['overrides'] = {name[len(prefix):]: value or 0
+                                  for name, value in request.form.items() if name.startswith(prefix)}
+        visits.append(visit)
+    return visits
+
+def route_form_preview():
+    """確認画面の送信内容から確認画面を作り直す（登録できなかったときに入力を残すため）
+
+    入力した数量は検証せずにそのまま残す。セットや患者が削除された訪問と、削除された備品の行は除く。
+    戻り値は (訪問のリスト, 除いた訪問の数)。
+    """
+    rows = []
+    dropped = 0
+    for index, (patient_id, set_value) in enumerate(zip(request.form.getlist('patient_id[]'),
+                                                        request.form.getlist('set[]'))):
+        kind, _, set_id = set_value.partition(':')
+        if kind not in ('patient', 'item') or not set_id.isdigit():
+            dropped += 1
+            continue
+        prefix = f'quantity-{index}-'
+        quantities = {int(name[len(prefix):]): value for name, value in request.form.items()
+                      if name.startswith(prefix) and name[len(prefix):].isdigit()}
+        rows.append((int(patient_id) if patient_id.isdigit() else None, kind, int(set_id), quantities))
+
+    patient_sets = {row.id: row for row in db.session.execute(
+        db.select(PatientSet.id, PatientSet.name, PatientSet.patient_id)
+        .where(PatientSet.id.in_({set_id for _, kind, set_id, _ in rows if kind == 'patient'})))}
+    item_sets = dict(db.session.execute(
+        db.select(ItemSet.id, ItemSet.name)
+        .where(ItemSet.id.in_({set_id for _, kind, set_id, _ in rows if kind == 'item'}))).all())
+    known_patients = set(db.session.scalars(
+        db.select(Patient.id).where(Patient.id.in_({row[0] for row in rows if row[0] is not None}))))
+    known_items = set(db.session.scalars(
+        db.select(Item.id).where(Item.id.in_({item_id for row in rows for item_id in row[3]}))))
+
+    preview = []
+    for patient_id, kind, set_id, quantities in rows:
+        if kind == 'patient':
+            patient_set = patient_sets.get(set_id)
+            if patient_set is None:
+                dropped += 1
+                continue
+            patient_id, set_name = patient_set.patient_id, patient_set.name
+        else:
+            if set_id not in item_sets or (patient_id is not None and patient_id not in known_patients):
+                dropped += 1
+                continue
+            set_name = item_sets[set_id]
+        preview.append({
+            'patient_id': patient_id,
+            'kind': kind,
+            'set_id': set_id,
+            'set_name': set_name,
+            'items': {item_id: quantity for item_id, quantity in quantities.items() if item_id in known_items}
+        })
+    return preview, dropped
+
+def render_route_preview(preview):
+    """訪問ルートの確認画面（セットの内容を訪問ごとに表示し、数量を変更できるようにする）"""
+    item_ids = {item_id for visit in preview for item_id in visit['items']}
+    items = {row.id: row for row in db.session.execute(
+        db.select(Item.id, Item.name, Item.unit_type, Item.current_stock).where(Item.id.in_(item_ids)))}
+    patient_names = dict(db.session.execute(
+        db.select(Patient.id, Patient.name)
+        .where(Patient.id.in_({visit['patient_id'] for visit in preview}))).all())
+    totals = {}
+    for visit in preview:
+        for item_id, quantity in visit['items'].items():
+            try:
+                quantity = max(int(quantity), 0)
+            except (TypeError, ValueError):
+                quantity = 0
+            totals[item_id] = totals.get(item_id, 0) + quantity
+    return render_template('use_route.html', preview=preview, items=items,
+                           patient_names=patient_names, totals=totals)
+
+@app.route('/use_route', methods=['GET', 'POST'])
+@login_required
+def use_route():
+    """1日の訪問ルート分のセットをまとめて使用登録する（確認画面で数量を変更できる）"""
+    if request.method == 'POST':
+        confirm = request.form.get('action') == 'confirm'
+        try:
+            visits = route_form_visits(with_quantities=confirm)
+            if not visits:
+                raise ValueError('訪問を1件以上入力してください')
+            if len(visits) > VISIT_BATCH_MAX:
+                raise ValueError(f'1回に登録できる訪問は{VISIT_BATCH_MAX}件までです')
+            expanded = expand_visits(visits)
+        except ValueError as e:
+            flash(str(e), 'danger')
+            if confirm:
+                # 確認画面での入力（訪問と変更した数量）を捨てずに確認画面を表示し直す
+                preview, dropped = route_form_preview()
+                if dropped:
+                    flash(f'セットまたは患者が削除された訪問{dropped}件を除きました', 'warning')
+                if preview:
+                    return render_route_preview(preview)
+            return redirect(url_for('use_route'))
+
+        if not confirm:
+            return render_route_preview(expanded)
+
+        result = use_visits(expanded)
+        usage_count = sum(len(visit['items']) for visit in expanded)
+        flash(f'{len(expanded)}件の訪問で {usage_count}件の使用を登録しました', 'success')
+        if result['order_ids']:
+            flash(f"在庫が最低在庫数を下回った備品を{len(result['order_ids'])}件の発注に追加しました", 'info')
+            return redirect(url_for('orders'))
+        return redirect(url_for('index'))
+
+    return render_template('use_route.html', item_sets=reference_item_sets(), rows=10)
+
+@app.route('/api/patients/<int:patient_id>/sets')
+@login_required
+def api_patient_sets(patient_id):
+    """患者の患者セット（訪問ルートのフォームでセットの選択肢にする）"""
+    rows = db.session.execute(
+        db.select(PatientSet.id, PatientSet.name).where(PatientSet.patient_id == patient_id).order_by(PatientSet.id))
+    return jsonify({'data': [{'id': row.id, 'name': row.name} for row in rows]})
+
+@app.route('/api/visits', methods=['POST'])
+@login_required
+def api_use_visits():
+    """訪問ルートのセットをまとめて使用登録する
+
+    リクエスト: {"visits": [{"patient_id", "patient_set_id" または "item_set_id", "overrides": {備品ID: 数量}}, ...]}
+    レスポンス: 訪問数・使用記録数・備品ごとの使用数の合計・発注ID
+    """
+    payload = request.get_json(silent=True)
+    visits = payload.get('visits') if isinstance(payload, dict) else None
+    if not isinstance(visits, list) or not visits:
+        return jsonify({'error': 'visits を配列で指定してください'}), 400
+    if len(visits) > VISIT_BATCH_MAX:
+        return jsonify({'error': f'1回に登録できる訪問は{VISIT_BATCH_MAX}件までです'}), 413
+    try:
+        expanded = expand_visits(visits)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    result = use_visits(expanded)
+    totals = {}
+    for visit in expanded:
+        for item_id, quantity in visit['items'].items():
+            totals[str(item_id)] = totals.get(str(item_id), 0) + quantity
+    return jsonify({
+        'visits': len(expanded),
+        'usages': sum(len(visit['items']) for visit in expanded),
+        'items': totals,
+        'order_ids': result['order_ids']
+    })
+
+ORDER_SORTS = {
+    'id': Order.id,
+    'date': Order.order_date,
+    'status': Order.status
+}
+
+ORDER_STATUSES = ('pending', 'sent', 'received')
+
+def query_orders_page():
+    """発注履歴の1ページ分を絞り込み・並び替えして取得する"""
+    params = list_params(ORDER_SORTS, 'date', 'desc')
+    filters = {
+        'status': request.args.get('status') if request.args.get('status') in ORDER_STATUSES else None,
+        'supplier_id': request.args.get('supplier_id', type=int),
+        'date_from': parse_date_arg('date_from'),
+        'date_to': parse_date_arg('date_to')
+    }
+    # 発注先は結合して取得し、品目数は集計サブクエリで取得
+    item_counts = db.select(
+        OrderItem.order_id,
+        db.func.count(OrderItem.id).label('item_count')
+    ).group_by(OrderItem.order_id).subquery()
+    stmt = db.select(Order, db.func.coalesce(item_counts.c.item_count, 0)).outerjoin(
+        item_counts, item_counts.c.order_id == Order.id
+    ).options(db.joinedload(Order.supplier))
+    if filters['status']:
+        stmt = stmt.where(Order.status == filters['status'])
+    if filters['supplier_id']:
+        stmt = stmt.where(Order.supplier_id == filters['supplier_id'])
+    if filters['date_from']:
+        stmt = stmt.where(Order.order_date >= filters['date_from'])
+    if filters['date_to']:
+        # 終了日はその日の終わりまで含める
+        stmt = stmt.where(Order.order_date < filters['date_to'] + timedelta(days=1))
+    rows, next_cursor = keyset_paginate(stmt, Order.id, params)
+    return rows, next_cursor, params, filters
+
 @app.route('/orders')
 @login_required
 def orders():
-    all_orders = Order.query.order_by(Order.order_date.desc()).all()
-    return render_template('orders.html', orders=all_orders)
+    page_orders, next_cursor, params, filters = query_orders_page()
+    all_suppliers = reference_suppliers(order_by_name=True)
+    return render_template('orders.html',
+                          orders=page_orders,
+                          suppliers=all_suppliers,
+                          params=params,
+                          filters=filters,
+                          **pagination_urls(next_cursor))
+
+@app.route('/api/orders')
+@login_required
+def api_orders():
+    page_orders, next_cursor, params, filters = query_orders_page()
+    return jsonify({
+        'data': [{
+            'id': order.id,
+            'order_date': order.order_date.isoformat(),
+            'supplier_id': order.supplier_id,
+            'supplier_name': order.supplier.name if order.supplier else None,
+            'status': order.status,
+            'item_count': item_count
+        } for order, item_count in page_orders],
+        'next_cursor': next_cursor,
+        'sort': params['sort'],
+        'order': params['order']
+    })
+
+@app.route('/reorder_scan', methods=['POST'])
+@login_required
+def reorder_scan_route():
+    """在庫が最低在庫数以下の備品をまとめて発注に追加する"""
+    try:
+        result = submit_write('reorder_scan')
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"在庫一括確認エラー: {e}")
+        flash(f'在庫の確認中にエラーが発生しました: {str(e)}', 'danger')
+        return redirect(url_for('orders'))
+    
+    if result['items']:
+        flash(f"{result['items']}件の備品を{len(result['order_ids'])}件の発注に追加しました", 'success')
+    else:
+        flash('新たに発注が必要な備品はありません', 'info')
+    return redirect(url_for('orders'))
 
 @app.route('/view_order/<int:order_id>')
 @login_required
 def view_order(order_id):
-    order = Order.query.get_or_404(order_id)
+    # 発注先と明細の備品をまとめて取得
+    order = Order.query.options(
+        db.joinedload(Order.supplier),
+        db.selectinload(Order.items).joinedload(OrderItem.item)
+    ).filter_by(id=order_id).first_or_404()
     return render_template('view_order.html', order=order)
 
-# PDFの作成関数を修正
-def create_order_pdf(order_id):
-    from reportlab.lib.styles import getSampleStyleSheet
-    from reportlab.lib import colors
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.pagesizes import A4, mm
-    
-    # 日本語フォントサポートをインポート
-    from japanese_pdf import setup_japanese_fonts, japanese_paragraph
-    
-    order = Order.query.get_or_404(order_id)
-    supplier = order.supplier
-    order_items = OrderItem.query.filter_by(order_id=order_id).all()
+# 発注書PDFのキャッシュ
+class PdfCache:
+    """生成済みPDFを内容のハッシュで保持するLRUキャッシュ（ワーカープロセスごと）"""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= len(self._entries.pop(key))
+            self._entries[key] = data
+            self.total_bytes += len(data)
+            # 上限を超えたら最も古く使われたものから削除
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+# 一括生成で使うプロセス数
+app.config['PDF_WORKERS'] = int(os.environ.get('PDF_WORKERS', os.cpu_count() or 1))
+
+pdf_cache = PdfCache(
+    max_entries=int(os.environ.get('PDF_CACHE_MAX_ENTRIES', 256)),
+    max_bytes=int(os.environ.get('PDF_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+)
+
+def order_pdf_snapshots(order_ids):
+    """発注書に印字する内容を発注ごとの辞書にまとめる（キャッシュのキーと描画の両方に使う）
+
+    発注・発注先・明細・クリニック情報をそれぞれ1回のクエリで読み込む。
+    戻り値は 発注ID→内容 の辞書（発注ID順）。存在しない発注IDは含まれない。
+    """
+    order_ids = list(order_ids)
+    orders = Order.query.options(db.joinedload(Order.supplier)).filter(
+        Order.id.in_(order_ids)
+    ).order_by(Order.id).all()
+    lines = db.session.execute(
+        db.select(OrderItem.order_id, Item.name, Item.unit_type, OrderItem.quantity)
+        .join(Item, Item.id == OrderItem.item_id)
+        .where(OrderItem.order_id.in_(order_ids))
+        .order_by(OrderItem.id)
+    ).all()
+    lines_by_order = {}
+    for row in lines:
+        lines_by_order.setdefault(row.order_id, []).append([row.name, row.unit_type, row.quantity])
     
     # クリニック情報を取得
-    clinic_info = ClinicInfo.query.first()
+    clinic_info = reference_clinic()
     
     if not clinic_info:
         clinic_info = ClinicInfo(name="訪問診療クリニック")
         db.session.add(clinic_info)
         db.session.commit()
     
+    clinic = {
+        'name': clinic_info.name,
+        'director': clinic_info.director,
+        'address': clinic_info.address,
+        'phone': clinic_info.phone,
+        'fax': clinic_info.fax
+    }
+    
+    # ステータスは印字しないため含めない（送信済みにしてもキャッシュが使える）
+    return {order.id: {
+        'order': {'id': order.id, 'order_date': order.order_date.strftime('%Y年%m月%d日')},
+        'supplier': {
+            'name': order.supplier.name,
+            'address': order.supplier.address,
+            'fax_number': order.supplier.fax_number,
+            'email': order.supplier.email
+        },
+        'clinic': clinic,
+        'items': lines_by_order.get(order.id, [])
+    } for order in orders}
+
+def order_pdf_snapshot(order_id):
+    """1件の発注書の内容を返す。発注がなければ404"""
+    snapshot = order_pdf_snapshots([order_id]).get(order_id)
+    if snapshot is None:
+        abort(404)
+    return snapshot
+
+def snapshot_hash(snapshot):
+    return hashlib.sha256(json.dumps(snapshot, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def render_order_pdf(snapshot):
+    """発注書の内容からPDFのバイト列を生成する"""
+    from reportlab.platypus import SimpleDocTemplate
+    from reportlab.lib.pagesizes import A4, mm
+    
     # PDF生成
     buffer = io.BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=20*mm, leftMargin=20*mm, topMargin=20*mm, bottomMargin=20*mm)
+    doc.build(order_pdf_elements(snapshot, doc))
+    return buffer.getvalue()
+
+def timed_render_order_pdf(snapshot):
+    """render_order_pdf の結果と描画時間を返す（プロセスプールの子プロセスから時間を受け取るため）"""
+    started = time.perf_counter()
+    pdf_bytes = render_order_pdf(snapshot)
+    return pdf_bytes, time.perf_counter() - started
+
+def order_pdf_elements(snapshot, doc):
+    """発注書1件分のPDF要素を作る"""
+    from reportlab.lib import colors
+    from reportlab.platypus import Table, TableStyle, Spacer
+    from reportlab.lib.pagesizes import mm
+    
+    # 日本語フォントサポートをインポート（フォント登録はプロセスごとに1回）
+    from japanese_pdf import setup_japanese_fonts, japanese_paragraph
+    
+    order = snapshot['order']
+    supplier = snapshot['supplier']
+    clinic_info = snapshot['clinic']
     
     # 日本語フォントと日本語用スタイルを設定
     styles = setup_japanese_fonts()
@@ -845,40 +2784,40 @@ def create_order_pdf(order_id):
     elements.append(Spacer(1, 5*mm))
     
     # 発注情報（右上）
-    elements.append(japanese_paragraph(f"発注日: {order.order_date.strftime('%Y年%m月%d日')}", styles['JapaneseRight']))
-    elements.append(japanese_paragraph(f"発注番号: {order.id}", styles['JapaneseRight']))
+    elements.append(japanese_paragraph(f"発注日: {order['order_date']}", styles['JapaneseRight']))
+    elements.append(japanese_paragraph(f"発注番号: {order['id']}", styles['JapaneseRight']))
     elements.append(Spacer(1, 10*mm))
     
     # 発注先情報
     elements.append(japanese_paragraph("<b>【発注先】</b>", styles['JapaneseNormal']))
-    elements.append(japanese_paragraph(f"{supplier.name}", styles['JapaneseNormal']))
+    elements.append(japanese_paragraph(f"{supplier['name']}", styles['JapaneseNormal']))
     
-    if supplier.address:
-        elements.append(japanese_paragraph(f"住所: {supplier.address}", styles['JapaneseNormal']))
+    if supplier['address']:
+        elements.append(japanese_paragraph(f"住所: {supplier['address']}", styles['JapaneseNormal']))
     
-    if supplier.fax_number:
-        elements.append(japanese_paragraph(f"FAX: {supplier.fax_number}", styles['JapaneseNormal']))
+    if supplier['fax_number']:
+        elements.append(japanese_paragraph(f"FAX: {supplier['fax_number']}", styles['JapaneseNormal']))
     
-    if supplier.email:
-        elements.append(japanese_paragraph(f"メール: {supplier.email}", styles['JapaneseNormal']))
+    if supplier['email']:
+        elements.append(japanese_paragraph(f"メール: {supplier['email']}", styles['JapaneseNormal']))
     
     elements.append(Spacer(1, 10*mm))
     
     # 発注元クリニック情報
     elements.append(japanese_paragraph("<b>【発注元】</b>", styles['JapaneseNormal']))
-    elements.append(japanese_paragraph(f"{clinic_info.name}", styles['JapaneseNormal']))
+    elements.append(japanese_paragraph(f"{clinic_info['name']}", styles['JapaneseNormal']))
     
-    if clinic_info.director:
-        elements.append(japanese_paragraph(f"院長: {clinic_info.director}", styles['JapaneseNormal']))
+    if clinic_info['director']:
+        elements.append(japanese_paragraph(f"院長: {clinic_info['director']}", styles['JapaneseNormal']))
     
-    if clinic_info.address:
-        elements.append(japanese_paragraph(f"住所: {clinic_info.address}", styles['JapaneseNormal']))
+    if clinic_info['address']:
+        elements.append(japanese_paragraph(f"住所: {clinic_info['address']}", styles['JapaneseNormal']))
     
-    if clinic_info.phone:
-        elements.append(japanese_paragraph(f"TEL: {clinic_info.phone}", styles['JapaneseNormal']))
+    if clinic_info['phone']:
+        elements.append(japanese_paragraph(f"TEL: {clinic_info['phone']}", styles['JapaneseNormal']))
     
-    if clinic_info.fax:
-        elements.append(japanese_paragraph(f"FAX: {clinic_info.fax}", styles['JapaneseNormal']))
+    if clinic_info['fax']:
+        elements.append(japanese_paragraph(f"FAX: {clinic_info['fax']}", styles['JapaneseNormal']))
     
     elements.append(Spacer(1, 15*mm))
     
@@ -887,12 +2826,11 @@ def create_order_pdf(order_id):
              japanese_paragraph("数量", styles['JapaneseNormal']), 
              japanese_paragraph("単位", styles['JapaneseNormal'])]]
     
-    for order_item in order_items:
-        item = order_item.item
-        unit = "箱" if item.unit_type == "box" else "個"
+    for name, unit_type, quantity in snapshot['items']:
+        unit = "箱" if unit_type == "box" else "個"
         data.append([
-            japanese_paragraph(item.name, styles['JapaneseNormal']),
-            japanese_paragraph(str(order_item.quantity), styles['JapaneseNormal']),
+            japanese_paragraph(name, styles['JapaneseNormal']),
+            japanese_paragraph(str(quantity), styles['JapaneseNormal']),
             japanese_paragraph(unit, styles['JapaneseNormal'])
         ])
     
@@ -916,54 +2854,194 @@ def create_order_pdf(order_id):
     elements.append(japanese_paragraph("<b>備考:</b>", styles['JapaneseNormal']))
     elements.append(japanese_paragraph("このFAXは自動生成されています。ご不明点は発注元までお問い合わせください。", styles['JapaneseNormal']))
     
-    # PDFを生成
-    doc.build(elements)
-    buffer.seek(0)
-    return buffer
+    return elements
+
+def create_order_pdf(order_id):
+    """発注書PDFを返す。内容が前回と同じならキャッシュ済みのPDFを使う"""
+    snapshot = order_pdf_snapshot(order_id)
+    key = snapshot_hash(snapshot)
+    pdf_bytes = pdf_cache.get(key)
+    if pdf_bytes is None:
+        pdf_bytes, seconds = timed_render_order_pdf(snapshot)
+        record_pdf_render(seconds)
+        pdf_cache.put(key, pdf_bytes)
+    return io.BytesIO(pdf_bytes)
+
+def render_order_pdfs(order_ids, workers=None):
+    """複数の発注書PDFをプロセスプールで並列に生成する
+
+    キャッシュ済みのものはそのまま使い、残りだけを並列に描画する。
+    戻り値は 発注ID→PDFのバイト列 の辞書（発注ID順）。
+    """
+    snapshots = order_pdf_snapshots(order_ids)
+    keys = {order_id: snapshot_hash(snapshot) for order_id, snapshot in snapshots.items()}
+    pdfs = {}
+    missing = []
+    for order_id, key in keys.items():
+        pdf_bytes = pdf_cache.get(key)
+        if pdf_bytes is None:
+            missing.append(order_id)
+        else:
+            pdfs[order_id] = pdf_bytes
+
+    workers = workers or app.config['PDF_WORKERS']
+    if len(missing) > 1 and workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(missing))) as executor:
+            rendered = executor.map(timed_render_order_pdf, [snapshots[order_id] for order_id in missing])
+            rendered = list(rendered)
+    else:
+        rendered = [timed_render_order_pdf(snapshots[order_id]) for order_id in missing]
+
+    for order_id, (pdf_bytes, seconds) in zip(missing, rendered):
+        record_pdf_render(seconds)
+        pdf_cache.put(keys[order_id], pdf_bytes)
+        pdfs[order_id] = pdf_bytes
+    return {order_id: pdfs[order_id] for order_id in snapshots}
+
+def render_merged_order_pdf(order_ids, workers=None):
+    """複数の発注書を1つのPDFにまとめる（発注ごとに改ページ）
+
+    発注ごとのPDFは render_order_pdfs でキャッシュとプロセスプールを使って用意し、ページを連結する。
+    """
+    from pypdf import PdfWriter
+    
+    pdfs = render_order_pdfs(order_ids, workers)
+    writer = PdfWriter()
+    for pdf_bytes in pdfs.values():
+        writer.append(io.BytesIO(pdf_bytes))
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue(), list(pdfs)
+
+def build_order_sheets(order_ids, output_format='zip', workers=None):
+    """発注書をZIPまたは結合PDFとして作成し、対象のうち未処理の発注を一括で送信済みにする
+
+    戻り値は (バイト列, ファイル名, MIMEタイプ, 出力した発注ID)。
+    """
+    if output_format == 'merged':
+        data, exported = render_merged_order_pdf(order_ids, workers)
+        filename = 'orders.pdf'
+        mimetype = 'application/pdf'
+    else:
+        pdfs = render_order_pdfs(order_ids, workers)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for order_id, pdf_bytes in pdfs.items():
+                archive.writestr(f'order_{order_id}.pdf', pdf_bytes)
+        data = buffer.getvalue()
+        exported = list(pdfs)
+        filename = 'orders.zip'
+        mimetype = 'application/zip'
+
+    # ステータスの更新は1回のUPDATEで行う（受領済みなどの発注は送信済みに戻さない）
+    if exported:
+        db.session.execute(
+            db.update(Order.__table__).where(Order.id.in_(exported), Order.status == 'pending').values(status='sent')
+        )
+        db.session.commit()
+    return data, filename, mimetype, exported
+
+def pending_order_ids():
+    return list(db.session.scalars(
+        db.select(Order.id).where(Order.status == 'pending').order_by(Order.id)
+    ))
 
 @app.route('/generate_pdf/<int:order_id>')
 @login_required
 def generate_pdf(order_id):
+    """1件の発注書はジョブにせずその場で返す（キャッシュにあれば描画もしない）"""
+    Order.query.get_or_404(order_id)
     try:
         pdf_buffer = create_order_pdf(order_id)
         
-        # 発注のステータスを更新
-        order = Order.query.get_or_404(order_id)
-        order.status = 'sent'
+        # 未処理の発注だけ送信済みにする
+        db.session.execute(db.update(Order.__table__).where(Order.id == order_id, Order.status == 'pending').values(status='sent'))
         db.session.commit()
         
         return send_file(pdf_buffer, as_attachment=True, download_name=f"order_{order_id}.pdf", mimetype='application/pdf')
     except Exception as e:
+        db.session.rollback()
         app.logger.error(f"PDF生成エラー: {e}")
         flash(f'PDF生成中にエラーが発生しました: {str(e)}', 'danger')
         return redirect(url_for('index'))
 
+@app.route('/generate_pdfs', methods=['POST'])
+@login_required
+def generate_pdfs():
+    """未処理の発注書（または選択した発注書）をまとめて出力する（ジョブを登録し発注を送信済みにするためPOSTのみ）"""
+    order_ids = [int(order_id) for order_id in request.form.getlist('order_ids[]') if order_id.isdigit()]
+    if not order_ids:
+        order_ids = pending_order_ids()
+    if not order_ids:
+        flash('出力する発注書がありません', 'warning')
+        return redirect(url_for('orders'))
+    
+    output_format = request.form.get('format', 'zip')
+    try:
+        job = submit_job('generate_pdfs', {'order_ids': order_ids, 'format': output_format})
+        return redirect(url_for('job_status', job_id=job.id))
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"PDF一括生成エラー: {e}")
+        flash(f'PDF一括生成中にエラーが発生しました: {str(e)}', 'danger')
+        return redirect(url_for('orders'))
+
+REPORT_PERIODS = ('month', 'quarter', 'year')
+
+def report_range(period, year, month):
+    """レポート期間の開始日・終了日（終了日は含まない）と表示名を返す"""
+    if period == 'year':
+        return datetime(year, 1, 1), datetime(year + 1, 1, 1), f'{year}年'
+    if period == 'quarter':
+        quarter = (month - 1) // 3 + 1
+        first_month = (quarter - 1) * 3 + 1
+        start_date = datetime(year, first_month, 1)
+        end_date = datetime(year + 1, 1, 1) if quarter == 4 else datetime(year, first_month + 3, 1)
+        return start_date, end_date, f'{year}年 第{quarter}四半期（{first_month}月〜{first_month + 2}月）'
+    # 月初と月末
+    start_date = datetime(year, month, 1)
+    if month == 12:
+        end_date = datetime(year + 1, 1, 1)
+    else:
+        end_date = datetime(year, month + 1, 1)
+    return start_date, end_date, f'{year}年{month}月'
+
 @app.route('/monthly_report', methods=['GET', 'POST'])
 @login_required
 def monthly_report():
     year = datetime.now().year
     month = datetime.now().month
+    period = 'month'
     
     if request.method == 'POST':
         year = request.form.get('year', type=int)
         month = request.form.get('month', type=int)
+        period = request.form.get('period', 'month')
+    if period not in REPORT_PERIODS:
+        period = 'month'
     
-    # 月初と月末
-    start_date = datetime(year, month, 1)
-    if month == 12:
-        end_date = datetime(year + 1, 1, 1)
-    else:
-        end_date = datetime(year, month + 1, 1)
+    start_date, end_date, period_label = report_range(period, year, month)
+    usages, orders = report_totals(start_date, end_date)
     
-    # 使用量集計
+    return render_template('monthly_report.html', 
+                          usages=usages, 
+                          orders=orders, 
+                          year=year, 
+                          month=month,
+                          period=period,
+                          period_label=period_label)
+
+def report_totals(start_date, end_date):
+    """期間内の備品ごとの使用量・発注量を返す"""
+    # 使用量集計（日別集計テーブルから読むため、使用記録の件数に依存しない）
     usages = db.session.query(
         Item.name,
-        db.func.sum(Usage.quantity).label('total_quantity')
+        db.func.sum(UsageDailyRollup.quantity).label('total_quantity')
     ).join(
-        Usage, Usage.item_id == Item.id
+        UsageDailyRollup, UsageDailyRollup.item_id == Item.id
     ).filter(
-        Usage.usage_date >= start_date,
-        Usage.usage_date < end_date
+        UsageDailyRollup.day >= start_date.date(),
+        UsageDailyRollup.day < end_date.date()
     ).group_by(
         Item.id
     ).all()
@@ -971,29 +3049,218 @@ def monthly_report():
     # 発注量集計
     orders = db.session.query(
         Item.name,
-        db.func.sum(OrderItem.quantity).label('total_quantity')
-    ).join(
-        OrderItem, OrderItem.item_id == Item.id
+        db.func.sum(OrderDailyRollup.quantity).label('total_quantity')
     ).join(
-        Order, Order.id == OrderItem.order_id
+        OrderDailyRollup, OrderDailyRollup.item_id == Item.id
     ).filter(
-        Order.order_date >= start_date,
-        Order.order_date < end_date
+        OrderDailyRollup.day >= start_date.date(),
+        OrderDailyRollup.day < end_date.date()
     ).group_by(
         Item.id
     ).all()
+    return usages, orders
+
+def build_report_csv(period, year, month):
+    """レポートをCSV（Excelで開けるようBOM付きUTF-8）で作成する"""
+    start_date, end_date, period_label = report_range(period, year, month)
+    usages, orders = report_totals(start_date, end_date)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['期間', '区分', '備品名', '数量'])
+    for row in usages:
+        writer.writerow([period_label, '使用量', row.name, row.total_quantity])
+    for row in orders:
+        writer.writerow([period_label, '発注量', row.name, row.total_quantity])
+    filename = f"report_{start_date.strftime('%Y%m%d')}_{period}.csv"
+    return buffer.getvalue().encode('utf-8-sig'), filename
+
+@app.route('/export_report', methods=['POST'])
+@login_required
+def export_report():
+    period = request.form.get('period', 'month')
+    if period not in REPORT_PERIODS:
+        period = 'month'
+    params = {
+        'period': period,
+        'year': request.form.get('year', datetime.now().year, type=int),
+        'month': request.form.get('month', datetime.now().month, type=int)
+    }
+    job = submit_job('export_report', params)
+    return redirect(url_for('job_status', job_id=job.id))
+
+# 需要予測・推奨最低在庫数
+app.config['FORECAST_WINDOW_DAYS'] = int(os.environ.get('FORECAST_WINDOW_DAYS', 180))
+app.config['FORECAST_MOVING_AVERAGE_DAYS'] = int(os.environ.get('FORECAST_MOVING_AVERAGE_DAYS', 28))
+app.config['FORECAST_LEAD_TIME_DAYS'] = int(os.environ.get('FORECAST_LEAD_TIME_DAYS', 7))
+app.config['FORECAST_SERVICE_LEVEL_Z'] = float(os.environ.get('FORECAST_SERVICE_LEVEL_Z', 1.65))  # 欠品率 約5%
+FORECAST_DISPLAY_LIMIT = 500
+
+class DemandCache:
+    """使用量の日別集計を 備品×日 の行列としてプロセス内に保持する
+
+    2回目以降は前回読み込んだ最終日以降の行だけを読み直し、期間が進んだ分は
+    行列をずらす。それより前の日の合計が変わっていれば（復元・集計の作り直しなど）
+    全体を読み直す。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.matrix = None
+        self.item_index = None
+        self.start_day = None
+        self.loaded_from = None
+
+    def _load(self, since):
+        import forecast
+        # 日付は期間の開始日からの日数としてDB側で整数に変換して読む
+        rollup = UsageDailyRollup.__table__
+        rows = db.session.execute(
+            db.select(
+                rollup.c.item_id,
+                days_since(rollup.c.day, self.start_day),
+                rollup.c.quantity
+            ).where(rollup.c.day >= since)
+        ).all()
+        if not rows:
+            return
+        item_ids, day_offsets, quantities = zip(*rows)
+        self.matrix, self.item_index = forecast.add_items(self.matrix, self.item_index, item_ids)
+        forecast.add_demand(self.matrix, self.item_index, item_ids, day_offsets, quantities)
+
+    def _advance(self, start_day, window):
+        """期間の開始日を進め、確定済みの日の合計がDBと一致すれば True を返す"""
+        import numpy as np
+        if self.matrix is None or self.matrix.shape[1] != window or self.loaded_from < start_day:
+            return False
+        shift = (start_day - self.start_day).days
+        if shift < 0:
+            return False
+        if shift:
+            self.matrix = np.roll(self.matrix, -shift, axis=1)
+            self.matrix[:, window - shift:] = 0
+            self.start_day = start_day
+
+        settled = (self.loaded_from - start_day).days
+        count, total = db.session.execute(
+            db.select(db.func.count(), db.func.coalesce(db.func.sum(UsageDailyRollup.quantity), 0))
+            .where(UsageDailyRollup.day >= start_day, UsageDailyRollup.day < self.loaded_from)
+        ).one()
+        settled_part = self.matrix[:, :settled]
+        return count == np.count_nonzero(settled_part) and total == settled_part.sum()
+
+    def refresh(self, today):
+        """today までの需要行列に更新する。lock を取得した状態で呼び出す"""
+        import numpy as np
+        window = app.config['FORECAST_WINDOW_DAYS']
+        start_day = today - timedelta(days=window - 1)
+        if self._advance(start_day, window):
+            # 最後に読み込んだ日はその後も使用が加算されているため読み直す
+            self.matrix[:, (self.loaded_from - start_day).days:] = 0
+            self._load(self.loaded_from)
+        else:
+            self.start_day = start_day
+            self.item_index = np.zeros(0, dtype=np.int64)
+            self.matrix = np.zeros((0, window), dtype=np.float64)
+            self._load(start_day)
+        self.loaded_from = today
+
+demand_cache = DemandCache()
+
+def minimum_stock_suggestions():
+    """使用履歴のある備品について、需要の統計と推奨最低在庫数を返す
+
+    全備品の計算はNumPyでまとめて行う。戻り値は辞書のリストで、
+    推奨値と現在の最低在庫数の差が大きい順に並ぶ。
+    """
+    import forecast
+    with demand_cache.lock:
+        demand_cache.refresh(datetime.utcnow().date())
+        stats = forecast.demand_statistics(
+            demand_cache.matrix,
+            app.config['FORECAST_MOVING_AVERAGE_DAYS'],
+            app.config['FORECAST_LEAD_TIME_DAYS'],
+            app.config['FORECAST_SERVICE_LEVEL_Z']
+        )
+        item_ids = demand_cache.item_index.tolist()
+    columns = {key: values.tolist() for key, values in stats.items()}
+
+    items = {row.id: row for row in db.session.execute(
+        db.select(Item.id, Item.name, Item.minimum_stock, Item.current_stock)
+    )}
+    suggestions = []
+    for index, item_id in enumerate(item_ids):
+        item = items.get(item_id)
+        # 期間内に使用がない備品は推奨値を出さない
+        if item is None or columns['mean'][index] == 0:
+            continue
+        suggestions.append({
+            'item_id': item_id,
+            'name': item.name,
+            'minimum_stock': item.minimum_stock or 0,
+            'current_stock': item.current_stock or 0,
+            'mean': columns['mean'][index],
+            'moving_average': columns['moving_average'][index],
+            'std': columns['std'][index],
+            'safety_stock': columns['safety_stock'][index],
+            'suggested': columns['suggested'][index]
+        })
+    suggestions.sort(key=lambda s: (-abs(s['suggested'] - s['minimum_stock']), s['item_id']))
+    return suggestions
+
+def apply_minimum_stock(values):
+    """備品ID→最低在庫数 の辞書を1回の一括UPDATEで反映する。コミットは呼び出し側で行う"""
+    if not values:
+        return 0
+    db.session.execute(
+        db.update(Item),
+        [{'id': item_id, 'minimum_stock': minimum_stock} for item_id, minimum_stock in values.items()]
+    )
+    return len(values)
+
+@app.route('/forecast')
+@login_required
+def forecast_view():
+    suggestions = minimum_stock_suggestions()
+    changes = [s for s in suggestions if s['suggested'] != s['minimum_stock']]
+    return render_template('forecast.html',
+                          suggestions=changes[:FORECAST_DISPLAY_LIMIT],
+                          change_count=len(changes),
+                          item_count=len(suggestions),
+                          window_days=app.config['FORECAST_WINDOW_DAYS'],
+                          moving_average_days=app.config['FORECAST_MOVING_AVERAGE_DAYS'],
+                          lead_time_days=app.config['FORECAST_LEAD_TIME_DAYS'])
+
+@app.route('/forecast/apply', methods=['POST'])
+@login_required
+def apply_forecast():
+    """推奨最低在庫数を選択した備品（またはすべて）に一括で反映する"""
+    suggestions = minimum_stock_suggestions()
+    if request.form.get('apply_all'):
+        selected = None
+    else:
+        selected = {int(item_id) for item_id in request.form.getlist('item_ids[]') if item_id.isdigit()}
+        if not selected:
+            flash('備品が選択されていません', 'warning')
+            return redirect(url_for('forecast_view'))
     
-    return render_template('monthly_report.html', 
-                          usages=usages, 
-                          orders=orders, 
-                          year=year, 
-                          month=month)
+    values = {
+        s['item_id']: s['suggested'] for s in suggestions
+        if s['suggested'] != s['minimum_stock'] and (selected is None or s['item_id'] in selected)
+    }
+    try:
+        count = apply_minimum_stock(values)
+        db.session.commit()
+        flash(f'{count}件の備品の最低在庫数を更新しました', 'success')
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"最低在庫数一括更新エラー: {e}")
+        flash(f'最低在庫数の更新中にエラーが発生しました: {str(e)}', 'danger')
+    return redirect(url_for('forecast_view'))
 
 @app.route('/patient_set/<int:set_id>', methods=['GET', 'POST'])
 @login_required
 def patient_set_detail(set_id):
     patient_set = PatientSet.query.get_or_404(set_id)
-    all_items = Item.query.all()
     
     if request.method == 'POST':
         # 既存のアイテムをすべて削除
@@ -1024,13 +3291,12 @@ def patient_set_detail(set_id):
         flash('患者セットを更新しました', 'success')
         return redirect(url_for('patient_set_detail', set_id=set_id))
     
-    # 現在のセットアイテムを取得
-    set_items = SetItem.query.filter_by(patient_set_id=set_id).all()
+    # 現在のセットアイテムを取得（選択中の備品の名前と在庫を表示するため備品も一緒に読み込む）
+    set_items = SetItem.query.options(orm.joinedload(SetItem.item)).filter_by(patient_set_id=set_id).all()
     
     return render_template(
         'patient_set_detail.html', 
         patient_set=patient_set,
-        all_items=all_items,
         set_items=set_items
     )
 
@@ -1038,7 +3304,6 @@ def patient_set_detail(set_id):
 @login_required
 def item_set_detail(set_id):
     item_set = ItemSet.query.get_or_404(set_id)
-    all_items = Item.query.all()
     
     if request.method == 'POST':
         # 既存のアイテムをすべて削除
@@ -1069,13 +3334,12 @@ def item_set_detail(set_id):
         flash('汎用セットを更新しました', 'success')
         return redirect(url_for('item_set_detail', set_id=set_id))
     
-    # 現在のセットアイテムを取得
-    set_items = SetItem.query.filter_by(item_set_id=set_id).all()
+    # 現在のセットアイテムを取得（選択中の備品の名前と在庫を表示するため備品も一緒に読み込む）
+    set_items = SetItem.query.options(orm.joinedload(SetItem.item)).filter_by(item_set_id=set_id).all()
     
     return render_template(
         'item_set_detail.html', 
         item_set=item_set,
-        all_items=all_items,
         set_items=set_items
     )
 
@@ -1083,94 +3347,23 @@ def item_set_detail(set_id):
 @login_required
 def bulk_use_items():
     """複数備品を一括で使用登録する機能"""
-    items = Item.query.all()
-    patients = Patient.query.all()
-    
     if request.method == 'POST':
         patient_id = request.form.get('patient_id')
         item_ids = request.form.getlist('item_id[]')
         quantities = request.form.getlist('quantity[]')
         
-        # 発注情報を集約するための辞書
-        orders_by_supplier = {}
-        
-        for i in range(len(item_ids)):
-            item_id = item_ids[i]
-            quantity = int(quantities[i])
-            
-            if not item_id or quantity <= 0:
-                continue
-                
-            item = Item.query.get_or_404(item_id)
-            
-            # 使用記録を保存
-            usage = Usage(
-                item_id=item.id,
-                quantity=quantity,
-                patient_id=patient_id if patient_id else None,
-                usage_date=datetime.utcnow()
-            )
-            db.session.add(usage)
-            
-            # 在庫を減らす
-            item.current_stock = max(0, item.current_stock - quantity)
-            
-            # 在庫が最低在庫数を下回ったら発注
-            if item.current_stock <= item.minimum_stock and item.supplier_id:
-                supplier_id = item.supplier_id
-                
-                # 今日の発注がすでにあるか確認
-                if supplier_id in orders_by_supplier:
-                    order = orders_by_supplier[supplier_id]
-                else:
-                    existing_order = Order.query.filter_by(
-                        supplier_id=supplier_id,
-                        status='pending'
-                    ).order_by(Order.order_date.desc()).first()
-                    
-                    if existing_order:
-                        order = existing_order
-                    else:
-                        # 新しい発注を作成
-                        new_order = Order(
-                            supplier_id=supplier_id,
-                            status='pending',
-                            order_date=datetime.utcnow()
-                        )
-                        db.session.add(new_order)
-                        db.session.flush()
-                        order = new_order
-                    
-                    orders_by_supplier[supplier_id] = order
-                
-                # 同じアイテムの発注がすでにあるか確認
-                existing_order_item = OrderItem.query.filter_by(
-                    order_id=order.id,
-                    item_id=item.id
-                ).first()
-                
-                if existing_order_item:
-                    existing_order_item.quantity += quantity
-                else:
-                    new_order_item = OrderItem(
-                        order_id=order.id,
-                        item_id=item.id,
-                        quantity=quantity
-                    )
-                    db.session.add(new_order_item)
-        
-        db.session.commit()
+        result = submit_write('use_items', lines=list(zip(item_ids, quantities)),
+                              patient_id=patient_id if patient_id else None, require_all=True)
         
-        if orders_by_supplier:
+        if result['order_ids']:
             flash('備品を使用登録し、発注書を生成しました', 'success')
             # 最初の発注を表示
-            first_order = list(orders_by_supplier.values())[0]
-            return redirect(url_for('view_order', order_id=first_order.id))
+            return redirect(url_for('view_order', order_id=result['order_ids'][0]))
         else:
             flash('備品を使用登録しました', 'success')
             return redirect(url_for('items'))
     
-    return render_template('bulk_use_items.html', items=items, patients=patients)
+    return render_template('bulk_use_items.html')
 
 @app.route('/patient_sets_manage/<int:patient_id>')
 @login_required
@@ -1181,14 +3374,10 @@ def patient_sets_manage(patient_id):
     # この患者に関連付けられたセットを取得
     patient_sets = PatientSet.query.filter_by(patient_id=patient_id).all()
     
-    # 全ての備品を取得（新規セット追加用）
-    all_items = Item.query.all()
-    
     return render_template(
         'patient_sets_manage.html', 
         patient=patient, 
-        patient_sets=patient_sets, 
-        items=all_items
+        patient_sets=patient_sets
     )
 
 @app.route('/delete_patient_set/<int:set_id>')
@@ -1237,31 +3426,52 @@ def clinic_settings():
 @login_required
 def edit_item(item_id):
     item = Item.query.get_or_404(item_id)
-    suppliers = Supplier.query.all()
     
     if request.method == 'POST':
-        item.name = request.form['name']
-        item.unit_type = request.form['unit_type']
+        values = {
+            'name': request.form['name'],
+            'unit_type': request.form['unit_type']
+        }
         
-        if item.unit_type == 'box' and request.form['items_per_box']:
-            item.items_per_box = int(request.form['items_per_box'])
+        if values['unit_type'] == 'box' and request.form['items_per_box']:
+            values['items_per_box'] = int(request.form['items_per_box'])
         else:
-            item.items_per_box = None
+            values['items_per_box'] = None
             
-        item.minimum_stock = int(request.form['minimum_stock'])
-        item.current_stock = int(request.form['current_stock'])
+        values['minimum_stock'] = int(request.form['minimum_stock'])
+        values['current_stock'] = int(request.form['current_stock'])
         
         supplier_id = request.form.get('supplier_id')
         if supplier_id and supplier_id != 'none':
-            item.supplier_id = int(supplier_id)
+            values['supplier_id'] = int(supplier_id)
         else:
-            item.supplier_id = None
+            values['supplier_id'] = None
             
-        db.session.commit()
+        submit_write('update_item', item_id=item.id, values=values)
         flash('備品情報を更新しました', 'success')
         return redirect(url_for('items'))
         
-    return render_template('edit_item.html', item=item, suppliers=suppliers)
+    return render_template('edit_item.html', item=item)
+
+ITEM_EDIT_FIELDS = ('name', 'unit_type', 'items_per_box', 'minimum_stock', 'current_stock', 'supplier_id')
+
+@write_operation('update_item')
+def update_item(item_id, values):
+    """備品の情報（在庫数を含む）を書き換える。values は 列名→値"""
+    item = db.session.get(Item, item_id)
+    if item is None:
+        abort(404)
+    for field, value in values.items():
+        if field in ITEM_EDIT_FIELDS:
+            setattr(item, field, value)
+
+@write_operation('update_item_stock')
+def update_item_stock(item_id, field, value):
+    """備品の現在の在庫数または最低在庫数を書き換える"""
+    item = db.session.get(Item, item_id)
+    if item is None:
+        abort(404)
+    setattr(item, field, value)
 
 @app.route('/update_stock', methods=['POST'])
 @login_required
@@ -1274,26 +3484,118 @@ def update_stock():
         if not all([item_id, field, value]):
             return jsonify({'success': False, 'message': '必要なパラメータが不足しています'}), 400
             
-        item = Item.query.get_or_404(item_id)
-        
-        if field == 'current_stock':
-            item.current_stock = int(value)
-        elif field == 'minimum_stock':
-            item.minimum_stock = int(value)
-        else:
+        if field not in ('current_stock', 'minimum_stock'):
             return jsonify({'success': False, 'message': '無効なフィールドです'}), 400
             
-        db.session.commit()
+        submit_write('update_item_stock', item_id=int(item_id), field=field, value=int(value))
         return jsonify({'success': True})
     except Exception as e:
         app.logger.error(f"在庫更新エラー: {e}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
 # CSVファイルからの物品インポート
+IMPORT_ERROR_REPORT_LIMIT = 200
+
+def parse_item_row(row, supplier_ids):
+    """CSVの1行を備品の辞書に変換する。取り込めない場合は理由付きで ValueError"""
+    if len(row) < 5:  # 最低限必要な列数
+        raise ValueError('列数が不足しています')
+    
+    name = row[0].strip()
+    if not name:
+        raise ValueError('備品名が空です')
+    if len(name) > 100:
+        raise ValueError('備品名が長すぎます')
+        
+    unit_type = row[1].strip().lower() if row[1] else 'individual'
+    
+    # 単位タイプの確認
+    if unit_type not in ['individual', 'box']:
+        unit_type = 'individual'  # デフォルトは個別
+    
+    try:
+        if unit_type == 'box' and len(row) > 2 and row[2]:
+            items_per_box = int(row[2])
+        else:
+            items_per_box = None if unit_type == 'individual' else 1
+            
+        minimum_stock = int(row[3]) if row[3] else 1
+        current_stock = int(row[4]) if row[4] else 0
+    except ValueError:
+        raise ValueError('数値の列に数値以外が含まれています')
+    
+    # 発注先IDの取得（あれば）
+    supplier_id = None
+    if len(row) > 5 and row[5]:
+        supplier_id = supplier_ids.get(row[5].strip())
+    
+    return {
+        'name': name,
+        'unit_type': unit_type,
+        'items_per_box': items_per_box,
+        'minimum_stock': minimum_stock,
+        'current_stock': current_stock,
+        'supplier_id': supplier_id
+    }
+
+@write_operation('insert_items')
+def insert_items(rows):
+    """備品をまとめて追加し、追加した件数を返す（rows は parse_item_row の辞書のリスト）"""
+    db.session.execute(db.insert(Item), rows)
+    return len(rows)
+
+def import_items_csv(binary_stream, chunk_size=None, progress=None):
+    """CSVを少しずつ読み込み、一定行数ごとに一括INSERTする
+
+    ファイル全体をメモリに載せないため、行数が多くてもメモリ使用量は一定。
+    チャンクごとにコミットするので、書き込みロックを長時間保持しない。
+    progress を指定するとチャンクごとに (処理済み行数, 追加件数) で呼び出す。
+    戻り値は {'added': 追加件数, 'error_count': エラー件数, 'errors': [{'line', 'reason'}]}
+    （errors は先頭 IMPORT_ERROR_REPORT_LIMIT 件まで）。
+    """
+    chunk_size = chunk_size or app.config['IMPORT_CHUNK_SIZE']
+    # 発注先名→IDの対応は最初に1回だけ作る
+    supplier_ids = {}
+    for supplier_id, supplier_name in db.session.execute(db.select(Supplier.id, Supplier.name).order_by(Supplier.id.desc())):
+        supplier_ids[supplier_name] = supplier_id
+    
+    report = {'added': 0, 'error_count': 0, 'errors': [], 'rows': 0}
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', errors='replace', newline='')
+    reader = csv.reader(text_stream)
+    
+    # ヘッダー行をスキップ
+    next(reader, None)
+    
+    chunk = []
+    for row in reader:
+        # 空行はスキップ
+        if not row or not any(row):
+            continue
+        report['rows'] += 1
+        try:
+            chunk.append(parse_item_row(row, supplier_ids))
+        except ValueError as e:
+            report['error_count'] += 1
+            if len(report['errors']) < IMPORT_ERROR_REPORT_LIMIT:
+                report['errors'].append({'line': reader.line_num, 'reason': str(e)})
+            continue
+        
+        if len(chunk) >= chunk_size:
+            report['added'] += submit_write('insert_items', rows=chunk)
+            chunk = []
+            if progress:
+                progress(report['rows'], report['added'])
+    
+    if chunk:
+        report['added'] += submit_write('insert_items', rows=chunk)
+    if progress:
+        progress(report['rows'], report['added'])
+    return report
+
 @app.route('/import_items', methods=['GET', 'POST'])
 @login_required
 def import_items():
-    suppliers = Supplier.query.all()
+    suppliers = reference_suppliers()
     
     if request.method == 'POST':
         if 'csv_file' not in request.files:
@@ -1308,91 +3610,11 @@ def import_items():
         
         if file and file.filename.endswith('.csv'):
             try:
-                # CSVファイルを読み込む
-                stream = io.StringIO(file.stream.read().decode('utf-8-sig', errors='replace'))
-                csv_data = list(csv.reader(stream))
-                
-                if len(csv_data) < 2:  # ヘッダー行 + 少なくとも1行のデータ
-                    flash('CSVファイルにデータが含まれていません', 'warning')
-                    return redirect(request.url)
-                
-                # ヘッダー行をスキップ
-                csv_data = csv_data[1:]
-                items_added = 0
-                errors = 0
-                
-                for row in csv_data:
-                    # 空行はスキップ
-                    if not row or not any(row):
-                        continue
-                        
-                    if len(row) < 5:  # 最低限必要な列数
-                        errors += 1
-                        continue
-                    
-                    try:
-                        name = row[0].strip()
-                        if not name:  # 備品名が空の場合はスキップ
-                            errors += 1
-                            continue
-                            
-                        unit_type = row[1].strip().lower() if len(row) > 1 and row[1] else 'individual'
-                        
-                        # 単位タイプの確認
-                        if unit_type not in ['individual', 'box']:
-                            unit_type = 'individual'  # デフォルトは個別
-                        
-                        try:
-                            if unit_type == 'box' and len(row) > 2 and row[2]:
-                                items_per_box = int(row[2])
-                            else:
-                                items_per_box = None if unit_type == 'individual' else 1
-                                
-                            minimum_stock = int(row[3]) if len(row) > 3 and row[3] else 1
-                            current_stock = int(row[4]) if len(row) > 4 and row[4] else 0
-                        except ValueError:
-                            # 数値変換エラー
-                            errors += 1
-                            continue
-                            
-                        # 発注先IDの取得（あれば）
-                        supplier_id = None
-                        if len(row) > 5 and row[5]:
-                            supplier_name = row[5].strip()
-                            supplier = Supplier.query.filter_by(name=supplier_name).first()
-                            if supplier:
-                                supplier_id = supplier.id
-                        
-                        # 物品の追加
-                        item = Item(
-                            name=name,
-                            unit_type=unit_type,
-                            items_per_box=items_per_box,
-                            minimum_stock=minimum_stock,
-                            current_stock=current_stock,
-                            supplier_id=supplier_id
-                        )
-                        db.session.add(item)
-                        items_added += 1
-                        
-                    except Exception as e:
-                        app.logger.error(f"行の処理エラー: {str(e)}, 行データ: {row}")
-                        errors += 1
-                        continue
-                
-                db.session.commit()
-                
-                if items_added > 0:
-                    success_msg = f'{items_added}個の物品をインポートしました'
-                    if errors > 0:
-                        success_msg += f'（{errors}行は処理できませんでした）'
-                    flash(success_msg, 'success')
-                    return redirect(url_for('items'))
-                else:
-                    flash('インポート可能な物品データがありませんでした', 'warning')
-                    return redirect(request.url)
-                
+                # 取り込みはバックグラウンドで行い、進捗画面に移動する
+                job = submit_job('import_items', upload=file)
+                return redirect(url_for('job_status', job_id=job.id))
             except Exception as e:
+                db.session.rollback()
                 app.logger.error(f"CSVインポートエラー: {str(e)}")
                 flash(f'CSVファイルの処理中にエラーが発生しました: {str(e)}', 'danger')
                 return redirect(request.url)
@@ -1436,27 +3658,10 @@ def import_suppliers():
                     flash(f'CSVファイルに必須フィールド {", ".join(missing_fields)} が含まれていません', 'danger')
                     return redirect(url_for('suppliers'))
                 
-                # データのインポート
-                import_count = 0
-                for row in reader:
-                    # 名前は必須
-                    if not row['name']:
-                        continue
-                    
-                    # 既存の発注先をチェック（同じ名前の場合は更新）
-                    supplier = Supplier.query.filter_by(name=row['name']).first()
-                    if not supplier:
-                        supplier = Supplier()
-                        db.session.add(supplier)
-                    
-                    supplier.name = row['name']
-                    supplier.fax_number = row.get('fax_number', '')
-                    supplier.address = row.get('address', '')
-                    supplier.email = row.get('email', '')
-                    
-                    import_count += 1
-                
-                db.session.commit()
+                # データのインポート（名前は必須）
+                rows = [{field: row.get(field, '') for field in ('name', 'fax_number', 'address', 'email')}
+                        for row in reader if row['name']]
+                import_count = submit_write('import_suppliers', rows=rows)
                 flash(f'{import_count}件の発注先をインポートしました', 'success')
                 
             except Exception as e:
@@ -1469,6 +3674,22 @@ def import_suppliers():
     
     return redirect(url_for('suppliers'))
 
+@write_operation('import_suppliers')
+def import_suppliers_operation(rows):
+    """発注先を追加し、同じ名前の発注先があれば更新する。件数を返す"""
+    for row in rows:
+        # 既存の発注先をチェック（同じ名前の場合は更新）
+        supplier = Supplier.query.filter_by(name=row['name']).first()
+        if not supplier:
+            supplier = Supplier()
+            db.session.add(supplier)
+        
+        supplier.name = row['name']
+        supplier.fax_number = row['fax_number']
+        supplier.address = row['address']
+        supplier.email = row['email']
+    return len(rows)
+
 # 既存データの削除
 @app.route('/clear_all_data', methods=['GET', 'POST'])
 @login_required
@@ -1476,6 +3697,8 @@ def clear_all_data():
     if request.method == 'POST':
         try:
             # 削除する順序を考慮して実行
+            UsageDailyRollup.query.delete()
+            OrderDailyRollup.query.delete()
             Usage.query.delete()
             OrderItem.query.delete()
             SetItem.query.delete()
@@ -1502,82 +3725,294 @@ def clear_all_data():
     return render_template('clear_all_data.html')
 
 # バックアップ機能
+BACKUP_BATCH_SIZE = 1000
+
+# バックアップに含めるテーブル（復元時もこの順で適用する）
+BACKUP_TABLES = [
+    ('suppliers', Supplier),
+    ('items', Item),
+    ('patients', Patient),
+    ('patient_sets', PatientSet),
+    ('item_sets', ItemSet),
+    ('set_items', SetItem),
+    ('usages', Usage),
+    ('orders', Order),
+    ('order_items', OrderItem)
+]
+
+CLINIC_BACKUP_FIELDS = ['name', 'address', 'phone', 'fax', 'email', 'website', 'director']
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} はJSONに変換できません')
+
+def iter_table_rows(model, batch_size=BACKUP_BATCH_SIZE):
+    """テーブルの全行をID順に一定件数ずつ読み込み、1行ずつ辞書で返す"""
+    columns = list(model.__table__.columns)
+    id_column = model.__table__.c.id
+    last_id = None
+    while True:
+        stmt = db.select(*columns).order_by(id_column).limit(batch_size)
+        if last_id is not None:
+            stmt = stmt.where(id_column > last_id)
+        rows = db.session.execute(stmt).all()
+        if not rows:
+            return
+        for row in rows:
+            yield dict(row._mapping)
+        last_id = rows[-1].id
+
+def iter_backup_json():
+    """バックアップのJSONを少しずつ文字列で返す（DB全体をメモリに載せない）"""
+    clinic_data = ClinicInfo.query.first()
+    clinic = {} if not clinic_data else {field: getattr(clinic_data, field) for field in CLINIC_BACKUP_FIELDS}
+    yield '{"version": 2, "clinic": ' + json.dumps(clinic, ensure_ascii=False)
+    
+    for key, model in BACKUP_TABLES:
+        yield f', "{key}": ['
+        first = True
+        for row in iter_table_rows(model):
+            yield ('' if first else ', ') + json.dumps(row, ensure_ascii=False, default=json_default)
+            first = False
+        yield ']'
+    yield '}\n'
+
+def iter_gzip(chunks):
+    """文字列のストリームをgzip圧縮しながら返す"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= 64 * 1024:
+            compressed = compressor.compress(b''.join(buffer))
+            buffer, size = [], 0
+            if compressed:
+                yield compressed
+    yield compressor.compress(b''.join(buffer)) + compressor.flush()
+
+def iter_encoded(chunks, flush_size=64 * 1024):
+    """小さな文字列をまとめてからバイト列で返す"""
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= flush_size:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
 @app.route('/backup_data')
 @login_required
 def backup_data():
+    # 全テーブル（使用履歴・発注履歴を含む）を一定件数ずつ読み込みながら送信する
+    use_gzip = request.args.get('gzip') == '1'
+    if use_gzip:
+        body = iter_gzip(iter_backup_json())
+        filename = 'medical_inventory_backup.json.gz'
+        mimetype = 'application/gzip'
+    else:
+        body = iter_encoded(iter_backup_json())
+        filename = 'medical_inventory_backup.json'
+        mimetype = 'application/json'
+    
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    return response
+
+# 復元機能
+RESTORE_CHUNK_SIZE = 1000
+
+class BackupReader:
+    """バックアップのJSONを先頭から少しずつ解析する
+
+    トップレベルのオブジェクトのキーごとに値を返し、配列は要素を1つずつ返すため、
+    ファイル全体をメモリに読み込まずに復元できる。
+    """
+
+    def __init__(self, stream, read_size=64 * 1024):
+        self.stream = stream
+        self.read_size = read_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        if self.eof:
+            return False
+        data = self.stream.read(self.read_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        """空白を読み飛ばして次の1文字を返す（終端なら空文字）"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError(f'バックアップファイルの形式が正しくありません（{char} が必要です）')
+        self.pos += 1
+
+    def _value(self):
+        """値を1つ解析する。バッファの末尾で終わる値は続きを読んでから確定する"""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def _array(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self._value()
+            char = self._peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError('バックアップファイルの形式が正しくありません')
+
+    def sections(self):
+        """(キー, 値) を順に返す。値が配列の場合は要素のイテレータになる"""
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if self._peek() == '[':
+                elements = self._array()
+                yield key, elements
+                # 呼び出し側が読まなかった要素は読み飛ばす
+                for _ in elements:
+                    pass
+            else:
+                yield key, self._value()
+            char = self._peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError('バックアップファイルの形式が正しくありません')
+
+def open_backup_stream(binary_stream):
+    """gzip圧縮されていれば展開し、テキストとして読めるストリームを返す"""
+    head = binary_stream.read(2)
+    binary_stream.seek(0)
+    if head == b'\x1f\x8b':
+        binary_stream = gzip.GzipFile(fileobj=binary_stream, mode='rb')
+    return io.TextIOWrapper(binary_stream, encoding='utf-8')
+
+def upsert_rows(model, rows):
+    """IDをキーに一括で追加・更新する（INSERT ... ON CONFLICT DO UPDATE）
+
+    古い形式のバックアップなど列がそろっていない行もあるため、含まれる列の組み合わせごとに実行する。
+    行にない列は追加時は列の既定値になり、更新時は既存の値を残す。
+    """
+    table = model.__table__
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row), []).append(row)
+    for names, group in groups.items():
+        stmt = dialect_insert(table)
+        set_ = {name: stmt.excluded[name] for name in names if name != 'id'}
+        if set_:
+            stmt = stmt.on_conflict_do_update(index_elements=['id'], set_=set_)
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=['id'])
+        db.session.execute(stmt, group)
+
+def backup_row_values(table, data):
+    """バックアップの1行をテーブルの列に合わせて変換する（バックアップにない列は含めない）"""
+    values = {}
+    for column in table.columns:
+        if column.name not in data:
+            continue
+        value = data[column.name]
+        if value is not None and isinstance(column.type, db.DateTime):
+            value = datetime.fromisoformat(value)
+        values[column.name] = value
+    return values
+
+def restore_backup(binary_stream, progress=None):
+    """バックアップを少しずつ読み込み、テーブルごとに一括upsertで復元する
+
+    全体を1つのトランザクションで適用し、最後にコミットする。
+    progress を指定すると (テーブル名, 処理済み件数) で随時呼び出す。
+    戻り値は テーブル名→復元件数 の辞書。
+    """
+    models = dict(BACKUP_TABLES)
+    counts = {}
+    reader = BackupReader(open_backup_stream(binary_stream))
     try:
-        # データベースの内容を取得
-        clinic_data = ClinicInfo.query.first()
-        items_data = Item.query.all()
-        suppliers_data = Supplier.query.all()
-        patients_data = Patient.query.all()
-        patient_sets_data = PatientSet.query.all()
-        item_sets_data = ItemSet.query.all()
-        set_items_data = SetItem.query.all()
-        
-        # JSONに変換するための辞書を作成
-        backup = {
-            'clinic': {} if not clinic_data else {
-                'name': clinic_data.name,
-                'address': clinic_data.address,
-                'phone': clinic_data.phone,
-                'fax': clinic_data.fax,
-                'email': clinic_data.email,
-                'website': clinic_data.website,
-                'director': clinic_data.director
-            },
-            'suppliers': [{
-                'id': s.id, 
-                'name': s.name, 
-                'fax_number': s.fax_number,
-                'address': s.address,
-                'email': s.email
-            } for s in suppliers_data],
-            'items': [{
-                'id': i.id,
-                'name': i.name,
-                'unit_type': i.unit_type,
-                'items_per_box': i.items_per_box,
-                'minimum_stock': i.minimum_stock,
-                'current_stock': i.current_stock,
-                'supplier_id': i.supplier_id
-            } for i in items_data],
-            'patients': [{
-                'id': p.id,
-                'name': p.name,
-                'patient_id': p.patient_id,
-                'address': p.address,
-                'phone': p.phone
-            } for p in patients_data],
-            'patient_sets': [{
-                'id': ps.id,
-                'name': ps.name,
-                'patient_id': ps.patient_id
-            } for ps in patient_sets_data],
-            'item_sets': [{
-                'id': its.id,
-                'name': its.name,
-                'description': its.description
-            } for its in item_sets_data],
-            'set_items': [{
-                'id': si.id,
-                'patient_set_id': si.patient_set_id,
-                'item_set_id': si.item_set_id,
-                'item_id': si.item_id,
-                'quantity': si.quantity
-            } for si in set_items_data]
-        }
+        for key, value in reader.sections():
+            if key == 'clinic':
+                # クリニック情報の復元
+                if value:
+                    clinic = ClinicInfo.query.first()
+                    if not clinic:
+                        clinic = ClinicInfo()
+                        db.session.add(clinic)
+                    
+                    clinic.name = value.get('name', 'クリニック名')
+                    for field in CLINIC_BACKUP_FIELDS[1:]:
+                        setattr(clinic, field, value.get(field))
+                    db.session.flush()
+                continue
+            
+            model = models.get(key)
+            if model is None:
+                continue
+            
+            counts[key] = 0
+            chunk = []
+            for data in value:
+                chunk.append(backup_row_values(model.__table__, data))
+                if len(chunk) >= RESTORE_CHUNK_SIZE:
+                    upsert_rows(model, chunk)
+                    counts[key] += len(chunk)
+                    chunk = []
+                    if progress:
+                        progress(key, counts[key])
+            if chunk:
+                upsert_rows(model, chunk)
+                counts[key] += len(chunk)
+            if progress:
+                progress(key, counts[key])
         
-        # JSON形式でダウンロード
-        response = jsonify(backup)
-        response.headers.set('Content-Disposition', 'attachment', filename='medical_inventory_backup.json')
-        return response
-    except Exception as e:
-        app.logger.error(f"バックアップエラー: {e}")
-        flash('バックアップの作成中にエラーが発生しました', 'danger')
-        return redirect(url_for('index'))
+        # 使用・発注履歴を復元した場合は日別集計を作り直す（ここでコミットされる）
+        if counts.get('usages') or counts.get('order_items'):
+            rebuild_rollups()
+        else:
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return counts
 
-# 復元機能
 @app.route('/restore_data', methods=['GET', 'POST'])
 @login_required
 def restore_data():
@@ -1593,155 +4028,295 @@ def restore_data():
             
         if file:
             try:
-                # JSONファイルを読み込む
-                backup_data = json.loads(file.read().decode('utf-8'))
-                
-                # クリニック情報の復元
-                if backup_data.get('clinic'):
-                    clinic = ClinicInfo.query.first()
-                    if not clinic:
-                        clinic = ClinicInfo()
-                        db.session.add(clinic)
-                    
-                    clinic_data = backup_data['clinic']
-                    clinic.name = clinic_data.get('name', 'クリニック名')
-                    clinic.address = clinic_data.get('address')
-                    clinic.phone = clinic_data.get('phone')
-                    clinic.fax = clinic_data.get('fax')
-                    clinic.email = clinic_data.get('email')
-                    clinic.website = clinic_data.get('website')
-                    clinic.director = clinic_data.get('director')
-                
-                # 発注先情報の復元
-                if backup_data.get('suppliers'):
-                    # 既存のIDマッピングを作成
-                    existing_suppliers = {s.id: s for s in Supplier.query.all()}
-                    
-                    for supplier_data in backup_data['suppliers']:
-                        supplier_id = supplier_data.get('id')
-                        if supplier_id in existing_suppliers:
-                            # 既存の発注先を更新
-                            supplier = existing_suppliers[supplier_id]
-                        else:
-                            # 新規発注先を作成
-                            supplier = Supplier()
-                            db.session.add(supplier)
-                        
-                        supplier.name = supplier_data.get('name')
-                        supplier.fax_number = supplier_data.get('fax_number')
-                        supplier.address = supplier_data.get('address')
-                        supplier.email = supplier_data.get('email')
-                
-                # 備品情報の復元
-                if backup_data.get('items'):
-                    # 既存のIDマッピングを作成
-                    existing_items = {i.id: i for i in Item.query.all()}
-                    
-                    for item_data in backup_data['items']:
-                        item_id = item_data.get('id')
-                        if item_id in existing_items:
-                            # 既存の備品を更新
-                            item = existing_items[item_id]
-                        else:
-                            # 新規備品を作成
-                            item = Item()
-                            db.session.add(item)
-                        
-                        item.name = item_data.get('name')
-                        item.unit_type = item_data.get('unit_type')
-                        item.items_per_box = item_data.get('items_per_box')
-                        item.minimum_stock = item_data.get('minimum_stock')
-                        item.current_stock = item_data.get('current_stock')
-                        item.supplier_id = item_data.get('supplier_id')
-                
-                # 患者情報の復元
-                if backup_data.get('patients'):
-                    # 既存のIDマッピングを作成
-                    existing_patients = {p.id: p for p in Patient.query.all()}
-                    
-                    for patient_data in backup_data['patients']:
-                        patient_id = patient_data.get('id')
-                        if patient_id in existing_patients:
-                            # 既存の患者を更新
-                            patient = existing_patients[patient_id]
-                        else:
-                            # 新規患者を作成
-                            patient = Patient()
-                            db.session.add(patient)
-                        
-                        patient.name = patient_data.get('name')
-                        patient.patient_id = patient_data.get('patient_id')
-                        patient.address = patient_data.get('address')
-                        patient.phone = patient_data.get('phone')
-                
-                # 患者セット情報の復元
-                if backup_data.get('patient_sets'):
-                    # 既存のIDマッピングを作成
-                    existing_patient_sets = {ps.id: ps for ps in PatientSet.query.all()}
-                    
-                    for ps_data in backup_data['patient_sets']:
-                        ps_id = ps_data.get('id')
-                        if ps_id in existing_patient_sets:
-                            # 既存の患者セットを更新
-                            ps = existing_patient_sets[ps_id]
-                        else:
-                            # 新規患者セットを作成
-                            ps = PatientSet()
-                            db.session.add(ps)
-                        
-                        ps.name = ps_data.get('name')
-                        ps.patient_id = ps_data.get('patient_id')
-                
-                # 備品セット情報の復元
-                if backup_data.get('item_sets'):
-                    # 既存のIDマッピングを作成
-                    existing_item_sets = {its.id: its for its in ItemSet.query.all()}
-                    
-                    for its_data in backup_data['item_sets']:
-                        its_id = its_data.get('id')
-                        if its_id in existing_item_sets:
-                            # 既存の備品セットを更新
-                            its = existing_item_sets[its_id]
-                        else:
-                            # 新規備品セットを作成
-                            its = ItemSet()
-                            db.session.add(its)
-                        
-                        its.name = its_data.get('name')
-                        its.description = its_data.get('description')
-                
-                # セット内容の復元
-                if backup_data.get('set_items'):
-                    # 既存のIDマッピングを作成
-                    existing_set_items = {si.id: si for si in SetItem.query.all()}
-                    
-                    for si_data in backup_data['set_items']:
-                        si_id = si_data.get('id')
-                        if si_id in existing_set_items:
-                            # 既存のセットアイテムを更新
-                            si = existing_set_items[si_id]
-                        else:
-                            # 新規セットアイテムを作成
-                            si = SetItem()
-                            db.session.add(si)
-                        
-                        si.patient_set_id = si_data.get('patient_set_id')
-                        si.item_set_id = si_data.get('item_set_id')
-                        si.item_id = si_data.get('item_id')
-                        si.quantity = si_data.get('quantity')
-                
-                # 変更をコミット
-                db.session.commit()
-                
-                flash('データを正常に復元しました', 'success')
-                return redirect(url_for('index'))
+                # 復元はバックグラウンドで行い、進捗画面に移動する
+                job = submit_job('restore_data', upload=file)
+                return redirect(url_for('job_status', job_id=job.id))
             except Exception as e:
+                db.session.rollback()
                 app.logger.error(f"リストアエラー: {e}")
                 flash(f'データ復元中にエラーが発生しました: {str(e)}', 'danger')
                 return redirect(request.url)
     
     return render_template('restore_data.html')
 
+# バックグラウンドジョブ
+# 重い処理はジョブテーブルに登録し、gunicornと並んで起動するワーカープロセス（worker.py）が
+# 順に実行する。Webリクエストは登録後すぐに進捗画面へリダイレクトする。
+# 時間のかかる復元・インポートは 'maintenance' キューに分け、別のワーカーで実行して
+# PDF作成やレポート出力（'default' キュー）がその後ろで待たないようにする。
+app.config['JOB_DIR'] = os.environ.get('JOB_DIR', os.path.join(os.path.dirname(db_file), 'jobs'))
+app.config['JOB_POLL_INTERVAL'] = float(os.environ.get('JOB_POLL_INTERVAL', 1.0))
+app.config['JOB_RETENTION_DAYS'] = int(os.environ.get('JOB_RETENTION_DAYS', 7))
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+JOB_QUEUES = ('default', 'maintenance')
+JOB_HANDLERS = {}
+
+def job_handler(kind, label, queue='default'):
+    """ジョブの処理関数を登録する
+
+    処理関数は (params, progress) を受け取り、(結果の辞書, 出力ファイル) を返す。
+    出力ファイルは (バイト列, ファイル名, MIMEタイプ) または None。
+    progress(done, total=None, message=None) で進捗を報告できる。
+    """
+    def decorator(f):
+        JOB_HANDLERS[kind] = {'run': f, 'label': label, 'queue': queue}
+        return f
+    return decorator
+
+def job_kinds(queue=None):
+    """キューで実行するジョブの種類（None ならすべて）"""
+    return [kind for kind, handler in JOB_HANDLERS.items() if queue is None or handler['queue'] == queue]
+
+def job_path(job_id, suffix):
+    os.makedirs(app.config['JOB_DIR'], exist_ok=True)
+    return os.path.join(app.config['JOB_DIR'], f'{job_id}.{suffix}')
+
+def submit_job(kind, params=None, upload=None):
+    """ジョブを登録する。upload を指定するとファイルを保存してから登録する"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f'不明なジョブの種類です: {kind}')
+    if params is not None and not isinstance(params, dict):
+        raise ValueError('ジョブのパラメータは辞書で指定してください')
+    params = dict(params or {})
+    job = Job(kind=kind, status='queued')
+    db.session.add(job)
+    db.session.flush()
+    if upload is not None:
+        # ワーカーが拾う前にファイルを置いておくため、コミットより先に保存する
+        params['path'] = job_path(job.id, 'input')
+        upload.save(params['path'])
+    job.params = json.dumps(params, ensure_ascii=False)
+    db.session.commit()
+    return job
+
+def write_job_progress(job_id, done, total=None, message=None):
+    """実行中の進捗をファイルに書く
+
+    復元などはDBの書き込みトランザクションを開いたまま進むため、
+    進捗はDBではなくジョブディレクトリのファイルで受け渡す。
+    """
+    path = job_path(job_id, 'progress')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'done': done, 'total': total, 'message': message}, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
+def read_job_progress(job_id):
+    try:
+        with open(job_path(job_id, 'progress'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def job_to_dict(job):
+    data = {
+        'id': job.id,
+        'kind': job.kind,
+        'label': JOB_HANDLERS.get(job.kind, {}).get('label', job.kind),
+        'status': job.status,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'progress': read_job_progress(job.id) if job.status == 'running' else None,
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error,
+        'result_url': url_for('job_result', job_id=job.id) if job.result_file else None
+    }
+    return data
+
+def claim_next_job(queue=None):
+    """キューで待機中の最も古いジョブを実行中にしてIDを返す（なければNone）"""
+    next_id = db.select(Job.id).where(Job.status == 'queued', Job.kind.in_(job_kinds(queue))) \
+        .order_by(Job.id).limit(1).scalar_subquery()
+    job_id = db.session.execute(
+        db.update(Job.__table__)
+        .where(Job.id == next_id, Job.status == 'queued')
+        .values(status='running', started_at=datetime.now())
+        .returning(Job.id)
+    ).scalar()
+    db.session.commit()
+    return job_id
+
+def finish_job(job_id, status, result=None, error=None, output=None):
+    values = {'status': status, 'finished_at': datetime.now(), 'error': error}
+    if result is not None:
+        values['result'] = json.dumps(result, ensure_ascii=False, default=json_default)
+    if output is not None:
+        data, filename, mimetype = output
+        path = job_path(job_id, 'result')
+        with open(path, 'wb') as f:
+            f.write(data)
+        values.update(result_file=path, result_name=filename, result_mimetype=mimetype)
+    db.session.execute(db.update(Job.__table__).where(Job.id == job_id).values(**values))
+    db.session.commit()
+
+def run_job(job_id):
+    job = db.session.get(Job, job_id)
+    params = json.loads(job.params or '{}')
+    handler = JOB_HANDLERS.get(job.kind)
+
+    def progress(done, total=None, message=None):
+        write_job_progress(job_id, done, total, message)
+
+    app.logger.info(f"ジョブ開始: {job_id} {job.kind}")
+    kind = job.kind
+    start_metrics_scope(f'job:{kind}')
+    started = time.perf_counter()
+    status = 'failed'
+    try:
+        if handler is None:
+            raise ValueError(f'不明なジョブの種類です: {job.kind}')
+        result, output = handler['run'](params, progress)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"ジョブエラー: {job_id} {e}")
+        finish_job(job_id, 'failed', error=str(e))
+    else:
+        finish_job(job_id, 'done', result=result, output=output)
+        status = 'done'
+        app.logger.info(f"ジョブ完了: {job_id}")
+    finally:
+        metrics.inc('inventory_jobs_total', [('kind', kind), ('status', status)])
+        metrics.observe('inventory_job_duration_seconds', time.perf_counter() - started, [('kind', kind)])
+        record_sql_metrics()
+        if 'sql_profile' in g:
+            log_sql_profile(sql_profile_summary())
+        db.session.remove()
+        for suffix in ('input', 'progress'):
+            if os.path.exists(job_path(job_id, suffix)):
+                os.remove(job_path(job_id, suffix))
+
+def purge_old_jobs():
+    """保持期間を過ぎた終了済みジョブと出力ファイルを削除する"""
+    cutoff = datetime.now() - timedelta(days=app.config['JOB_RETENTION_DAYS'])
+    old_jobs = db.session.execute(
+        db.select(Job.id, Job.result_file).where(Job.status.in_(('done', 'failed')), Job.finished_at < cutoff)
+    ).all()
+    for job_id, result_file in old_jobs:
+        if result_file and os.path.exists(result_file):
+            os.remove(result_file)
+    if old_jobs:
+        db.session.execute(db.delete(Job.__table__).where(Job.id.in_([job_id for job_id, _ in old_jobs])))
+        db.session.commit()
+    return len(old_jobs)
+
+def run_job_worker(once=False, queue=None):
+    """キューのジョブを順に実行し続ける（キューごとにワーカーは1つだけ起動する想定）
+
+    queue=None ならすべてのキューのジョブを実行する。古いジョブなどの削除は
+    'maintenance' 以外のワーカーが行う。once=True なら待機中のジョブがなくなった時点で終了する。
+    """
+    housekeeping = queue != 'maintenance'
+    with app.app_context():
+        # 前回のワーカーが途中で止まった場合、実行中のままのジョブは失敗として扱う
+        db.session.execute(
+            db.update(Job.__table__).where(Job.status == 'running', Job.kind.in_(job_kinds(queue)))
+            .values(status='failed', finished_at=datetime.now(), error='ワーカーが停止したため中断されました')
+        )
+        db.session.commit()
+        if housekeeping:
+            purge_old_jobs()
+            purge_usage_sync_keys()
+        last_purge = time.monotonic()
+        while True:
+            try:
+                job_id = claim_next_job(queue)
+            except OperationalError as e:
+                # 復元中などで書き込みロックを取れないときは、次の確認まで待つ
+                db.session.rollback()
+                app.logger.warning(f"ジョブを取得できませんでした: {e}")
+                job_id = None
+            if job_id is not None:
+                run_job(job_id)
+                continue
+            if once:
+                return
+            if housekeeping and time.monotonic() - last_purge > 3600:
+                purge_old_jobs()
+                compact_change_log()
+                purge_usage_sync_keys()
+                last_purge = time.monotonic()
+            db.session.remove()
+            time.sleep(app.config['JOB_POLL_INTERVAL'])
+
+@job_handler('import_items', '備品CSVインポート', queue='maintenance')
+def import_items_job(params, progress):
+    with open(params['path'], 'rb') as f:
+        report = import_items_csv(f, progress=lambda rows, added: progress(rows, None, f'{added}件追加'))
+    return report, None
+
+@job_handler('restore_data', 'データ復元', queue='maintenance')
+def restore_data_job(params, progress):
+    with open(params['path'], 'rb') as f:
+        counts = restore_backup(f, progress=lambda key, count: progress(count, None, key))
+    return {'counts': counts}, None
+
+@job_handler('generate_pdf', '発注書PDF作成')
+def generate_pdf_job(params, progress):
+    order_id = params['order_id']
+    pdf_buffer = create_order_pdf(order_id)
+    
+    # 未処理の発注だけ送信済みにする
+    db.session.execute(db.update(Order.__table__).where(Order.id == order_id, Order.status == 'pending').values(status='sent'))
+    db.session.commit()
+    return {'exported': [order_id]}, (pdf_buffer.getvalue(), f'order_{order_id}.pdf', 'application/pdf')
+
+@job_handler('generate_pdfs', '発注書一括作成')
+def generate_pdfs_job(params, progress):
+    order_ids = params['order_ids']
+    progress(0, len(order_ids), '発注書を作成しています')
+    data, filename, mimetype, exported = build_order_sheets(order_ids, params.get('format', 'zip'))
+    return {'exported': exported}, (data, filename, mimetype)
+
+@job_handler('export_report', 'レポートCSV出力')
+def export_report_job(params, progress):
+    data, filename = build_report_csv(params['period'], params['year'], params['month'])
+    return {}, (data, filename, 'text/csv')
+
+@app.route('/api/jobs', methods=['POST'])
+@login_required
+def api_submit_job():
+    """ジョブを登録する。JSON {kind, params} またはフォーム（kind, file）で受け付ける"""
+    if request.files:
+        kind = request.form.get('kind')
+        try:
+            params = json.loads(request.form.get('params') or '{}')
+        except ValueError:
+            return jsonify({'error': 'params がJSONとして読み込めません'}), 400
+        upload = request.files.get('file')
+    else:
+        payload = request.get_json(silent=True) or {}
+        kind = payload.get('kind')
+        params = payload.get('params') or {}
+        upload = None
+    if kind not in JOB_HANDLERS:
+        return jsonify({'error': f'不明なジョブの種類です: {kind}'}), 400
+    if not isinstance(params, dict):
+        return jsonify({'error': 'params はオブジェクトで指定してください'}), 400
+    if kind in ('import_items', 'restore_data') and upload is None:
+        return jsonify({'error': 'ファイルがありません'}), 400
+    job = submit_job(kind, params, upload)
+    return jsonify(job_to_dict(job)), 202
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def api_job(job_id):
+    return jsonify(job_to_dict(Job.query.get_or_404(job_id)))
+
+@app.route('/jobs/<int:job_id>/result')
+@login_required
+def job_result(job_id):
+    job = Job.query.get_or_404(job_id)
+    if job.status != 'done' or not job.result_file or not os.path.exists(job.result_file):
+        abort(404)
+    return send_file(job.result_file, as_attachment=True, download_name=job.result_name, mimetype=job.result_mimetype)
+
+@app.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    job = Job.query.get_or_404(job_id)
+    return render_template('job_status.html', job=job_to_dict(job))
+
 # 発注先の一括設定機能
 @app.route('/bulk_assign_supplier', methods=['GET', 'POST'])
 @login_required
@@ -1767,14 +4342,8 @@ def bulk_assign_supplier():
             supplier = Supplier.query.get_or_404(supplier_id)
             
             # 選択された備品に発注先を設定
-            updated_count = 0
-            for item_id in item_ids:
-                item = Item.query.get(item_id)
-                if item and item.supplier_id is None:
-                    item.supplier_id = supplier.id
-                    updated_count += 1
-            
-            db.session.commit()
+            updated_count = submit_write('assign_supplier', supplier_id=supplier.id,
+                                         item_ids=[int(item_id) for item_id in item_ids if item_id.isdigit()])
             flash(f'{updated_count}件の備品に「{supplier.name}」を発注先として設定しました', 'success')
             
             # 未設定の備品がなくなったらメイン画面に戻る
@@ -1792,18 +4361,86 @@ def bulk_assign_supplier():
                           suppliers=suppliers,
                           items_without_supplier=items_without_supplier)
 
+@write_operation('assign_supplier')
+def assign_supplier(supplier_id, item_ids):
+    """発注先が未設定の備品に発注先を一括で設定し、設定した件数を返す"""
+    return db.session.execute(
+        db.update(Item.__table__)
+        .where(Item.id.in_(item_ids), Item.supplier_id.is_(None))
+        .values(supplier_id=supplier_id)
+    ).rowcount
+
+@app.cli.command('compact-change-log')
+def compact_change_log_command():
+    """変更履歴を行ごとに最新の1件にまとめる"""
+    print(f'{compact_change_log()}件の古い変更履歴を削除しました')
+
+@app.cli.command('purge-usage-sync-keys')
+def purge_usage_sync_keys_command():
+    """保持期間を過ぎた使用記録APIの冪等キーを削除する"""
+    print(f'{purge_usage_sync_keys()}件の冪等キーを削除しました')
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """使用量・発注量の日別集計を履歴から作り直す"""
+    usage_rows, order_rows = rebuild_rollups()
+    print(f'日別集計を作り直しました（使用量 {usage_rows}行、発注量 {order_rows}行）')
+
+@app.cli.command('generate-pdfs')
+@click.option('--order-id', 'order_ids', type=int, multiple=True, help='出力する発注ID（省略時は未処理の発注すべて）')
+@click.option('--format', 'output_format', type=click.Choice(['zip', 'merged']), default='zip', help='ZIP または結合PDF')
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help='出力先ファイル')
+@click.option('--workers', type=int, default=None, help='並列に生成するプロセス数')
+def generate_pdfs_command(order_ids, output_format, output, workers):
+    """発注書をまとめて生成し、未処理のものを送信済みにする"""
+    order_ids = list(order_ids) or pending_order_ids()
+    if not order_ids:
+        print('出力する発注書がありません')
+        return
+    data, filename, mimetype, exported = build_order_sheets(order_ids, output_format, workers)
+    output = output or filename
+    with open(output, 'wb') as f:
+        f.write(data)
+    print(f'{len(exported)}件の発注書を {output} に出力しました')
+
+@app.cli.command('reorder-scan')
+def reorder_scan_command():
+    """最低在庫数以下の備品をまとめて未処理発注に追加する"""
+    result = submit_write('reorder_scan')
+    print(f"{result['items']}件の備品を{len(result['order_ids'])}件の発注に追加しました")
+
+@app.cli.command('suggest-minimum-stock')
+@click.option('--apply', 'apply_changes', is_flag=True, help='推奨値を最低在庫数に反映する')
+def suggest_minimum_stock_command(apply_changes):
+    """使用履歴から推奨最低在庫数を計算する"""
+    suggestions = minimum_stock_suggestions()
+    changes = {s['item_id']: s['suggested'] for s in suggestions if s['suggested'] != s['minimum_stock']}
+    for s in suggestions:
+        if s['item_id'] in changes:
+            print(f"{s['item_id']}\t{s['name']}\t{s['minimum_stock']} -> {s['suggested']}")
+    if apply_changes:
+        apply_minimum_stock(changes)
+        db.session.commit()
+        print(f'{len(changes)}件の備品の最低在庫数を更新しました')
+    else:
+        print(f'{len(changes)}件の備品で最低在庫数の見直しを推奨します（--apply で反映）')
+
 if __name__ == '__main__':
     with app.app_context():
         # データベースファイルの存在を確認
         db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'inventory.db')
-        if not os.path.exists(db_path):
-            # データベースファイルが存在しない場合のみテーブルを作成
-            db.create_all()
-            # 基本データの初期化（サプライヤーとクリニック情報）
-            if Supplier.query.count() == 0 and ClinicInfo.query.count() == 0:
-                from init_db import init_database
-                init_database()
-        else:
-            # 既存のデータベースファイルが存在する場合は必要に応じてマイグレーション
-            db.create_all()
+        is_new_db = not os.path.exists(db_path)
+        # テーブルを作成し、インデックス・トリガー・検索インデックスを追加（新規DBも既存DBも同じ）
+        db.create_all()
+        apply_schema_migrations()
+        # 新規DBの場合は基本データの初期化（サプライヤーとクリニック情報）
+        if is_new_db and Supplier.query.count() == 0 and ClinicInfo.query.count() == 0:
+            from init_db import init_database
+            init_database()
+    # 開発サーバーではジョブワーカーを同じプロセスのスレッドで動かす（リローダーの子プロセスのみ）
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        for job_queue in JOB_QUEUES:
+            threading.Thread(target=run_job_worker, kwargs={'queue': job_queue}, daemon=True).start()
+        if app.config['WRITE_QUEUE']:
+            threading.Thread(target=run_write_server, daemon=True).start()
     app.run(debug=True, host='0.0.0.0')
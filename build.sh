@@ -104,6 +104,9 @@ fi
 # データベースの初期化
 python init_db.py
 
+# 既存のデータベースに不足しているインデックスを追加
+python migrate_db.py
+
 # バックアップからデータを復元（バックアップが存在する場合）
 if [ -f "$BACKUP_FILE" ]; then
     echo "バックアップからデータを復元しています..."
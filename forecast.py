@@ -0,0 +1,59 @@
+"""
+需要予測のユーティリティモジュール
+備品×日の使用量行列から、全備品の推奨最低在庫数をまとめて計算します
+"""
+import numpy as np
+
+def add_demand(matrix, item_index, item_ids, day_offsets, quantities):
+    """(備品ID, 日のオフセット, 数量) の配列を 備品×日 の需要行列に加算する
+
+    item_index は昇順に並んだ備品IDの配列で、行列の行の並びと対応する。
+    item_ids はすべて item_index に含まれている必要がある。範囲外の日は無視する。
+    """
+    if len(item_ids) == 0:
+        return matrix
+    item_ids = np.asarray(item_ids, dtype=np.int64)
+    day_offsets = np.asarray(day_offsets, dtype=np.int64)
+    quantities = np.asarray(quantities, dtype=np.float64)
+    in_range = (day_offsets >= 0) & (day_offsets < matrix.shape[1])
+    rows = np.searchsorted(item_index, item_ids[in_range])
+    np.add.at(matrix, (rows, day_offsets[in_range]), quantities[in_range])
+    return matrix
+
+def add_items(matrix, item_index, item_ids):
+    """需要行列に新しい備品の行を追加し、(行列, 備品IDの配列) を返す"""
+    new_ids = np.setdiff1d(np.asarray(item_ids, dtype=np.int64), item_index)
+    if len(new_ids) == 0:
+        return matrix, item_index
+    merged = np.union1d(item_index, new_ids)
+    expanded = np.zeros((len(merged), matrix.shape[1]), dtype=np.float64)
+    expanded[np.searchsorted(merged, item_index)] = matrix
+    return expanded, merged
+
+def demand_statistics(matrix, moving_average_days, lead_time_days, service_level_z):
+    """需要行列から備品ごとの統計と推奨最低在庫数を一度に計算する
+
+    - mean: 期間全体の1日あたり平均使用量
+    - moving_average: 直近 moving_average_days 日の移動平均
+    - std: 1日あたり使用量の標準偏差（ばらつき）
+    - safety_stock: 安全在庫 = z × 標準偏差 × √リードタイム
+    - suggested: 推奨最低在庫数 = 移動平均 × リードタイム + 安全在庫（切り上げ）
+    """
+    items, days = matrix.shape
+    if items == 0 or days == 0:
+        empty = np.zeros(items)
+        return {'mean': empty, 'moving_average': empty, 'std': empty,
+                'safety_stock': empty, 'suggested': empty.astype(np.int64)}
+
+    mean = matrix.mean(axis=1)
+    window = min(moving_average_days, days)
+    # 累積和の差で末尾 window 日の移動平均を求める
+    cumulative = np.cumsum(matrix, axis=1)
+    previous = cumulative[:, -window - 1] if window < days else 0.0
+    moving_average = (cumulative[:, -1] - previous) / window
+    std = matrix.std(axis=1, ddof=1) if days > 1 else np.zeros(items)
+    safety_stock = service_level_z * std * np.sqrt(lead_time_days)
+    # 浮動小数点の誤差で1つ多く切り上げないよう丸めてから切り上げる
+    suggested = np.ceil(np.round(moving_average * lead_time_days + safety_stock, 6)).astype(np.int64)
+    return {'mean': mean, 'moving_average': moving_average, 'std': std,
+            'safety_stock': safety_stock, 'suggested': suggested}
@@ -0,0 +1,183 @@
+"""性能測定用のダミーデータを生成する
+
+実際の運用に近い件数（例: 備品5万件、発注先500件、患者5千人とそのセット、5年分・1千万件の使用記録）を
+現在のデータベースに一括で登録します。負荷試験（load_test.py）の前に実行してください。
+
+    python generate_data.py --reset
+    python generate_data.py --items 50000 --suppliers 500 --patients 5000 --usages 10000000 --years 5
+"""
+import random
+import time
+from datetime import datetime, timedelta
+
+import click
+
+from app import (app, db, Item, Supplier, Patient, PatientSet, ItemSet, SetItem, Usage, Order, OrderItem,
+                 ClinicInfo, apply_schema_migrations, rebuild_rollups)
+
+CHUNK_SIZE = 50000
+
+ITEM_NAMES = ['ガーゼ', '注射器', '翼状針', 'アルコール綿', '手袋', 'カテーテル', '輸液セット', '絆創膏',
+              '包帯', 'マスク', '採血管', '留置針', '消毒液', '吸引チューブ', '尿パッド', 'シリンジ']
+ITEM_SIZES = ['S', 'M', 'L', '5cm', '10cm', '2.5ml', '5ml', '10ml', '20G', '22G', '24G']
+
+def insert_rows(model, rows):
+    """行をまとめて登録し、追加された行のIDを返す"""
+    table = model.__table__
+    start = db.session.scalar(db.select(db.func.coalesce(db.func.max(table.c.id), 0)))
+    for offset in range(0, len(rows), CHUNK_SIZE):
+        db.session.execute(db.insert(table), rows[offset:offset + CHUNK_SIZE])
+    db.session.commit()
+    return db.session.scalars(db.select(table.c.id).where(table.c.id > start).order_by(table.c.id)).all()
+
+def popularity_weights(count, rng):
+    """よく使う備品ほど使用回数が多くなるよう、順位の逆数に比例した累積の重みを返す"""
+    ranks = list(range(1, count + 1))
+    rng.shuffle(ranks)
+    cumulative = []
+    total = 0.0
+    for rank in ranks:
+        total += 1.0 / rank
+        cumulative.append(total)
+    return cumulative
+
+def generate_masters(rng, items, suppliers, patients, sets_per_patient, item_sets, items_per_set):
+    supplier_ids = insert_rows(Supplier, [
+        {'name': f'発注先{n:04d}', 'fax_number': f'03-{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}',
+         'address': f'東京都千代田区{n % 9 + 1}-{n % 30 + 1}', 'email': f'order{n}@supplier.example.com'}
+        for n in range(1, suppliers + 1)
+    ])
+    click.echo(f'発注先: {len(supplier_ids)}件')
+
+    item_rows = []
+    for n in range(1, items + 1):
+        unit_type = rng.choice(['individual', 'box'])
+        item_rows.append({
+            'name': f'{rng.choice(ITEM_NAMES)} {rng.choice(ITEM_SIZES)} #{n:05d}',
+            'unit_type': unit_type,
+            'items_per_box': rng.choice([10, 20, 50, 100]) if unit_type == 'box' else None,
+            'minimum_stock': rng.randint(0, 20),
+            'current_stock': rng.randint(0, 100),
+            # 1割の備品は発注先未設定
+            'supplier_id': rng.choice(supplier_ids) if supplier_ids and rng.random() < 0.9 else None,
+        })
+    item_ids = insert_rows(Item, item_rows)
+    click.echo(f'備品: {len(item_ids)}件')
+
+    patient_ids = insert_rows(Patient, [
+        {'name': f'患者{n:05d}', 'patient_id': f'P{n:06d}', 'address': f'東京都新宿区{n % 9 + 1}-{n % 40 + 1}',
+         'phone': f'090-{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}'}
+        for n in range(1, patients + 1)
+    ])
+    click.echo(f'患者: {len(patient_ids)}件')
+
+    patient_set_ids = insert_rows(PatientSet, [
+        {'name': f'訪問セット{n + 1}', 'patient_id': patient_id}
+        for patient_id in patient_ids for n in range(sets_per_patient)
+    ])
+    item_set_ids = insert_rows(ItemSet, [
+        {'name': f'汎用セット{n:03d}', 'description': '負荷試験用のセット'} for n in range(1, item_sets + 1)
+    ])
+    set_items = []
+    for key, set_ids in (('patient_set_id', patient_set_ids), ('item_set_id', item_set_ids)):
+        for set_id in set_ids:
+            for item_id in rng.sample(item_ids, min(items_per_set, len(item_ids))):
+                set_items.append({'patient_set_id': None, 'item_set_id': None, key: set_id,
+                                  'item_id': item_id, 'quantity': rng.randint(1, 5)})
+    insert_rows(SetItem, set_items)
+    click.echo(f'患者セット: {len(patient_set_ids)}件、汎用セット: {len(item_set_ids)}件、セット内容: {len(set_items)}件')
+    return supplier_ids, item_ids, patient_ids
+
+def generate_usages(rng, count, years, item_ids, patient_ids, end):
+    """使用記録を古い順に登録する（日時順に追加するとインデックスの更新が速い）"""
+    if not count or not item_ids:
+        return
+    cumulative = popularity_weights(len(item_ids), rng)
+    span = timedelta(days=365 * years).total_seconds()
+    start = end - timedelta(seconds=span)
+    started = time.perf_counter()
+    table = Usage.__table__
+    for offset in range(0, count, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, count - offset)
+        # このチャンクが受け持つ期間の中で日時を散らす
+        chunk_start = span * offset / count
+        chunk_span = span * size / count
+        seconds = sorted(chunk_start + rng.random() * chunk_span for _ in range(size))
+        chosen = rng.choices(item_ids, cum_weights=cumulative, k=size)
+        db.session.execute(db.insert(table), [
+            {'item_id': item_id, 'quantity': rng.randint(1, 3), 'usage_date': start + timedelta(seconds=second),
+             # 7割は患者に紐づいた使用
+             'patient_id': rng.choice(patient_ids) if patient_ids and rng.random() < 0.7 else None}
+            for item_id, second in zip(chosen, seconds)
+        ])
+        db.session.commit()
+        done = offset + size
+        elapsed = time.perf_counter() - started
+        click.echo(f'\r使用記録: {done}/{count}件（{done / elapsed:.0f}件/秒）', nl=False)
+    click.echo()
+
+def generate_orders(rng, count, years, item_ids, end):
+    """過去の発注履歴を登録する（すべて受領済み）"""
+    if not item_ids:
+        return
+    items_by_supplier = {}
+    for item_id, supplier_id in db.session.execute(
+            db.select(Item.id, Item.supplier_id)
+            .where(Item.id.between(item_ids[0], item_ids[-1]), Item.supplier_id.is_not(None))):
+        items_by_supplier.setdefault(supplier_id, []).append(item_id)
+    if not count or not items_by_supplier:
+        return
+    suppliers = list(items_by_supplier)
+    span = timedelta(days=365 * years).total_seconds()
+    start = end - timedelta(seconds=span)
+    order_ids = insert_rows(Order, [
+        {'order_date': start + timedelta(seconds=second), 'supplier_id': rng.choice(suppliers), 'status': 'received'}
+        for second in sorted(rng.random() * span for _ in range(count))
+    ])
+    order_items = []
+    for order_id, supplier_id in db.session.execute(
+            db.select(Order.id, Order.supplier_id).where(Order.id >= order_ids[0]).order_by(Order.id)):
+        candidates = items_by_supplier[supplier_id]
+        for item_id in rng.sample(candidates, min(rng.randint(1, 5), len(candidates))):
+            order_items.append({'order_id': order_id, 'item_id': item_id, 'quantity': rng.randint(1, 10)})
+    insert_rows(OrderItem, order_items)
+    click.echo(f'発注: {len(order_ids)}件、発注明細: {len(order_items)}件')
+
+@click.command()
+@click.option('--items', default=50000, show_default=True, help='備品の件数')
+@click.option('--suppliers', default=500, show_default=True, help='発注先の件数')
+@click.option('--patients', default=5000, show_default=True, help='患者の人数')
+@click.option('--sets-per-patient', default=2, show_default=True, help='患者ごとの患者セット数')
+@click.option('--item-sets', default=100, show_default=True, help='汎用セットの件数')
+@click.option('--items-per-set', default=5, show_default=True, help='セットあたりの備品数')
+@click.option('--usages', default=10000000, show_default=True, help='使用記録の件数')
+@click.option('--orders', default=50000, show_default=True, help='過去の発注の件数')
+@click.option('--years', default=5, show_default=True, help='使用記録・発注履歴の期間（年）')
+@click.option('--seed', default=1, show_default=True, help='乱数のシード（同じ値なら同じデータになる）')
+@click.option('--reset', is_flag=True, help='既存のデータをすべて削除してから生成する')
+def generate_data(items, suppliers, patients, sets_per_patient, item_sets, items_per_set,
+                  usages, orders, years, seed, reset):
+    """性能測定用のダミーデータを生成する"""
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    with app.app_context():
+        if reset:
+            db.drop_all()
+        db.create_all()
+        apply_schema_migrations()
+        if ClinicInfo.query.count() == 0:
+            db.session.add(ClinicInfo(name='訪問診療クリニック', director='山田 太郎', fax='03-3333-4444'))
+            db.session.commit()
+
+        supplier_ids, item_ids, patient_ids = generate_masters(
+            rng, items, suppliers, patients, sets_per_patient, item_sets, items_per_set)
+        end = datetime.now().replace(microsecond=0)
+        generate_orders(rng, orders, years, item_ids, end)
+        generate_usages(rng, usages, years, item_ids, patient_ids, end)
+
+        usage_rows, order_rows = rebuild_rollups()
+        click.echo(f'日別集計: 使用量 {usage_rows}行、発注量 {order_rows}行')
+    click.echo(f'完了しました（{time.perf_counter() - started:.1f}秒）')
+
+if __name__ == '__main__':
+    generate_data()
@@ -1,6 +1,69 @@
+import glob
 import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
 
 bind = "0.0.0.0:10000"
 workers = multiprocessing.cpu_count() * 2 + 1
 worker_class = "sync"
 timeout = 120
+# アプリの読み込み・スキーマ確認・テンプレートのコンパイルはマスターで1回だけ行い、
+# ワーカーはフォークで引き継ぐ（コードの変更を反映するには再起動が必要）
+preload_app = True
+
+# メトリクスの共有ディレクトリ（各ワーカーが値を書き出し、/metrics で合算する）
+# 起動ごとに空のディレクトリから数え始める
+if os.environ.get('METRICS_DIR'):
+    os.makedirs(os.environ['METRICS_DIR'], exist_ok=True)
+    for path in glob.glob(os.path.join(os.environ['METRICS_DIR'], '*.json')):
+        os.remove(path)
+    metrics_dir_created = False
+else:
+    os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='inventory_metrics_')
+    metrics_dir_created = True
+
+# バックグラウンドジョブのワーカー（キューごとに1つ。JOB_WORKER=0 で起動しない）と
+# 書き込みを直列化するライター（WRITE_QUEUE=1 のときだけ起動する）
+helper_processes = []
+# preload_app ではマスターが wsgi.py を読み込み、その後に RENDER を設定するため、
+# 読み込み前の環境変数で起動してワーカーと同じデータベースを使わせる
+helper_env = dict(os.environ)
+
+def start_helper(server, script, *args):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+    process = subprocess.Popen([sys.executable, path, *args], env=helper_env)
+    helper_processes.append(process)
+    server.log.info("Started %s (pid: %s)", " ".join((script,) + args), process.pid)
+
+def when_ready(server):
+    if os.environ.get('WRITE_QUEUE', '0') == '1':
+        start_helper(server, 'writer.py')
+    if os.environ.get('JOB_WORKER', '1') != '0':
+        # 時間のかかる復元・インポートが他のジョブを待たせないよう、キューごとに別のプロセスで実行する
+        for queue in ('default', 'maintenance'):
+            start_helper(server, 'worker.py', queue)
+
+def pre_fork(server, worker):
+    worker.fork_started = time.monotonic()
+
+def post_worker_init(worker):
+    worker.log.info("Worker ready in %.3fs (pid: %s)", time.monotonic() - worker.fork_started, worker.pid)
+
+def child_exit(server, worker):
+    # 終了したワーカーのメトリクスを合算から外す
+    try:
+        os.remove(os.path.join(os.environ['METRICS_DIR'], f'{worker.pid}.json'))
+    except OSError:
+        pass
+
+def on_exit(server):
+    for process in helper_processes:
+        if process.poll() is None:
+            process.terminate()
+            process.wait(timeout=30)
+    if metrics_dir_created:
+        shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
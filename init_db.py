@@ -1,10 +1,12 @@
-from app import db, Supplier, ClinicInfo, app
+from app import db, Supplier, ClinicInfo, app, apply_schema_migrations
 
 def init_database():
     # アプリケーションコンテキストを設定
     with app.app_context():
         # データベーステーブルの作成
         db.create_all()
+        # インデックス・トリガー・検索インデックスの作成
+        apply_schema_migrations()
         
         # 基本的な発注先の追加
         if Supplier.query.count() == 0:
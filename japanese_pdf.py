@@ -7,9 +7,16 @@ from reportlab.pdfbase.cidfonts import UnicodeCIDFont
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import Paragraph
 
+# 登録済みの日本語スタイルシート（プロセスごとに1回だけ作成する）
+_japanese_styles = None
+
 # 日本語フォントを登録
 def setup_japanese_fonts():
-    """日本語フォントを登録する"""
+    """日本語フォントを登録する（2回目以降は登録済みのスタイルシートを返す）"""
+    global _japanese_styles
+    if _japanese_styles is not None:
+        return _japanese_styles
+    
     # 東アジア言語のサポートフォントを登録
     pdfmetrics.registerFont(UnicodeCIDFont('HeiseiKakuGo-W5'))
     pdfmetrics.registerFont(UnicodeCIDFont('HeiseiMin-W3'))
@@ -48,6 +55,7 @@ def setup_japanese_fonts():
         alignment=2  # 右揃え
     ))
     
+    _japanese_styles = styles
     return styles
 
 # 日本語テキストをParagraphでラップする
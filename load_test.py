@@ -0,0 +1,222 @@
+"""主要な操作を混ぜて gunicorn に負荷をかけ、ルートごとのスループットとレイテンシを計測する
+
+generate_data.py でデータを作り、gunicorn を起動してから実行します。
+対象のIDは同じデータベースから読み込むため、サーバーと同じ環境で実行してください。
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+    python load_test.py --users 16 --duration 60 --save baseline.json
+    python load_test.py --users 16 --duration 60 --compare baseline.json
+"""
+import http.cookiejar
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import click
+
+from app import app, db, Item, Patient, PatientSet, Order
+
+# 既定の操作の比率
+DEFAULT_MIX = {
+    'items': 30,
+    'use_item': 20,
+    'orders': 15,
+    'monthly_report': 15,
+    'use_patient_set': 10,
+    'generate_pdf': 10,
+}
+# ID を無作為に選ぶための上限（大きなテーブルでも読み込みを軽くする）
+SAMPLE_SIZE = 10000
+# 計測終了後に実行中のリクエストを待つ秒数
+STOP_TIMEOUT = 60
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """リダイレクト先までは計測しない（POST 後の一覧表示を含めないため）"""
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+class Client:
+    """仮想ユーザー1人分のセッション（ログイン済みのクッキーを持つ）"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect())
+
+    def request(self, path, data=None):
+        """リクエストを送り (ステータス, 本文, Location) を返す"""
+        body = urllib.parse.urlencode(data, doseq=True).encode() if data is not None else None
+        try:
+            with self.opener.open(self.base_url + path, body, timeout=120) as response:
+                return response.status, response.read(), response.headers.get('Location')
+        except urllib.error.HTTPError as e:
+            return e.code, e.read(), e.headers.get('Location')
+
+    def login(self):
+        status, _, _ = self.request('/login', {'username': 'tasuku', 'password': 'tasuku'})
+        if status not in (200, 302):
+            raise click.ClickException(f'ログインに失敗しました（ステータス {status}）')
+
+def sample_ids(rng, column):
+    ids = db.session.scalars(db.select(column)).all()
+    return rng.sample(ids, min(SAMPLE_SIZE, len(ids)))
+
+def load_targets(rng):
+    with app.app_context():
+        targets = {
+            'items': sample_ids(rng, Item.id),
+            'patients': sample_ids(rng, Patient.id),
+            'patient_sets': sample_ids(rng, PatientSet.id),
+            'orders': sample_ids(rng, Order.id),
+        }
+        db.session.remove()
+    for key in ('items', 'patient_sets', 'orders'):
+        if not targets[key]:
+            raise click.ClickException(f'{key} のデータがありません。先に generate_data.py を実行してください')
+    return targets
+
+def run_operation(client, name, rng, targets, record):
+    """操作を1回実行して記録する"""
+    if name == 'items':
+        request = (rng.choice(['/items', '/items?sort=name', '/items?below_minimum=1']), None)
+    elif name == 'orders':
+        request = ('/orders', None)
+    elif name == 'monthly_report':
+        today = time.localtime()
+        request = ('/monthly_report', {'period': rng.choice(['month', 'month', 'quarter', 'year']),
+                                       'year': today.tm_year - rng.randint(0, 4), 'month': rng.randint(1, 12)})
+    elif name == 'use_item':
+        item_ids = rng.sample(targets['items'], min(rng.randint(1, 5), len(targets['items'])))
+        data = {'item_id[]': item_ids, 'quantity[]': [rng.randint(1, 3) for _ in item_ids]}
+        if targets['patients'] and rng.random() < 0.7:
+            data['patient_id'] = rng.choice(targets['patients'])
+        request = ('/use_item', data)
+    elif name == 'use_patient_set':
+        request = (f"/use_patient_set/{rng.choice(targets['patient_sets'])}", {})
+    elif name == 'generate_pdf':
+        request = (f"/generate_pdf/{rng.choice(targets['orders'])}", None)
+    else:
+        raise click.ClickException(f'不明な操作です: {name}')
+
+    started = time.perf_counter()
+    status, _, _ = client.request(*request)
+    record(name, time.perf_counter() - started, status < 400)
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    # 最近傍順位法
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+def summarize(samples, errors, elapsed):
+    results = {}
+    for name in sorted(set(samples) | set(errors)):
+        latencies = sorted(samples.get(name, []))
+        count = len(latencies) + errors.get(name, 0)
+        results[name] = {
+            'count': count,
+            'errors': errors.get(name, 0),
+            'throughput': count / elapsed if elapsed else 0.0,
+            'p50': percentile(latencies, 0.50) * 1000,
+            'p95': percentile(latencies, 0.95) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+        }
+    return results
+
+def print_results(results, baseline=None):
+    click.echo(f"{'操作':<22}{'件数':>8}{'エラー':>8}{'件/秒':>9}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    for name, row in results.items():
+        line = (f"{name:<22}{row['count']:>8}{row['errors']:>8}{row['throughput']:>9.1f}"
+                f"{row['p50']:>10.1f}{row['p95']:>10.1f}{row['p99']:>10.1f}")
+        base = (baseline or {}).get(name)
+        if base and base['p95']:
+            # ベースラインとの比較（p95 とスループットの増減）
+            line += f"  p95 {(row['p95'] / base['p95'] - 1) * 100:+.0f}%"
+            if base['throughput']:
+                line += f" 件/秒 {(row['throughput'] / base['throughput'] - 1) * 100:+.0f}%"
+        click.echo(line)
+
+def parse_mix(value):
+    if not value:
+        return DEFAULT_MIX
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in DEFAULT_MIX:
+            raise click.BadParameter(f'不明な操作です: {name}（{", ".join(DEFAULT_MIX)}）')
+        mix[name.strip()] = int(weight or 1)
+    return mix
+
+@click.command()
+@click.option('--url', default='http://127.0.0.1:10000', show_default=True, help='gunicorn のURL')
+@click.option('--users', default=8, show_default=True, help='同時に操作する仮想ユーザー数')
+@click.option('--duration', default=60, show_default=True, help='計測時間（秒）')
+@click.option('--warmup', default=5, show_default=True, help='計測前に負荷をかける時間（秒）')
+@click.option('--mix', default=None, help='操作の比率（例: items=30,use_item=20）')
+@click.option('--seed', default=1, show_default=True, help='乱数のシード')
+@click.option('--save', type=click.Path(dir_okay=False), default=None, help='結果をJSONで保存する（ベースライン用）')
+@click.option('--compare', type=click.Path(exists=True, dir_okay=False), default=None, help='比較するベースラインのJSON')
+def load_test(url, users, duration, warmup, mix, seed, save, compare):
+    """主要な操作を混ぜて負荷をかけ、ルートごとのスループットとレイテンシを表示する"""
+    mix = parse_mix(mix)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    targets = load_targets(random.Random(seed))
+
+    lock = threading.Lock()
+    samples = {}
+    errors = {}
+    measuring = threading.Event()
+    stop = threading.Event()
+
+    def record(name, seconds, ok):
+        if not measuring.is_set():
+            return
+        with lock:
+            if ok:
+                samples.setdefault(name, []).append(seconds)
+            else:
+                errors[name] = errors.get(name, 0) + 1
+
+    def user(index):
+        rng = random.Random(seed * 1000 + index)
+        client = Client(url)
+        client.login()
+        while not stop.is_set():
+            run_operation(client, rng.choices(names, weights)[0], rng, targets, record)
+
+    threads = [threading.Thread(target=user, args=(index,), daemon=True) for index in range(users)]
+    for thread in threads:
+        thread.start()
+    click.echo(f'{url} に {users} ユーザーで負荷をかけています（ウォームアップ {warmup}秒、計測 {duration}秒）')
+    time.sleep(warmup)
+    measuring.set()
+    started = time.perf_counter()
+    time.sleep(duration)
+    measuring.clear()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=STOP_TIMEOUT)
+
+    results = summarize(samples, errors, elapsed)
+    total = sum(row['count'] for row in results.values())
+    baseline = None
+    if compare:
+        with open(compare, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+    click.echo(f'合計 {total}件（{total / elapsed:.1f}件/秒）')
+    if save:
+        with open(save, 'w', encoding='utf-8') as f:
+            json.dump({'url': url, 'users': users, 'duration': duration, 'mix': mix, 'results': results},
+                      f, ensure_ascii=False, indent=2)
+        click.echo(f'結果を {save} に保存しました')
+
+if __name__ == '__main__':
+    load_test()
@@ -0,0 +1,179 @@
+"""
+Prometheus形式のメトリクスを集計するユーティリティモジュール
+各プロセスが自分の値を METRICS_DIR のファイルに書き出し、/metrics で全プロセス分を合算します
+"""
+import atexit
+import json
+import os
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels, extra=None):
+    pairs = list(labels) + (list(extra) if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in pairs) + '}'
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+    """カウンターとヒストグラムをプロセス内に保持し、ファイル経由で合算する
+
+    directory が None の場合は自プロセスの値だけを返す（開発サーバー用）。
+    directory がある場合は、値が変わったときだけ flush_interval 秒ごとに
+    バックグラウンドのスレッドがファイルへ書き出す。
+    fork された子プロセスでは親の値を引き継がずに0から数える。
+    """
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.metrics = {}  # 名前 -> (種類, 説明, バケット)
+        self._reset()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.values = {}  # (名前, ラベル) -> 値 または [バケットごとの件数..., 合計, 件数]
+        self.dirty = False
+        self.flusher = None
+
+    def counter(self, name, help_text):
+        self.metrics[name] = ('counter', help_text, None)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.metrics[name] = ('histogram', help_text, tuple(buckets))
+
+    def _check_fork(self):
+        if os.getpid() != self.pid:
+            self._reset()
+
+    def _mark_dirty(self):
+        self.dirty = True
+        if self.directory and self.flusher is None:
+            self.flusher = threading.Thread(target=self._flush_loop, args=(self.pid,), daemon=True)
+            self.flusher.start()
+            atexit.register(self.flush)
+
+    def _flush_loop(self, pid):
+        while os.getpid() == pid:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def inc(self, name, labels=(), value=1):
+        with self.lock:
+            self._check_fork()
+            key = (name, tuple(labels))
+            self.values[key] = self.values.get(key, 0) + value
+            self._mark_dirty()
+
+    def observe(self, name, value, labels=()):
+        buckets = self.metrics[name][2]
+        with self.lock:
+            self._check_fork()
+            key = (name, tuple(labels))
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * len(buckets) + [0.0, 0]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+            self._mark_dirty()
+
+    def flush(self):
+        """前回の書き出し以降に値が変わっていればファイルに書き出す"""
+        if not self.directory:
+            return
+        with self.lock:
+            self._check_fork()
+            if not self.dirty:
+                return
+            self.dirty = False
+            data = [[name, [list(pair) for pair in labels], value] for (name, labels), value in self.values.items()]
+            # 書きかけのファイルを読まれないよう一時ファイルから置き換える
+            path = os.path.join(self.directory, f'{self.pid}.json')
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(path + '.tmp', path)
+
+    def _merged_values(self):
+        """全プロセスの値を合算する（自プロセスはファイルではなく最新の値を使う）
+
+        終了したプロセスのファイルは合算せずに削除する（max_requests で入れ替わった
+        ワーカーの値が残り続けないように）。
+        """
+        with self.lock:
+            self._check_fork()
+            merged = {key: (list(value) if isinstance(value, list) else value) for key, value in self.values.items()}
+        if not self.directory:
+            return merged
+        own_file = f'{self.pid}.json'
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json') or filename == own_file:
+                continue
+            pid = filename[:-len('.json')]
+            if not pid.isdigit():
+                continue
+            if not process_alive(int(pid)):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(os.path.join(self.directory, filename), encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in data:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                if isinstance(value, list):
+                    current = merged.setdefault(key, [0] * len(value))
+                    for index, item in enumerate(value):
+                        current[index] += item
+                else:
+                    merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def render(self, extra_lines=()):
+        """Prometheusのテキスト形式で出力する"""
+        merged = self._merged_values()
+        lines = []
+        for name, (kind, help_text, buckets) in self.metrics.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (metric_name, labels), value in sorted(merged.items(), key=lambda item: item[0]):
+                if metric_name != name:
+                    continue
+                if kind == 'counter':
+                    lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+                    continue
+                # バケットは「以下」の件数を記録しているのでそのまま累積値になる
+                for bound, count in zip(buckets, value):
+                    lines.append(f'{name}_bucket{format_labels(labels, [("le", format_value(float(bound)))])} {count}')
+                lines.append(f'{name}_bucket{format_labels(labels, [("le", "+Inf")])} {value[-1]}')
+                lines.append(f'{name}_sum{format_labels(labels)} {format_value(value[-2])}')
+                lines.append(f'{name}_count{format_labels(labels)} {value[-1]}')
+        lines.extend(extra_lines)
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,11 @@
+from app import app, db, apply_schema_migrations
+
+with app.app_context():
+    print('マイグレーション中...')
+    db.create_all()
+    created = apply_schema_migrations()
+    if created:
+        print(f'インデックスを追加しました: {", ".join(created)}')
+    else:
+        print('追加が必要なインデックスはありません')
+    print('マイグレーション完了')
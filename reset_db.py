@@ -1,6 +1,7 @@
-from app import app, db
+from app import app, db, apply_schema_migrations
 
 with app.app_context():
     print('データベース初期化中...')
     db.create_all()
+    apply_schema_migrations()
     print('データベース初期化完了')
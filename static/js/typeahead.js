@@ -0,0 +1,132 @@
+// 選択肢の検索
+// data-typeahead="items|patients|suppliers" を付けた select の前に検索欄を追加し、
+// 入力に応じて /api/typeahead から選択肢を読み込む。ページには選択中の選択肢だけを出力すればよい。
+(function() {
+    const DELAY = 200;
+    const PLACEHOLDERS = {
+        items: '備品名で検索',
+        patients: '患者名・患者IDで検索',
+        suppliers: '発注先名で検索'
+    };
+    const LABELS = {
+        items: function(row) {
+            return row.name + ' (在庫: ' + row.stock + (row.unit === 'box' ? ' 箱' : ' 個') + ')';
+        },
+        patients: function(row) {
+            return row.patient_id ? row.name + ' (' + row.patient_id + ')' : row.name;
+        },
+        suppliers: function(row) {
+            return row.name;
+        }
+    };
+
+    function attach(select) {
+        // 複製した行は検索欄も複製されているので追加しない
+        const previous = select.previousElementSibling;
+        if (previous && previous.classList.contains('typeahead-input')) {
+            return;
+        }
+        const input = document.createElement('input');
+        input.type = 'search';
+        input.className = 'form-control form-control-sm mb-1 typeahead-input';
+        input.placeholder = PLACEHOLDERS[select.dataset.typeahead] || '検索';
+        input.autocomplete = 'off';
+        select.parentNode.insertBefore(input, select);
+    }
+
+    function selectFor(input) {
+        const select = input.nextElementSibling;
+        return select && select.dataset.typeahead ? select : null;
+    }
+
+    function load(select, query) {
+        const kind = select.dataset.typeahead;
+        const token = (select.typeaheadToken || 0) + 1;
+        select.typeaheadToken = token;
+        select.typeaheadLoaded = true;
+        fetch('/api/typeahead/' + kind + '?q=' + encodeURIComponent(query), {credentials: 'same-origin'})
+            .then(function(response) { return response.json(); })
+            .then(function(result) {
+                // 後から送った検索の結果がすでに届いていれば捨てる
+                if (select.typeaheadToken !== token) {
+                    return;
+                }
+                const selected = select.value;
+                const placeholder = select.options[0] && select.options[0].value === '' ? select.options[0] : null;
+                const current = select.selectedIndex >= 0 && selected ? select.options[select.selectedIndex] : null;
+                select.innerHTML = '';
+                if (placeholder) {
+                    if (!placeholder.dataset.label) {
+                        placeholder.dataset.label = placeholder.textContent;
+                    }
+                    placeholder.textContent = query
+                        ? (result.data.length ? '-- ' + result.data.length + '件から選択 --' : '-- 該当なし --')
+                        : placeholder.dataset.label;
+                    select.appendChild(placeholder);
+                }
+                result.data.forEach(function(row) {
+                    if (String(row.id) === selected) {
+                        return;
+                    }
+                    const option = new Option(LABELS[kind](row), row.id);
+                    if (kind === 'items') {
+                        option.dataset.stock = row.stock;
+                        option.dataset.unit = row.unit;
+                    }
+                    select.appendChild(option);
+                });
+                // 選択中の値は検索結果になくても残す
+                if (current) {
+                    select.appendChild(current);
+                }
+                select.value = selected;
+            });
+    }
+
+    document.addEventListener('DOMContentLoaded', function() {
+        document.querySelectorAll('select[data-typeahead]').forEach(attach);
+
+        document.addEventListener('input', function(e) {
+            if (!e.target.classList.contains('typeahead-input')) {
+                return;
+            }
+            const input = e.target;
+            const select = selectFor(input);
+            if (!select) {
+                return;
+            }
+            clearTimeout(input.typeaheadTimer);
+            input.typeaheadTimer = setTimeout(function() {
+                load(select, input.value.trim());
+            }, DELAY);
+        });
+
+        // 最初に触れたときに先頭の選択肢を読み込む
+        document.addEventListener('focusin', function(e) {
+            let select = null;
+            if (e.target.classList.contains('typeahead-input')) {
+                select = selectFor(e.target);
+            } else if (e.target.dataset && e.target.dataset.typeahead) {
+                select = e.target;
+            }
+            if (select && !select.typeaheadLoaded) {
+                const input = select.previousElementSibling;
+                load(select, input && input.classList.contains('typeahead-input') ? input.value.trim() : '');
+            }
+        });
+
+        // 検索欄で Enter を押したら最初の候補を選択する（フォームは送信しない）
+        document.addEventListener('keydown', function(e) {
+            if (e.key !== 'Enter' || !e.target.classList.contains('typeahead-input')) {
+                return;
+            }
+            e.preventDefault();
+            const select = selectFor(e.target);
+            const first = select && Array.from(select.options).find(function(option) { return option.value; });
+            if (first) {
+                select.value = first.value;
+                select.dispatchEvent(new Event('change', {bubbles: true}));
+            }
+        });
+    });
+})();
@@ -0,0 +1,16 @@
+"""バックグラウンドジョブのワーカー
+
+gunicorn.conf.py からキューごとに gunicorn と並んで起動される。単独で起動する場合:
+    python worker.py               # すべてのキューのジョブを1つのワーカーで実行
+    python worker.py default       # PDF作成・レポート出力
+    python worker.py maintenance   # 復元・インポート
+"""
+import sys
+
+from app import JOB_QUEUES, run_job_worker
+
+if __name__ == '__main__':
+    queue = sys.argv[1] if len(sys.argv) > 1 else None
+    if queue is not None and queue not in JOB_QUEUES:
+        sys.exit(f'不明なキューです: {queue}（{", ".join(JOB_QUEUES)}）')
+    run_job_worker(queue=queue)
@@ -0,0 +1,9 @@
+"""書き込みを直列化するライタープロセス
+
+WRITE_QUEUE=1 のとき、gunicorn.conf.py から gunicorn と並んで起動される。単独で起動する場合:
+    WRITE_QUEUE=1 python writer.py
+"""
+from app import run_write_server
+
+if __name__ == '__main__':
+    run_write_server()
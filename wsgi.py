@@ -1,17 +1,21 @@
 import os
-from app import app, db
+import time
+
+started = time.perf_counter()
+from app import app, STARTUP_TIMES, prepare_for_workers
+STARTUP_TIMES['import'] = time.perf_counter() - started
 
 # Render環境変数の設定
 os.environ['RENDER'] = 'true'
 
-# アプリケーション起動前にデータベースの初期化を確認
-with app.app_context():
-    try:
-        # データベースファイルが存在しなければ作成
-        db.create_all()
-        print("データベースの初期化を確認しました")
-    except Exception as e:
-        print(f"データベース初期化エラー: {e}")
+# アプリケーション起動前にデータベースの初期化を確認し、テンプレートをコンパイルしておく
+# （gunicorn.conf.py の preload_app により、マスターで1回だけ実行されワーカーに引き継がれる）
+try:
+    prepare_for_workers()
+    print("データベースの初期化を確認しました")
+except Exception as e:
+    print(f"データベース初期化エラー: {e}")
+print('起動時間: ' + ', '.join(f'{phase} {seconds:.2f}秒' for phase, seconds in STARTUP_TIMES.items()))
 
 if __name__ == "__main__":
     app.run(debug=False, host='0.0.0.0')